@@ -47,5 +47,9 @@ if __name__ == "__main__":
     # context.load_cert_chain('kanabi/certs/server.crt', 'kanabi/certs/server.key')
     # app.run(debug=True, host='127.0.0.1', port=443, ssl_context=context)
 
+    # connect to the database in the background; /ready reports when it is up
+    import kanabi.driver as driver
+    driver.start()
+
     context = ('./kanabi/configs/cert.pem', './kanabi/configs/key.pem')
     app.run(host='0.0.0.0', port=443, ssl_context=context, threaded=True, debug=True)
@@ -0,0 +1,57 @@
+"""
+gunicorn settings of the production server:
+    gunicorn -c gunicorn.conf.py wsgi:app
+The app is loaded once in the master (preload_app) and shared by the workers it forks. Each worker keeps its own
+database connections, caches and upload job pool; the master closes its connections before forking, so that no two
+processes share a socket, and every worker reconnects on first use.
+Settings can be overridden with the environment variables below.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('KANABI_BIND', '0.0.0.0:443')
+workers = int(os.environ.get('KANABI_WORKERS', multiprocessing.cpu_count()))
+# requests stream large exports and wait on the database, so each worker serves several at once
+worker_class = 'gthread'
+threads = int(os.environ.get('KANABI_THREADS', 4))
+preload_app = True
+# uploads can take minutes to be sent and saved; a worker that is asked to stop finishes them, and the upload jobs
+# it is running, for up to this many seconds before it is killed
+graceful_timeout = int(os.environ.get('KANABI_GRACEFUL_TIMEOUT', 300))
+timeout = 120
+# restart workers now and then, staggered, to bound the memory a long-running worker collects
+max_requests = 1000
+max_requests_jitter = 100
+certfile = './kanabi/configs/cert.pem'
+keyfile = './kanabi/configs/key.pem'
+accesslog = '-'
+
+# seconds of graceful_timeout kept back from draining upload jobs, for closing connections and exiting
+drain_margin = 10
+
+
+def pre_fork(server, worker):
+    # workers make their own connections; the master must not hand down any it made while loading the app
+    import kanabi.driver as driver
+    driver.close_connections()
+
+
+def post_worker_init(worker):
+    # connect in the background, so that the worker serves /ready and the like while the database comes up
+    import kanabi.driver as driver
+    driver.start()
+    # the first worker resumes the uploads left unfinished when the server last stopped; the master can't, as its
+    # job pool would not be forked along with the workers
+    if worker.age == 1:
+        from kanabi.jobs import jobs
+        jobs.resume()
+
+
+def worker_exit(server, worker):
+    # in-flight requests are done by now; wait for the upload jobs this worker started before closing its
+    # connections. Jobs still running when the time is up are resumed by the next server start.
+    import kanabi.driver as driver
+    from kanabi.jobs import jobs
+    if not jobs.drain(max(0, graceful_timeout - drain_margin)):
+        server.log.warning('Worker %s stopped with upload jobs unfinished', worker.pid)
+    driver.close_connections()
@@ -6,6 +6,7 @@ from .user import User
 from .configure import db
 from .responses import make_gui_response
 from .driver import create_db_user
+from .metrics import metrics
 
 
 auth_bp = Blueprint('auth_bp', __name__)
@@ -52,10 +53,11 @@ def login():
     remember = True if req.get('remember') else False
     if email is None or password is None:
         return make_gui_response(json_header, 400, 'email and password must be supplied in login request')
-    user = fetch_user(email)
-
-    # Check if user actually exists and compare provided and stored password hashes
-    if not user or not check_password_hash(user.password, password):
+    with metrics.timer('authenticate'):
+        user = fetch_user(email)
+        # Check if user actually exists and compare provided and stored password hashes
+        valid = user is not None and check_password_hash(user.password, password)
+    if not valid:
         # Reload page if user doesn't exist or the password was incorrect
         return make_gui_response(json_header, 400, 'Invalid Credentials')
 
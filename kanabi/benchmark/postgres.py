@@ -0,0 +1,150 @@
+import os
+import shlex
+import socket
+import subprocess
+import time
+import uuid
+from configparser import ConfigParser
+
+import psycopg2
+
+from kanabi.db.dbConfig import default_config
+
+schema_file = 'kanabi/db/db-create.sql'
+# tables emptied between benchmark runs; their row sequences start over
+data_tables = ['intake', 'violations', 'reports', 'metadata', 'txn_history', 'archive']
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class DisposablePostgres:
+    """
+    A Postgres container for one benchmark session, set up with db-create.sql in the same way as the docker-compose
+    database, and removed afterwards. Its settings are written to a database.ini of its own, which the driver reads
+    when KANABI_DB_CONFIG names it.
+    Usage:
+        with DisposablePostgres(workdir) as server:
+            os.environ['KANABI_DB_CONFIG'] = server.config_file
+            ...
+    """
+    image = 'postgres:12.2'
+    user = 'kanabiadmin'
+    password = 'password'
+    dbname = 'kanabi'
+
+    def __init__(self, workdir, docker='docker', image=None):
+        """
+        Args:
+            workdir (str): directory to write the database.ini into
+            docker (str): command that runs Docker, e.g. 'sudo docker'
+            image (str): Postgres image; that of docker-compose.yml if not given
+        """
+        self.workdir = workdir
+        self.docker = shlex.split(docker)
+        self.image = image or self.image
+        self.name = f'kanabi-benchmark-{uuid.uuid4().hex[:8]}'
+        self.port = None
+        self.config_file = os.path.join(workdir, 'database.ini')
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def params(self):
+        """
+        Returns (dict): keyword arguments for psycopg2.connect
+        """
+        return {'dbname': self.dbname, 'user': self.user, 'password': self.password, 'host': '127.0.0.1',
+                'port': self.port, 'sslmode': 'disable'}
+
+    def start(self, timeout=120):
+        """
+        Starts the container and waits until the schema is in place.
+        Args:
+            timeout (int): seconds to wait for the database
+        Returns: None
+        """
+        self.port = _free_port()
+        subprocess.run(self.docker + [
+            'run', '-d', '--rm', '--name', self.name,
+            '-e', f'POSTGRES_USER={self.user}', '-e', f'POSTGRES_PASSWORD={self.password}',
+            '-e', f'POSTGRES_DB={self.dbname}',
+            '-p', f'127.0.0.1:{self.port}:5432',
+            '-v', f'{os.path.abspath(schema_file)}:/docker-entrypoint-initdb.d/init.sql:ro',
+            self.image,
+        ], check=True, stdout=subprocess.DEVNULL)
+        try:
+            self._wait(timeout)
+        except Exception:
+            self.stop()
+            raise
+        write_config(self.config_file, self.params())
+
+    def _wait(self, timeout):
+        # the image runs init.sql on a server that only listens on its socket, so a TCP connection that finds the
+        # intake table means the database is ready
+        deadline = time.monotonic() + timeout
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(connect_timeout=2, **self.params())
+                with conn.cursor() as cur:
+                    cur.execute("SELECT to_regclass('public.intake')")
+                    if cur.fetchone()[0] is not None:
+                        return
+            except psycopg2.OperationalError:
+                pass
+            finally:
+                if conn is not None:
+                    conn.close()
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Postgres container {self.name} was not ready after {timeout} seconds')
+            time.sleep(1)
+
+    def stop(self):
+        """
+        Removes the container and its data.
+        Returns: None
+        """
+        subprocess.run(self.docker + ['rm', '-f', self.name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def write_config(filename, params):
+    """
+    Writes a database.ini for a benchmark database: the [postgresql] section holds its connection settings, and the
+    other sections are copied from the default database.ini with query logging turned off.
+    Args:
+        filename (str): file to write
+        params (dict): connection settings
+    Returns: None
+    """
+    parser = ConfigParser()
+    parser.read(default_config)
+    parser['postgresql'] = {key: str(value) for key, value in params.items()}
+    if parser.has_section('querylog'):
+        parser['querylog']['path'] = ''
+    with open(filename, 'w') as f:
+        parser.write(f)
+
+
+def reset_tables(params):
+    """
+    Empties the tables the benchmark writes to, so that every run starts from the same state.
+    Args:
+        params (dict): keyword arguments for psycopg2.connect
+    Returns: None
+    """
+    conn = psycopg2.connect(**params)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"TRUNCATE {', '.join(data_tables)} RESTART IDENTITY CASCADE")
+        conn.commit()
+    finally:
+        conn.close()
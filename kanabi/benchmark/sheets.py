@@ -0,0 +1,221 @@
+import csv
+import os
+import random
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook
+
+from kanabi.models.IntakeRow import intake_headers
+from kanabi.readers import na_values
+from kanabi.validation.intake_validation import license_types, valid_compliance_regions, valid_endorsements, \
+    validNeighborhoods
+
+sheet_formats = ['xlsx', 'csv']
+
+violations_headers = ['DBA', 'Address', 'MRL#', 'License Type', 'Violation sent date', 'Original Violation Amount',
+                      'Admin Rvw Decision Date', 'Admin Rvw Violation Amount', 'Certified #',
+                      'Certified receipt returned', 'Date paid/ Waived', 'Receipt No.', 'Cash Amount', 'Check Amount',
+                      'Card Amount', 'Check No. / Approval Code', 'Notes']
+reports_headers = ['Date', 'Method', 'Intake Person', 'RP (Name)', 'RP (Contact Info)', 'Concern', 'Location Name',
+                   'Location Address', 'MRL?', 'Action Taken', 'Status', 'Status Date', 'Additional Notes']
+
+first_names = ['Randa', 'Donald', 'Christopher', 'Maria', 'Aisha', 'Kenji', 'Olga', 'Samuel', 'Priya', 'Lucas']
+last_names = ['Shahin', 'Morse', 'Olson', 'Garcia', 'Nguyen', 'Tanaka', 'Ivanova', 'Okafor', 'Patel', 'Silva']
+street_names = ['Pacific St.', 'Barbur Blvd.', 'Halsey St.', 'Sandy Blvd.', 'Powell Blvd.', 'Division St.',
+                'Burnside St.', 'Hawthorne Blvd.', 'Alberta St.', 'Belmont St.']
+directions = ['N', 'NE', 'NW', 'SE', 'SW']
+business_words = ['Green', 'Leaf', 'Rose', 'City', 'Harvest', 'Cascade', 'River', 'Summit', 'Bud', 'Grove']
+concerns = ['Odor coming from the business.', 'Customers smoking in the parking lot.', 'Sign too close to a school.',
+            'Traffic and double parking on the street.', 'Open after hours.']
+# values that read back as blank cells are left out
+neighborhoods = [name for name in validNeighborhoods if name not in na_values]
+regions = [region for region in valid_compliance_regions if region != 'NAN']
+first_day = datetime(2015, 12, 1)
+
+
+def _business(rng):
+    return f'{rng.choice(business_words)} {rng.choice(business_words)}'
+
+
+def _address(rng):
+    return f'{rng.randint(100, 19999)} {rng.choice(directions)} {rng.choice(street_names)}'
+
+
+def _phone(rng):
+    return f'503-{rng.randint(200, 999)}-{rng.randint(0, 9999):04d}'
+
+
+def _day(rng):
+    return first_day + timedelta(days=rng.randint(0, 1800))
+
+
+def intake_row(n, rng):
+    """
+    Makes up an intake row that passes validate_intake.
+    Args:
+        n (int): row number, which also makes the MRL unique
+        rng (random.Random): source of the values
+    Returns ([]): the row number followed by a value for each of intake_headers
+    """
+    first, last = rng.choice(first_names), rng.choice(last_names)
+    amounts = [None, None, None]
+    paid_by = rng.randrange(3)
+    amounts[paid_by] = f'${rng.choice([975, 1000, 1500, 3000])}'
+    mrl = f'MRL{n}'
+    return [
+        n,
+        _day(rng).strftime('%m/%d/%y'),
+        f'{_business(rng)} Holdings, LLC',
+        _business(rng),
+        _address(rng),
+        f'#{rng.randint(1, 400)}' if rng.random() < 0.3 else None,
+        rng.randint(97201, 97299),
+        _address(rng) + ', Portland, OR',
+        mrl,
+        rng.choice(neighborhoods),
+        rng.choice(regions),
+        first,
+        last,
+        f'{first}.{last}{n}@example.com'.lower(),
+        _phone(rng),
+        ','.join(rng.sample(valid_endorsements, rng.randint(1, 2))) if rng.random() < 0.4 else None,
+        ('DRE-' if rng.random() < 0.5 else '') + rng.choice(license_types),
+        rng.choice(['Y', 'N', None]),
+        rng.choice(['Y', None]),
+        rng.randint(2015, 2020),
+        rng.randint(1, 999999),
+    ] + amounts + [
+        f'{rng.randint(10, 99)}-{rng.randint(100000000, 999999999)}' if paid_by > 0 else None,
+        mrl,
+        'Renewal' if rng.random() < 0.1 else None,
+    ]
+
+
+def violations_row(n, rng):
+    """
+    Makes up a violations row.
+    Args:
+        n (int): position of the row
+        rng (random.Random): source of the values
+    Returns ([]): a value for each of violations_headers
+    """
+    sent = _day(rng)
+    amount = rng.choice([1000, 2500, 5000])
+    reviewed = rng.random() < 0.2
+    paid = rng.random() < 0.6
+    return [
+        _business(rng),
+        _address(rng),
+        f'MRL{rng.randint(1, max(n, 1))}',
+        rng.choice(license_types),
+        sent,
+        amount,
+        sent + timedelta(days=rng.randint(10, 90)) if reviewed else None,
+        amount // 2 if reviewed else None,
+        f'{rng.randint(10 ** 9, 10 ** 10 - 1)}' if rng.random() < 0.5 else None,
+        rng.choice(['Y', 'N', None]),
+        sent + timedelta(days=rng.randint(10, 300)) if paid else None,
+        rng.randint(1, 99999) if paid else None,
+        None,
+        amount if paid else None,
+        None,
+        rng.randint(10 ** 8, 10 ** 9 - 1) if paid else None,
+        'never paid violation' if not paid and rng.random() < 0.3 else None,
+    ]
+
+
+def reports_row(n, rng):
+    """
+    Makes up a reports row.
+    Args:
+        n (int): position of the row
+        rng (random.Random): source of the values
+    Returns ([]): a value for each of reports_headers
+    """
+    reported = _day(rng)
+    return [
+        reported,
+        rng.choice(['Phone', 'Email', 'Walk-in']),
+        rng.choice(first_names) if rng.random() < 0.5 else None,
+        f'{rng.choice(first_names)} {rng.choice(last_names)}',
+        _phone(rng),
+        rng.choice(concerns),
+        _business(rng),
+        _address(rng),
+        rng.randint(1, max(n, 1)),
+        rng.choice(['Information', 'Inspection', 'Warning']),
+        rng.choice(['Open', 'Closed']),
+        (reported + timedelta(days=rng.randint(1, 120))).strftime('%m/%d/%Y'),
+        None,
+    ]
+
+
+# table -> (header row, row maker); intake sheets lead with an unnamed row number column, like the samples
+sheets = {
+    'intake': ([None] + intake_headers, intake_row),
+    'violations': (violations_headers, violations_row),
+    'reports': (reports_headers, reports_row),
+}
+
+
+def generate_rows(table, rows, seed=0):
+    """
+    Args:
+        table (str): intake, violations or reports
+        rows (int): number of rows
+        seed (int): seed of the values; the same seed gives the same rows
+    Returns (generator): the rows of a synthetic sheet for the table, without the header
+    """
+    rng = random.Random(f'{table}-{seed}')
+    make_row = sheets[table][1]
+    for n in range(1, rows + 1):
+        yield make_row(n, rng)
+
+
+def write_sheet(table, rows, path, seed=0):
+    """
+    Writes a synthetic sheet for a table, as .xlsx or .csv according to the extension of path. Workbooks are written
+    in openpyxl's write-only mode, which streams rows to the file.
+    Args:
+        table (str): intake, violations or reports
+        rows (int): number of rows
+        path (str): file to write
+        seed (int): seed of the values
+    Returns (str): path
+    """
+    header = sheets[table][0]
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['' if name is None else name for name in header])
+            for row in generate_rows(table, rows, seed):
+                writer.writerow(['' if value is None else value for value in row])
+        return path
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(header)
+    for row in generate_rows(table, rows, seed):
+        sheet.append(row)
+    workbook.save(path)
+    return path
+
+
+def sheet_path(workdir, table, rows, sheet_format='xlsx', seed=0):
+    """
+    Returns the path of a synthetic sheet in workdir, writing the sheet first unless an earlier run already did.
+    Args:
+        workdir (str): directory the sheets are kept in
+        table (str): intake, violations or reports
+        rows (int): number of rows
+        sheet_format (str): xlsx or csv
+        seed (int): seed of the values
+    Returns (str): the path
+    """
+    os.makedirs(workdir, exist_ok=True)
+    path = os.path.join(workdir, f'{table}-{rows}-{seed}.{sheet_format}')
+    if not os.path.exists(path):
+        # written under a temporary name, so that an interrupted run leaves no partial sheet behind
+        partial = path + '.partial.' + sheet_format
+        write_sheet(table, rows, partial, seed)
+        os.replace(partial, path)
+    return path
@@ -0,0 +1,392 @@
+"""
+Benchmark suite for the ingestion, query and export paths. Generates synthetic intake, violations and reports sheets
+that pass validation, loads them into a throwaway Postgres, and times process_file, validate_intake, filter_table
+with representative query trees, get_table and the /export streams. The throughput and peak memory of each case are
+appended to a JSON history, and compared with the last run of the same size, so that regressions show up between
+commits.
+Usage:
+    python -m kanabi.benchmark.suite [--rows N [N ...]] [--format xlsx|csv] [--repeat R] [--cases NAME ...]
+        [--config INI] [--docker CMD] [--workdir DIR] [--history FILE] [--label TEXT]
+Without --config, a postgres:12.2 container is started for the session (Docker is required) and removed afterwards.
+With --config, the database named in that database.ini is used instead; its data tables are emptied before every
+size, so never point it at a database whose data matters. Sheets are kept in the work directory and reused by later
+runs of the same size and format.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from kanabi.db.dbConfig import config_env, pgSqlConfig
+from .postgres import DisposablePostgres, reset_tables
+from .sheets import sheet_formats, sheet_path
+
+default_rows = [1000, 10000]
+default_workdir = 'kanabi/benchmark/data'
+default_history = 'kanabi/benchmark/history.json'
+tables = ['intake', 'violations', 'reports']
+# a throughput change beyond this fraction of the previous run's is reported as a regression or improvement
+change_threshold = 0.1
+
+
+def filter_queries(rows):
+    """
+    Args:
+        rows (int): number of rows in the intake table
+    Returns (OrderedDict): name -> filter request, covering point lookups, typed comparisons, boolean trees, pattern
+        matches and paging
+    """
+    return OrderedDict([
+        ('mrl_equals', {'table': 'intake', 'columns': ['dba', 'mrl'],
+                        'where': {'column': 'mrl', 'op': '=', 'operand': f'MRL{max(rows // 2, 1)}'}}),
+        ('amount_and_zip', {'table': 'intake', 'columns': ['mrl', 'cash_amount', 'facility_zip'],
+                            'where': {'and': [{'column': 'cash_amount', 'op': '>', 'operand': 1000},
+                                              {'column': 'facility_zip', 'op': '<', 'operand': 97250}]}}),
+        ('date_or_region', {'table': 'intake', 'columns': ['entity', 'mrl', 'submission_date'],
+                            'where': {'or': [{'column': 'submission_date', 'op': '<', 'operand': '1/1/2016'},
+                                             {'and': [{'column': 'compliance_region', 'op': '=', 'operand': 'SW'},
+                                                      {'column': 'row', 'op': '<', 'operand': rows // 10}]}]}}),
+        ('dba_ilike', {'table': 'intake', 'columns': ['dba', 'mrl'],
+                       'where': {'column': 'dba', 'op': 'ilike', 'operand': '%grove%'}}),
+        ('paged', {'table': 'intake', 'columns': ['mrl', 'dba', 'submission_date'],
+                   'order_by': [{'column': 'submission_date', 'direction': 'desc'}], 'limit': 100}),
+    ])
+
+
+def benchmark_user():
+    """
+    Returns (JobUser): the user the driver connects as: the benchmark database's owner
+    """
+    from kanabi.jobs import JobUser
+    params = pgSqlConfig()
+    return JobUser(params['user'], params['password'])
+
+
+def best_time(run, repeat):
+    """
+    Args:
+        run (function): the work to time; returns the number of rows it handled
+        repeat (int): number of runs
+    Returns ((float, int)): seconds taken by the fastest run, and the rows it handled
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = run()
+        seconds = time.perf_counter() - started
+        if best is None or seconds < best[0]:
+            best = (seconds, rows)
+    return best
+
+
+def case_validate_intake(files, rows, repeat):
+    from kanabi.readers import reader_for
+    from kanabi.validation.intake_validation import validate_intake
+    # the file is read beforehand, so that only validation is timed
+    with reader_for(files['intake']) as reader:
+        frames = list(reader.batches())
+    invalid = []
+
+    def run():
+        invalid.clear()
+        for df in frames:
+            _, errors = validate_intake(df.copy())
+            invalid.extend(errors or {})
+        return sum(len(df) for df in frames)
+
+    seconds, handled = best_time(run, repeat)
+    return {'seconds': seconds, 'rows': handled, 'invalid_rows': len(invalid)}
+
+
+def case_process_file(table):
+    def case(files, rows, repeat):
+        import kanabi.driver as driver
+        # loads the table for the cases that follow, so it runs once whatever the repeat count
+        started = time.perf_counter()
+        success, report = driver.process_file(table, files[table], benchmark_user())
+        seconds = time.perf_counter() - started
+        return {'seconds': seconds, 'rows': report['insertions_attempted'],
+                'failed_rows': report['insertions_attempted'] - report['insertions_successful']}
+    return case
+
+
+def case_filter_table(name):
+    def case(files, rows, repeat):
+        import kanabi.driver as driver
+        user = benchmark_user()
+        request = filter_queries(rows)[name]
+
+        def run():
+            query, response, status = driver.filter_table(request, user)
+            if status != 200:
+                raise RuntimeError(f'Filter {name} failed: {response}')
+            if 'limit' not in request:
+                return len(response)
+            # follow the pages, as a client scrolling through the results would
+            handled = 0
+            for _ in range(20):
+                handled += len(response['results'])
+                if response['next'] is None:
+                    break
+                query, response, status = driver.filter_table(dict(request, after=response['next']), user)
+            return handled
+
+        seconds, handled = best_time(run, repeat)
+        return {'seconds': seconds, 'rows': handled}
+    return case
+
+
+def case_get_table(files, rows, repeat):
+    import kanabi.driver as driver
+    user = benchmark_user()
+    seconds, handled = best_time(lambda: len(driver.get_table('intake', None, user)), repeat)
+    return {'seconds': seconds, 'rows': handled}
+
+
+def case_export(export_format):
+    def case(files, rows, repeat):
+        # the functions GET /export runs, without the HTTP layer and the result cache in front of them
+        import kanabi.driver as driver
+        from kanabi.server import ndjson_chunks
+        from kanabi.writers import parquet_available, parquet_chunks, parquet_row_group_size
+        if export_format == 'parquet' and not parquet_available():
+            return None
+        user = benchmark_user()
+        query, params = driver.export_query({'table': 'intake'})
+        size = []
+
+        def counted(chunks, counter):
+            for chunk in chunks:
+                counter[0] += len(chunk)
+                yield chunk
+
+        def run():
+            if export_format == 'csv':
+                # the synthetic values hold no line breaks, so every line but the header is a row
+                data = b''.join(driver.copy_csv(query, params, user))
+                size[:] = [len(data)]
+                return data.count(b'\n') - 1
+            chunk_size = parquet_row_group_size if export_format == 'parquet' else driver.stream_chunk_size
+            description, chunks = driver.stream_query(query, params, user, chunk_size)
+            counter = [0]
+            if export_format == 'parquet':
+                pieces = parquet_chunks(description, counted(chunks, counter))
+            else:
+                pieces = ndjson_chunks([column.name for column in description], counted(chunks, counter))
+            size[:] = [sum(len(piece) for piece in pieces)]
+            return counter[0]
+
+        seconds, handled = best_time(run, repeat)
+        return {'seconds': seconds, 'rows': handled, 'bytes': size[0]}
+    return case
+
+
+def all_cases():
+    """
+    Returns (OrderedDict): case name -> function(files, rows, repeat) returning its measurements, in the order they
+        run; the process_file cases load the tables that the later cases read
+    """
+    cases = OrderedDict([('validate_intake', case_validate_intake)])
+    for table in tables:
+        cases[f'process_file:{table}'] = case_process_file(table)
+    for name in filter_queries(1):
+        cases[f'filter_table:{name}'] = case_filter_table(name)
+    cases['get_table:intake'] = case_get_table
+    for export_format in ['csv', 'ndjson', 'parquet']:
+        cases[f'export:{export_format}'] = case_export(export_format)
+    return cases
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _run_case(name, files, rows, repeat, results):
+    try:
+        import kanabi.driver as driver
+        # connect and read the schema first, so that neither counts in the baseline or the timings
+        if not driver.reconnectDB():
+            raise ConnectionError(driver.connection_error_msg)
+        driver.catalog.schema()
+        baseline = _max_rss_mb()
+        measured = all_cases()[name](files, rows, repeat)
+        if measured is not None:
+            measured['baseline_rss_mb'] = baseline
+            measured['peak_rss_mb'] = _max_rss_mb()
+        results.put(measured)
+    except Exception as err:
+        results.put({'error': f'{type(err).__name__}: {err}'})
+
+
+def run_case(name, files, rows, repeat):
+    """
+    Runs a case in a fresh process, so that its peak memory is its own and no state carries over from other cases.
+    Args:
+        name (str): case name, from all_cases
+        files (dict): table -> sheet to load
+        rows (int): number of rows in each sheet
+        repeat (int): runs of the timed work; the fastest is kept
+    Returns (dict): seconds, rows, rows_per_second and peak_rss_mb, or error; None if the case can't run here
+    """
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    process = ctx.Process(target=_run_case, args=(name, files, rows, repeat, results))
+    process.start()
+    while True:
+        try:
+            measured = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                measured = {'error': f'Case process exited with code {process.exitcode}'}
+                break
+    process.join()
+    if measured is not None and 'seconds' in measured:
+        measured['rows_per_second'] = round(measured['rows'] / measured['seconds'], 1) if measured['seconds'] else None
+        measured['seconds'] = round(measured['seconds'], 6)
+    return measured
+
+
+def git_commit():
+    """
+    Returns (str): the checked out commit, with a '+' if the tree has changes, or None outside a git checkout
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         universal_newlines=True).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                        stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+' if dirty else '')
+
+
+def load_history(path):
+    """
+    Returns ([dict]): the recorded runs, oldest first
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def previous_run(history, rows, sheet_format):
+    """
+    Returns (dict): the latest recorded run of the same size and sheet format, or None
+    """
+    for run in reversed(history):
+        if run['rows'] == rows and run['format'] == sheet_format:
+            return run
+    return None
+
+
+def report(run, previous):
+    """
+    Prints the measurements of a run, and how each case's throughput changed since the previous comparable run.
+    Returns ([str]): the cases whose throughput dropped by more than change_threshold
+    """
+    before = previous['results'] if previous else {}
+    regressions = []
+    print(f"\n{run['rows']} rows ({run['format']})"
+          + (f", compared with {previous['commit'] or 'unknown commit'} of {previous['time']}" if previous else ''))
+    print(f"{'case':<32}{'seconds':>12}{'rows/s':>14}{'peak MB':>10}  change")
+    for name, measured in run['results'].items():
+        if 'error' in measured:
+            print(f'{name:<32}  {measured["error"]}')
+            continue
+        change = ''
+        old = before.get(name, {}).get('rows_per_second')
+        if old and measured['rows_per_second']:
+            ratio = measured['rows_per_second'] / old - 1
+            change = f'{ratio:+.0%}'
+            if ratio < -change_threshold:
+                change += '  REGRESSION'
+                regressions.append(name)
+        print(f"{name:<32}{measured['seconds']:>12.4f}{measured['rows_per_second'] or 0:>14.0f}"
+              f"{measured['peak_rss_mb']:>10.1f}  {change}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ingestion, query and export against a throwaway Postgres.')
+    parser.add_argument('--rows', type=int, nargs='+', default=default_rows,
+                        help='rows in each generated sheet; one run per size (1000 to 1000000)')
+    parser.add_argument('--format', choices=sheet_formats, default='xlsx', help='format of the generated sheets')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each read case; the fastest is recorded')
+    parser.add_argument('--cases', nargs='+', help='names of the cases to run, e.g. filter_table:paged; all by default')
+    parser.add_argument('--config', help='database.ini of an existing throwaway database to use instead of Docker')
+    parser.add_argument('--docker', default='docker', help="command that runs Docker, e.g. 'sudo docker'")
+    parser.add_argument('--workdir', default=default_workdir, help='directory for the generated sheets')
+    parser.add_argument('--history', default=default_history, help='JSON file the results are appended to')
+    parser.add_argument('--label', help='note recorded with the results')
+    args = parser.parse_args(argv)
+
+    cases = all_cases()
+    names = args.cases or list(cases)
+    unknown = [name for name in names if name not in cases]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}; choose from {', '.join(cases)}")
+    if any(name.startswith(('filter_table', 'get_table', 'export')) for name in names) \
+            and 'process_file:intake' not in names:
+        parser.error('the read cases need process_file:intake to load the intake table')
+
+    os.makedirs(args.workdir, exist_ok=True)
+    server = None
+    if args.config:
+        os.environ[config_env] = os.path.abspath(args.config)
+    else:
+        print(f'Starting {DisposablePostgres.image} ...')
+        server = DisposablePostgres(args.workdir, args.docker).__enter__()
+        os.environ[config_env] = os.path.abspath(server.config_file)
+
+    history = load_history(args.history)
+    regressions = []
+    try:
+        for rows in args.rows:
+            print(f'Generating sheets of {rows} rows ...')
+            files = {table: os.path.abspath(sheet_path(args.workdir, table, rows, args.format)) for table in tables}
+            reset_tables(pgSqlConfig())
+            results = OrderedDict()
+            for name in names:
+                print(f'  {name}')
+                measured = run_case(name, files, rows, args.repeat)
+                if measured is not None:
+                    results[name] = measured
+            run = {
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'commit': git_commit(),
+                'label': args.label,
+                'rows': rows,
+                'format': args.format,
+                'repeat': args.repeat,
+                'python': platform.python_version(),
+                'results': results,
+            }
+            regressions += report(run, previous_run(history, rows, args.format))
+            history.append(run)
+            with open(args.history, 'w') as f:
+                json.dump(history, f, indent=2)
+    finally:
+        if server is not None:
+            server.__exit__(None, None, None)
+
+    if regressions:
+        print(f"\nThroughput dropped by more than {change_threshold:.0%} in: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
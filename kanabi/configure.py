@@ -5,19 +5,23 @@ from flask_login import LoginManager, current_user
 from flask_principal import Principal, RoleNeed, UserNeed, identity_loaded, Identity, AnonymousIdentity
 from flask_cors import CORS
 from kanabi.cors import cors_setup
-from .responses import make_gui_response, update_origin_list, origin_list
+from .responses import KanabiJSONEncoder, make_gui_response, update_origin_list, origin_list
 
 db = SQLAlchemy()
 
 
-# Creates the app and initializes core plugins and configurable parameters
-def create_app():
+# Creates the app and initializes core plugins and configurable parameters. A server that forks worker processes
+# passes resume_jobs=False and resumes unfinished uploads in one of its workers instead (see gunicorn.conf.py).
+def create_app(resume_jobs=True):
     app = Flask(__name__, instance_relative_config=True)
 
     # Loads default configuration from file and then overrides it with private instance-specific values
     # found in /instance/config.py
     app.config.from_pyfile('config.py')
 
+    # Dates and amounts from the typed intake columns
+    app.json_encoder = KanabiJSONEncoder
+
     # Load the file specified by the APP_CONFIG_FILE environment variable
     # Variables defined here will override those in the default configuration
     # This can be accomplished using '$ export APP_CONFIG_FILE=/var/www/kanabi/config/production.py'
@@ -47,11 +51,12 @@ def create_app():
     # Utilizes CORS with the list of origin strings and regex expressions to validate resource requests.
     CORS(app, origins=o_list, supports_credentials=True)
 
-    # Uses flask-login to load user by their id. Receives an id, returns a user object.
+    # Uses flask-login to load user by their id. Receives an id, returns a user object: a snapshot of the user,
+    # from the user cache unless it has expired or the user was changed.
     @login_manager.user_loader
     def load_user(user_id):
         # User ID is the primary key from the user table
-        return User.query.get(int(user_id))
+        return user_cache.get(user_id)
 
     # Upon loading user with Flask-Login assign an identity with flask-principal
     @principals.identity_loader
@@ -66,12 +71,11 @@ def create_app():
         identity.user = current_user
         if not isinstance(identity, AnonymousIdentity):
             identity.provides.add(UserNeed(identity.id))
-            if current_user.is_editor:
-                identity.provides.add(RoleNeed('editor'))
-            if current_user.is_admin:
-                identity.provides.add(RoleNeed('admin'))
+            user = user_cache.get(identity.id)
+            for role in user.roles if user is not None else ():
+                identity.provides.add(RoleNeed(role))
 
-    from .user import User
+    from .user import user_cache
 
     with app.app_context():
         from kanabi import server
@@ -88,6 +92,18 @@ def create_app():
         app.register_blueprint(server.main_bp)
         app.register_blueprint(auth.auth_bp)
 
+        from kanabi.jobs import jobs
+        from kanabi.metrics import metrics
+
         # Create Database Models
         db.create_all()
+
+        # Resume the uploads that were still being processed when the server stopped
+        jobs.init_app(app, resume=resume_jobs)
+
+        # Time every request, and profile those of admins that ask for it with ?profile=1
+        metrics.init_app(app)
+
+        # Keep the users of recent requests in memory, rather than reading them from the auth database every time
+        user_cache.init_app(app)
     return app
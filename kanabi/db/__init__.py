@@ -1 +1 @@
-__all__ = ['connection', 'dbConfig']
+__all__ = ['connection', 'dbConfig', 'pool', 'bulk', 'sequence', 'statements', 'querylog', 'advisor', 'catalog', 'notify', 'resultcache']
@@ -0,0 +1,197 @@
+"""
+Index advisor: replays the filter queries recorded in the query log under EXPLAIN (ANALYZE, BUFFERS) and reports the
+sequential scans whose filters an index could serve.
+Usage:
+    python -m kanabi.db.advisor <query log> [--top N]
+Enable the log by setting path in the [querylog] section of kanabi/db/database.ini. The advisor connects with the
+[postgresql] settings of the same file. EXPLAIN ANALYZE runs each query, so point it at a replica if the load matters.
+"""
+import argparse
+import json
+import re
+import sys
+from collections import OrderedDict
+
+import psycopg2
+
+from .dbConfig import pgSqlConfig
+
+identifier_pattern = re.compile(r'"?([A-Za-z_][A-Za-z0-9_]*)"?')
+
+
+def read_log(path):
+    """
+    Groups the logged queries by shape.
+    Args:
+        path (str): query log file
+    Returns (OrderedDict): query text -> {'count', 'duration', 'params'}, the params being those of the first run
+    """
+    shapes = OrderedDict()
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            shape = shapes.setdefault(entry['query'], {'count': 0, 'duration': 0.0, 'params': entry['params']})
+            shape['count'] += 1
+            shape['duration'] += entry.get('duration', 0.0)
+    return shapes
+
+
+def table_columns(cur):
+    """
+    Returns ({str: [str]}): column names of each table in the public schema
+    """
+    cur.execute("""
+    SELECT table_name, column_name FROM information_schema.columns
+    WHERE table_schema = 'public' ORDER BY table_name, ordinal_position
+    """)
+    columns = {}
+    for table, column in cur.fetchall():
+        columns.setdefault(table, []).append(column)
+    return columns
+
+
+def indexed_columns(cur):
+    """
+    Returns ({str: {str}}): for each table, the columns that lead an index and so can be searched by it
+    """
+    cur.execute("""
+    SELECT c.relname, a.attname
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = 'public'
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+    """)
+    indexed = {}
+    for table, column in cur.fetchall():
+        indexed.setdefault(table, set()).add(column)
+    return indexed
+
+
+def plan_nodes(node):
+    """
+    Walks a JSON plan tree.
+    Args:
+        node ({}): plan node
+    Returns (generator): the node and all nodes below it
+    """
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain(cur, query, params):
+    """
+    Runs a query under EXPLAIN (ANALYZE, BUFFERS) and rolls back afterwards.
+    Args:
+        cur ({}): the Postgres cursor
+        query (str): SQL with %s placeholders
+        params ([]): parameter values
+    Returns ({}): the top plan entry: 'Plan', 'Execution Time', ...
+    """
+    try:
+        cur.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + query, params)
+        result = cur.fetchone()[0]
+        if isinstance(result, str):
+            result = json.loads(result)
+        return result[0]
+    finally:
+        cur.connection.rollback()
+
+
+def advise(plan, columns, indexed):
+    """
+    Finds the sequential scans of a plan that filter on columns no index leads with.
+    Args:
+        plan ({}): top plan entry, as returned by explain
+        columns ({str: [str]}): table columns, as returned by table_columns
+        indexed ({str: {str}}): indexed columns, as returned by indexed_columns
+    Returns ([{}]): one entry per sequential scan: table, filter, rows removed, blocks read and suggested columns
+    """
+    findings = []
+    for node in plan_nodes(plan['Plan']):
+        if node.get('Node Type') != 'Seq Scan' or 'Filter' not in node:
+            continue
+        table = node.get('Relation Name')
+        known = columns.get(table, [])
+        filtered = []
+        for name in identifier_pattern.findall(node['Filter']):
+            if name in known and name not in filtered:
+                filtered.append(name)
+        findings.append({
+            'table': table,
+            'filter': node['Filter'],
+            'rows_removed': node.get('Rows Removed by Filter', 0),
+            'blocks': node.get('Shared Hit Blocks', 0) + node.get('Shared Read Blocks', 0),
+            'suggest': [col for col in filtered if col not in indexed.get(table, set())]
+        })
+    return findings
+
+
+def report(shapes, cur, top=None, out=sys.stdout):
+    """
+    Explains the most expensive query shapes of a log and writes what an index would help with.
+    Args:
+        shapes (OrderedDict): as returned by read_log
+        cur ({}): the Postgres cursor
+        top (int): only look at this many shapes, by total logged run time
+        out: stream to write the report to
+    Returns ({(str, str): {}}): suggested (table, column) indexes, with the number of queries and logged time they
+        would serve
+    """
+    columns = table_columns(cur)
+    indexed = indexed_columns(cur)
+    ranked = sorted(shapes.items(), key=lambda x: x[1]['duration'], reverse=True)
+    if top:
+        ranked = ranked[:top]
+
+    suggestions = {}
+    for query, shape in ranked:
+        out.write(f"\n{shape['count']} x {shape['duration'] * 1000:.1f} ms  {query}\n")
+        try:
+            plan = explain(cur, query, shape['params'])
+        except psycopg2.Error as err:
+            out.write(f"  could not explain: {str(err).strip()}\n")
+            continue
+        out.write(f"  execution {plan.get('Execution Time', 0):.2f} ms\n")
+        findings = advise(plan, columns, indexed)
+        if not findings:
+            out.write("  no filtered sequential scans\n")
+        for finding in findings:
+            out.write(f"  seq scan on {finding['table']}: {finding['rows_removed']} rows removed by filter, "
+                      f"{finding['blocks']} blocks, filter {finding['filter']}\n")
+            for col in finding['suggest']:
+                out.write(f"    would benefit from an index on {finding['table']} ({col})\n")
+                entry = suggestions.setdefault((finding['table'], col), {'queries': 0, 'duration': 0.0})
+                entry['queries'] += shape['count']
+                entry['duration'] += shape['duration']
+
+    out.write('\nSuggested indexes:\n' if suggestions else '\nNo indexes to suggest.\n')
+    for (table, col), entry in sorted(suggestions.items(), key=lambda x: x[1]['duration'], reverse=True):
+        out.write(f"  CREATE INDEX {table}_{col}_idx ON {table} ({col});  "
+                  f"-- {entry['queries']} queries, {entry['duration'] * 1000:.1f} ms logged\n")
+    return suggestions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Suggest indexes for the filter queries in a query log.')
+    parser.add_argument('log', help='query log written by the server (see [querylog] in database.ini)')
+    parser.add_argument('--top', type=int, default=None, help='only explain the N most expensive query shapes')
+    args = parser.parse_args(argv)
+
+    shapes = read_log(args.log)
+    if not shapes:
+        print(f'No queries found in {args.log}')
+        return 1
+    conn = psycopg2.connect(**pgSqlConfig())
+    try:
+        report(shapes, conn.cursor(), args.top)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import csv
+import io
+
+from .sequence import reserve_rows
+
+stage_table = 'stage_rows'
+key_exists_msg = 'Key ({})=({}) already exists.'
+
+
+def copy_value(s):
+    """
+    Normalizes an input element for COPY the same way driver.fmt does for INSERT statements: empty and NaN-like
+    values become NULL, quotation marks are stripped from strings and other values are stringified.
+    Args:
+        s (any): the input element
+    Returns (str or None): the value to stage, None meaning NULL
+    """
+    if s is None or str(s) == '':
+        return None
+    if type(s) is str:
+        return s.replace('"', '').replace("'", "")
+    if str(s).lower() == 'nan' or str(s).lower() == 'nat':
+        return None
+    return str(s)
+
+
+def split_row_number(row):
+    """
+    Separates the row number from the data values of an input row, following the rules of driver.insert_row:
+    a leading digit string or integer is an explicit row number, anything else means a row number must be assigned
+    and (unless it is None or an integer) the first element is the first data value.
+    Args:
+        row ([]): row of values
+    Returns ((int or None, [])): the explicit row number, if any, and the data values
+    """
+    if row[0] is not None and str(row[0]).isdigit():
+        return int(row[0]), list(row[1:])
+    if not isinstance(row[0], int) and row[0] is not None:
+        return None, list(row)
+    return None, list(row[1:])
+
+
+def unique_columns(cur, table):
+    """
+    Finds the single-column unique constraints (including the primary key) of a table.
+    Args:
+        cur ({}): the Postgres cursor
+        table (str): table name
+    Returns ([str]): column names
+    """
+    cur.execute("""
+    SELECT a.attname
+    FROM pg_index i
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+    WHERE i.indrelid = %s::regclass AND i.indisunique AND i.indnatts = 1
+    """, (table,))
+    return [x[0] for x in cur.fetchall()]
+
+
+def stage_rows(cur, table, rows):
+    """
+    Creates a temporary staging table shaped like the target table and COPYs the rows into it.
+    Each staged row carries src_idx, its position in the input, so results can be reported per input row.
+    The staging table is dropped when the transaction ends.
+    Args:
+        cur ({}): the Postgres cursor
+        table (str): target table name
+        rows ([[]]): rows of values, as accepted by driver.insert_row
+    Returns ([str]): the target table columns that were staged, in order
+    """
+    cur.execute(f"CREATE TEMP TABLE {stage_table} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+    # rows without a row number are staged with a NULL one (COPY doesn't apply defaults to empty fields), and
+    # numbered by merge_staged
+    cur.execute(f'ALTER TABLE {stage_table} ALTER COLUMN "row" DROP NOT NULL')
+    cur.execute(f"ALTER TABLE {stage_table} ADD COLUMN src_idx integer")
+    cur.execute(f"SELECT * FROM {table} LIMIT 0")
+    table_cols = [col.name for col in cur.description]
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    width = None
+    for i, row in enumerate(rows):
+        row_number, values = split_row_number(row)
+        if width is None:
+            width = len(values)
+        elif len(values) != width:
+            raise ValueError(f'Row {i} has {len(values)} values, expected {width}')
+        writer.writerow([i, row_number] + [copy_value(v) for v in values])
+    if width is None:
+        return table_cols
+    if width + 1 > len(table_cols):
+        raise ValueError(f'Rows have {width + 1} values but table {table} has {len(table_cols)} columns')
+    columns = table_cols[:width + 1]
+
+    buf.seek(0)
+    col_list = ', '.join(f'"{col}"' for col in ['src_idx'] + columns)
+    cur.copy_expert(f"COPY {stage_table} ({col_list}) FROM STDIN WITH (FORMAT csv)", buf)
+    return columns
+
+
+def merge_staged(cur, table, columns):
+    """
+    Moves staged rows into the target table in one statement. Rows whose explicit row number is already in use
+    (in the table or earlier in the batch) are rejected first; rows without a row number get numbers reserved from
+    the table's row sequence; rows violating any other unique constraint are skipped by the insert.
+    Args:
+        cur ({}): the Postgres cursor
+        table (str): target table name
+        columns ([str]): staged columns, as returned by stage_rows
+    Returns ({int: int}, {int: str}): keyed by src_idx, the rows rejected because their row number was taken (with
+        that row number) and the rows skipped by the insert (with the reason)
+    """
+    taken = {}
+    failed = {}
+
+    # explicit row numbers that are taken, either by the table or by an earlier row of the batch
+    cur.execute(f"""
+    DELETE FROM {stage_table} s
+    WHERE EXISTS(SELECT 1 FROM {table} t WHERE t."row" = s."row")
+       OR EXISTS(SELECT 1 FROM {stage_table} p WHERE p."row" = s."row" AND p.src_idx < s.src_idx)
+    RETURNING s.src_idx, s."row"
+    """)
+    for src_idx, row_number in cur.fetchall():
+        taken[src_idx] = row_number
+
+    # number the remaining rows from a block reserved in one go, steering clear of the batch's explicit numbers
+    cur.execute(f'''
+    SELECT COALESCE(array_agg("row") FILTER (WHERE "row" IS NOT NULL), '{{}}'), count(*) FILTER (WHERE "row" IS NULL)
+    FROM {stage_table}
+    ''')
+    explicit, missing = cur.fetchone()
+    if missing:
+        row_numbers = reserve_rows(cur, table, missing, explicit)
+        cur.execute(f"""
+        UPDATE {stage_table} s
+        SET "row" = r.row_number
+        FROM (SELECT src_idx, row_number() OVER (ORDER BY src_idx) AS ordinal FROM {stage_table} WHERE "row" IS NULL) n
+        JOIN unnest(%s::integer[]) WITH ORDINALITY AS r(row_number, ordinal) USING (ordinal)
+        WHERE s.src_idx = n.src_idx
+        """, (row_numbers,))
+
+    col_list = ', '.join(f'"{col}"' for col in columns)
+    cur.execute(f"""
+    INSERT INTO {table} ({col_list})
+    SELECT {col_list} FROM {stage_table} ORDER BY src_idx
+    ON CONFLICT DO NOTHING
+    RETURNING "row"
+    """)
+    inserted = {x[0] for x in cur.fetchall()}
+
+    cur.execute(f'SELECT src_idx, "row" FROM {stage_table}')
+    skipped = {src_idx: row_number for src_idx, row_number in cur.fetchall() if row_number not in inserted}
+    if skipped:
+        # explain each skipped row by the first unique value that collides with a row that made it in
+        for col in unique_columns(cur, table):
+            if col not in columns or col == 'row':
+                continue
+            cur.execute(f"""
+            SELECT s.src_idx, s."{col}"
+            FROM {stage_table} s JOIN {table} t ON t."{col}" = s."{col}" AND t."row" <> s."row"
+            WHERE s.src_idx = ANY(%s)
+            """, (list(skipped),))
+            for src_idx, value in cur.fetchall():
+                if src_idx not in failed:
+                    failed[src_idx] = key_exists_msg.format(col, value)
+        for src_idx in skipped:
+            failed.setdefault(src_idx, 'Row could not be inserted.')
+
+    return taken, failed
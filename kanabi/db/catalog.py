@@ -0,0 +1,132 @@
+import threading
+from collections import namedtuple, OrderedDict
+
+import psycopg2
+
+from .notify import notifications
+
+# channel notified by the schema_change_fnc event trigger and by `launch.bash migrate` when the schema changes
+schema_channel = 'kanabi_schema'
+
+Schema = namedtuple('Schema', ['tables', 'columns', 'column_names', 'column_types'])
+Schema.__doc__ = """
+A snapshot of the public schema. It is never modified once built, so it can be read without locking.
+    tables (frozenset): table names
+    columns ({str: frozenset}): column names of each table
+    column_names ({str: (str)}): column names of each table, in table order
+    column_types ({str: {str: str}}): information_schema data type of each column of each table
+"""
+
+empty_schema = Schema(frozenset(), {}, {}, {})
+
+
+def load_schema(cur):
+    """
+    Reads the tables and columns of the public schema.
+    Args:
+        cur ({}): the Postgres cursor
+    Returns (Schema): the schema
+    """
+    cur.execute("""
+    SELECT c.table_name, c.column_name, c.data_type
+    FROM information_schema.columns c
+    JOIN information_schema.tables t ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+    WHERE c.table_schema = 'public' AND c.table_name NOT LIKE 'pg_%'
+    ORDER BY c.table_name, c.ordinal_position
+    """)
+    types = OrderedDict()
+    for table, column, data_type in cur.fetchall():
+        types.setdefault(table, OrderedDict())[column] = data_type
+    return Schema(
+        tables=frozenset(types),
+        columns={table: frozenset(cols) for table, cols in types.items()},
+        column_names={table: tuple(cols) for table, cols in types.items()},
+        column_types={table: dict(cols) for table, cols in types.items()}
+    )
+
+
+class SchemaCatalog:
+    """
+    Keeps the table and column names and types of the database in memory, so that checking a request against them
+    makes no round trip to the server.
+    The schema is reloaded after a notification on schema_channel, or when the listener had to reconnect and may have
+    missed one. Each lookup polls the listener, which only reads what the server has already sent.
+    """
+
+    def __init__(self, listener=None):
+        """
+        Args:
+            listener (Listener): source of schema change notifications; the shared one if not given
+        """
+        self.listener = listener or notifications
+        self.listener.subscribe(schema_channel, self._changed)
+        self._schema = None
+        self._stale = True
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def _changed(self, payload):
+        self._stale = True
+
+    def schema(self):
+        """
+        Returns (Schema): the current schema. If the database can't be reached, the last schema read is kept, or
+            an empty one if it was never read.
+        """
+        with self._lock:
+            self.listener.poll()
+            if self._stale or self._schema is None:
+                try:
+                    self._stale = False
+                    with self.listener.cursor() as cur:
+                        self._schema = load_schema(cur)
+                    self.loads += 1
+                except psycopg2.Error:
+                    self._stale = True
+            return self._schema or empty_schema
+
+    def invalidate(self):
+        """
+        Makes the next lookup reload the schema, e.g. after this process changed it.
+        Returns: None
+        """
+        self._stale = True
+
+    def tables(self):
+        """
+        Returns (frozenset): names of the tables in the public schema
+        """
+        return self.schema().tables
+
+    def has_table(self, table):
+        """
+        Args:
+            table (str): table name
+        Returns (bool): whether the table exists
+        """
+        return table in self.schema().tables
+
+    def columns(self, table):
+        """
+        Args:
+            table (str): table name
+        Returns (frozenset): the table's column names, empty if there is no such table
+        """
+        return self.schema().columns.get(table, frozenset())
+
+    def column_types(self, table):
+        """
+        Args:
+            table (str): table name
+        Returns ({str: str}): data type of each of the table's columns
+        """
+        return self.schema().column_types.get(table, {})
+
+    def stats(self):
+        """
+        Returns (dict): number of times the schema was read
+        """
+        return {'loads': self.loads}
+
+
+catalog = SchemaCatalog()
@@ -1,5 +1,8 @@
+import random
+import time
+
 import psycopg2
-from .dbConfig import pgSqlConfig
+from .dbConfig import connection_params, pgSqlConfig
 
 
 def pg_connect():
@@ -9,7 +12,7 @@ def pg_connect():
     """
     try:
         # read connection parameters
-        params = pgSqlConfig()
+        params = connection_params(pgSqlConfig())
         # connect to the PostgreSQL server
         print('Connecting to the PostgreSQL database...')
         conn = psycopg2.connect(**params)
@@ -20,6 +23,44 @@ def pg_connect():
         print(error)
 
 
+def backoff(base=0.5, cap=10.0):
+    """
+    Delays to wait between connection attempts: exponential backoff with full jitter, so that server processes
+    started together don't retry in step.
+    Args:
+        base (float): upper bound, in seconds, of the first delay; it doubles with every attempt
+        cap (float): largest upper bound
+    Returns (generator): an endless sequence of delays, in seconds
+    """
+    attempt = 0
+    while True:
+        yield random.uniform(0, min(cap, base * 2 ** attempt))
+        attempt += 1
+
+
+def pg_connect_retry(timeout=None, base=0.5, cap=10.0):
+    """
+    Connects to the PostgreSQL database server, retrying with backoff until it succeeds or time runs out.
+    Args:
+        timeout (float): seconds to keep trying; no limit if None
+        base (float): upper bound of the first delay between attempts
+        cap (float): largest upper bound of a delay
+    Returns: the database cursor and connection objects, or None if no attempt succeeded in time
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for attempt, delay in enumerate(backoff(base, cap), 1):
+        connected = pg_connect()
+        if connected is not None:
+            return connected
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            delay = min(delay, remaining)
+        print(f'Connection attempt {attempt} failed, retrying in {delay:.1f}s')
+        time.sleep(delay)
+
+
 def pg_disconnect(cur, conn):
     """
     Breaks the database connection.
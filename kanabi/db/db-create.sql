@@ -12,10 +12,13 @@ This SQL file will be executed once the DB is set up.
 -- 		 It copies the old data and the new data in txn_history table as
 --  	 JSON. In case of DELETE it copies data into archive table then updates txn_history
 --       with location data for archive table
+--       It also notifies the kanabi_changes channel with the table name
 --
 CREATE FUNCTION change_fnc() RETURNS TRIGGER
     LANGUAGE plpgsql
     AS $$BEGIN
+-- tell the servers' result caches that the table changed; repeats within a transaction are sent once
+PERFORM pg_notify('kanabi_changes', TG_RELNAME);
 IF TG_OP='INSERT'
 THEN
 INSERT INTO txn_history(tabname,schemaname,operation, new_val)
@@ -39,6 +42,21 @@ $$;
 
 ALTER FUNCTION change_fnc() OWNER TO kanabiadmin;
 
+--
+-- Name: notify_change_fnc(); Type: FUNCTION; Schema: public; Owner: kanabiadmin
+-- Desc: Notifies the kanabi_changes channel with the table name, like change_fnc, for tables whose changes are
+--       not recorded in txn_history
+--
+CREATE FUNCTION notify_change_fnc() RETURNS TRIGGER
+    LANGUAGE plpgsql
+    AS $$BEGIN
+PERFORM pg_notify('kanabi_changes', TG_TABLE_NAME);
+RETURN NULL;
+END;
+$$;
+
+ALTER FUNCTION notify_change_fnc() OWNER TO kanabiadmin;
+
 --
 -- A function to restore a record from the archive table back to original table
 -- Name: restore_record
@@ -73,6 +91,111 @@ END;$_$;
 
 ALTER FUNCTION restore_row(row_num integer) OWNER TO kanabiadmin;
 
+--
+-- Name: restore_rows
+-- Desc: Restores many archive rows at once. Rows are inserted into each table they were deleted from
+--       with one INSERT per table; rows that conflict with an existing row (same row number, MRL or
+--       receipt num) are skipped. Returns, in the order given, whether each archive row was 'restored',
+--       skipped as a 'conflict', or 'missing' from the archive.
+--
+CREATE OR REPLACE FUNCTION restore_rows(row_nums integer[])
+    RETURNS TABLE(row_num integer, status text)
+    LANGUAGE 'plpgsql'
+AS $_$#variable_conflict use_column
+DECLARE
+tablename text;
+restored integer[] := '{}';
+inserted integer[];
+BEGIN
+FOR tablename IN
+    SELECT DISTINCT t.tabname
+    FROM txn_history AS t JOIN archive AS a
+    ON t.archive_row = a.row_id
+    WHERE a.row_id = ANY(row_nums)
+LOOP
+    -- of archive rows holding the same row number, only the first is tried, so that each row number inserted
+    -- stands for one archive row
+    EXECUTE
+    format('WITH source AS (
+        SELECT DISTINCT ON (r."row") a.row_id, r
+        FROM archive AS a
+        JOIN txn_history AS t ON t.archive_row = a.row_id AND t.tabname = $2,
+        LATERAL json_populate_record(NULL::%I, a.old_val) AS r
+        WHERE a.row_id = ANY($1)
+        ORDER BY r."row", a.row_id
+    ), inserted AS (
+        INSERT INTO %I
+        SELECT (s.r).* FROM source AS s
+        ON CONFLICT DO NOTHING
+        RETURNING "row"
+    )
+    SELECT coalesce(array_agg(s.row_id), ''{}'')
+    FROM source AS s JOIN inserted AS i ON (s.r)."row" = i."row"', tablename, tablename)
+    INTO inserted
+    USING row_nums, tablename;
+    restored := restored || inserted;
+END LOOP;
+RETURN QUERY
+SELECT n.row_num,
+    CASE
+        WHEN n.row_num = ANY(restored) THEN 'restored'
+        WHEN EXISTS(SELECT 1 FROM txn_history AS t WHERE t.archive_row = n.row_num) THEN 'conflict'
+        ELSE 'missing'
+    END
+FROM unnest(row_nums) WITH ORDINALITY AS n(row_num, ordinal)
+ORDER BY n.ordinal;
+END;$_$;
+
+ALTER FUNCTION restore_rows(row_nums integer[]) OWNER TO kanabiadmin;
+
+--
+-- A function to reserve a block of unused row numbers for a table from the table's <table>_row_seq sequence
+-- Name: reserve_rows
+-- Desc: Draws n values from the sequence, skipping any that are already used as a row number in the table
+--       (e.g. explicitly numbered rows from a spreadsheet) or listed in exclude (rows about to be inserted)
+--
+CREATE OR REPLACE FUNCTION reserve_rows(tablename text, n integer, exclude integer[] DEFAULT '{}')
+    RETURNS SETOF integer
+    LANGUAGE 'plpgsql'
+AS $_$DECLARE
+candidate integer;
+taken boolean;
+reserved integer := 0;
+BEGIN
+WHILE reserved < n LOOP
+    candidate := nextval(quote_ident(tablename || '_row_seq')::regclass);
+    IF candidate = ANY(exclude) THEN
+        CONTINUE;
+    END IF;
+    EXECUTE format('SELECT EXISTS(SELECT 1 FROM %I WHERE "row" = $1)', tablename)
+    INTO taken
+    USING candidate;
+    IF NOT taken THEN
+        reserved := reserved + 1;
+        RETURN NEXT candidate;
+    END IF;
+END LOOP;
+END;$_$;
+
+ALTER FUNCTION reserve_rows(tablename text, n integer, exclude integer[]) OWNER TO kanabiadmin;
+
+--
+-- Name: schema_change_fnc(); Type: FUNCTION; Schema: public; Owner: kanabiadmin
+-- Desc: Notifies the servers' schema catalogs on the kanabi_schema channel after any DDL command
+--
+CREATE FUNCTION schema_change_fnc() RETURNS event_trigger
+    LANGUAGE plpgsql
+AS $$BEGIN
+-- temporary tables, such as the staging tables of bulk loads, are of no interest
+IF EXISTS (SELECT 1 FROM pg_event_trigger_ddl_commands()
+           WHERE schema_name IS NULL OR schema_name NOT LIKE 'pg_temp%') THEN
+    PERFORM pg_notify('kanabi_schema', tg_tag);
+END IF;
+END;
+$$;
+
+ALTER FUNCTION schema_change_fnc() OWNER TO kanabiadmin;
+
 
 -------------------------
 -- DB Parameters
@@ -107,12 +230,12 @@ COMMENT ON TABLE metadata IS 'Table to track the file metadata that is uploaded
 --
 CREATE TABLE intake (
     "row" integer NOT NULL,
-    submission_date text,
+    submission_date date,
     entity text,
     dba text,
     facility_address text,
     facility_suite text,
-    facility_zip text,
+    facility_zip integer,
     mailing_address text,
     mrl text UNIQUE,
     neighborhood_association text,
@@ -126,10 +249,10 @@ CREATE TABLE intake (
     repeat_location text,
     app_complete text,
     fee_schedule text,
-    receipt_num text UNIQUE,
-    cash_amount text,
-    check_amount text,
-    card_amount text,
+    receipt_num bigint UNIQUE,
+    cash_amount numeric(12,2),
+    check_amount numeric(12,2),
+    card_amount numeric(12,2),
     check_num_approval_code text,
     mrl_num text,
     notes text,
@@ -173,6 +296,27 @@ COMMENT ON TABLE archive IS 'Table tracks the rows removed from the intake datab
 ALTER TABLE ONLY archive
     ADD CONSTRAINT archive_pkey PRIMARY KEY (row_id);
 
+--
+-- Name: schema_migrations; Type: TABLE; Schema: public; Owner: kanabiadmin
+--
+CREATE TABLE schema_migrations (
+    version text NOT NULL,
+    applied_at timestamp without time zone DEFAULT now()
+);
+ALTER TABLE schema_migrations OWNER TO kanabiadmin;
+COMMENT ON TABLE schema_migrations IS 'Table tracks the migrations in kanabi/db/migrations applied to the DB';
+ALTER TABLE ONLY schema_migrations
+    ADD CONSTRAINT schema_migrations_pkey PRIMARY KEY (version);
+-- this file already makes the changes of every migration so far; add each new one here too
+INSERT INTO schema_migrations(version) VALUES
+    ('001-row-sequences'),
+    ('002-filter-indexes'),
+    ('003-typed-intake'),
+    ('004-schema-notify'),
+    ('005-change-notify'),
+    ('006-restore-rows'),
+    ('007-metadata-notify');
+
 --
 -- Name: violations Type: table Schema: public Owner: kanabiadmin
 --
@@ -264,6 +408,73 @@ ALTER TABLE archive_row_seq OWNER TO kanabiadmin;
 ALTER SEQUENCE archive_row_seq OWNED BY archive.row_id;
 ALTER TABLE ONLY archive ALTER COLUMN row_id SET DEFAULT nextval('archive_row_seq'::regclass);
 
+--
+-- Name: intake_row_seq
+-- Desc: Sequence used to number rows of the intake table Owner: kanabiadmin
+--
+CREATE SEQUENCE intake_row_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+ALTER TABLE intake_row_seq OWNER TO kanabiadmin;
+ALTER SEQUENCE intake_row_seq OWNED BY intake."row";
+ALTER TABLE ONLY intake ALTER COLUMN "row" SET DEFAULT nextval('intake_row_seq'::regclass);
+
+--
+-- Name: violations_row_seq
+-- Desc: Sequence used to number rows of the violations table Owner: kanabiadmin
+--
+CREATE SEQUENCE violations_row_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+ALTER TABLE violations_row_seq OWNER TO kanabiadmin;
+ALTER SEQUENCE violations_row_seq OWNED BY violations."row";
+ALTER TABLE ONLY violations ALTER COLUMN "row" SET DEFAULT nextval('violations_row_seq'::regclass);
+
+--
+-- Name: reports_row_seq
+-- Desc: Sequence used to number rows of the reports table Owner: kanabiadmin
+--
+CREATE SEQUENCE reports_row_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+ALTER TABLE reports_row_seq OWNER TO kanabiadmin;
+ALTER SEQUENCE reports_row_seq OWNED BY reports."row";
+ALTER TABLE ONLY reports ALTER COLUMN "row" SET DEFAULT nextval('reports_row_seq'::regclass);
+
+-------------------------
+-- Indexes
+-------------------------
+
+--
+-- Name: intake filter indexes
+-- Desc: Columns used by the GUI's /list filters
+--
+CREATE INDEX intake_neighborhood_association_idx ON intake (neighborhood_association);
+CREATE INDEX intake_compliance_region_idx ON intake (compliance_region);
+CREATE INDEX intake_license_type_idx ON intake (license_type);
+CREATE INDEX intake_submission_date_idx ON intake (submission_date);
+
+--
+-- Name: txn_history audit indexes
+-- Desc: History of one table in time order, and the join from restore_row to the archive
+--
+CREATE INDEX txn_history_tabname_tstamp_idx ON txn_history (tabname, tstamp);
+CREATE INDEX txn_history_archive_row_idx ON txn_history (archive_row);
 
 -------------------------
 -- Triggers
@@ -293,6 +504,21 @@ CREATE TRIGGER reports_transactions
 BEFORE INSERT OR UPDATE OR DELETE ON reports
 FOR EACH ROW EXECUTE FUNCTION change_fnc();
 
+--
+-- Name: metadata_changes
+-- Desc: After each statement that writes to the metadata table, calls notify_change_fnc
+--
+CREATE TRIGGER metadata_changes
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON metadata
+FOR EACH STATEMENT EXECUTE FUNCTION notify_change_fnc();
+
+--
+-- Name: schema_change_trigger
+-- Desc: After any DDL command, calls schema_change_fnc so that the servers reload their table and column names
+--
+CREATE EVENT TRIGGER schema_change_trigger ON ddl_command_end
+EXECUTE FUNCTION schema_change_fnc();
+
 -------------------------
 -- Groups
 -------------------------
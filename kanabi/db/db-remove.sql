@@ -10,26 +10,52 @@ DROP TRIGGER IF EXISTS violations_transactions ON public.violations;
 
 DROP TRIGGER IF EXISTS records_transactions ON records;
 
+DROP TRIGGER IF EXISTS metadata_changes ON metadata;
+
+DROP EVENT TRIGGER IF EXISTS schema_change_trigger;
+
 DROP FUNCTION IF EXISTS change_fnc;
 
+DROP FUNCTION IF EXISTS notify_change_fnc;
+
 DROP FUNCTION IF EXISTS check_insertion_fnc;
 
+DROP FUNCTION IF EXISTS schema_change_fnc;
+
+DROP FUNCTION IF EXISTS reserve_rows;
+
+DROP FUNCTION IF EXISTS restore_rows;
+
+DROP FUNCTION IF EXISTS intake_text_to_date;
+
+DROP FUNCTION IF EXISTS intake_text_to_bigint;
+
+DROP FUNCTION IF EXISTS intake_text_to_money;
+
 DROP SEQUENCE IF EXISTS public.txn_history_id_seq CASCADE;
 
 DROP SEQUENCE IF EXISTS public.archive_row_seq CASCADE;
 
+DROP SEQUENCE IF EXISTS public.intake_row_seq CASCADE;
+
 DROP SEQUENCE IF EXISTS public.violations_row_seq CASCADE;
 
+DROP SEQUENCE IF EXISTS public.reports_row_seq CASCADE;
+
 DROP SEQUENCE IF EXISTS public.records_row_seq CASCADE;
 
 DROP TABLE IF EXISTS metadata;
 
+DROP TABLE IF EXISTS intake_untyped_values;
+
 DROP TABLE IF EXISTS intake;
 
 DROP TABLE IF EXISTS txn_history;
 
 DROP TABLE IF EXISTS archive;
 
+DROP TABLE IF EXISTS schema_migrations;
+
 DROP TABLE IF EXISTS violations;
 
 DROP TABLE IF EXISTS records;
@@ -1,15 +1,31 @@
 #!/usr/bin/python
+import os
 from configparser import ConfigParser
 
+default_config = 'kanabi/db/database.ini'
+# environment variable naming a file to read in place of the default one, e.g. that of a benchmark's database
+config_env = 'KANABI_DB_CONFIG'
+# libpq settings of every connection, unless database.ini sets them: a bound on the time a connection attempt may
+# take, and TCP keepalives, so that a connection to a server that went away is found out while it sits idle
+connection_defaults = {
+    'connect_timeout': '10',
+    'keepalives': '1',
+    'keepalives_idle': '30',
+    'keepalives_interval': '10',
+    'keepalives_count': '3',
+}
 
-def pgSqlConfig(filename='kanabi/db/database.ini', section='postgresql'):
+
+def pgSqlConfig(filename=default_config, section='postgresql'):
     """
     Extracts configuration parameters from the .ini file
     Args:
-        filename: file to parse
+        filename: file to parse; the default file is replaced by the one named in KANABI_DB_CONFIG, if set
         section: section of the file to read, if multiple are present
     Returns: an object containing the config parameters
     """
+    if filename == default_config:
+        filename = os.environ.get(config_env) or filename
 
     # create a parser
     parser = ConfigParser()
@@ -26,3 +42,15 @@ def pgSqlConfig(filename='kanabi/db/database.ini', section='postgresql'):
         raise Exception('Section {0} not found in the {1} file'.format(section, filename))
 
     return db
+
+
+def connection_params(params):
+    """
+    Adds the connection_defaults to connection parameters.
+    Args:
+        params ({}): keyword arguments for psycopg2.connect, e.g. from pgSqlConfig
+    Returns ({}): a copy of params, with the defaults of the settings it doesn't have
+    """
+    ret = dict(connection_defaults)
+    ret.update(params)
+    return ret
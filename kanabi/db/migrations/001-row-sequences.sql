@@ -0,0 +1,57 @@
+/*
+Migration 001: number table rows from per-table sequences instead of probing for a free row number.
+Brings a database created before reserve_rows and the <table>_row_seq sequences were added to db-create.sql
+up to date. Each sequence starts after the highest row number already in its table.
+*/
+
+--
+-- A function to reserve a block of unused row numbers for a table from the table's <table>_row_seq sequence
+-- Name: reserve_rows
+-- Desc: Draws n values from the sequence, skipping any that are already used as a row number in the table
+--       (e.g. explicitly numbered rows from a spreadsheet) or listed in exclude (rows about to be inserted)
+--
+CREATE OR REPLACE FUNCTION reserve_rows(tablename text, n integer, exclude integer[] DEFAULT '{}')
+    RETURNS SETOF integer
+    LANGUAGE 'plpgsql'
+AS $_$DECLARE
+candidate integer;
+taken boolean;
+reserved integer := 0;
+BEGIN
+WHILE reserved < n LOOP
+    candidate := nextval(quote_ident(tablename || '_row_seq')::regclass);
+    IF candidate = ANY(exclude) THEN
+        CONTINUE;
+    END IF;
+    EXECUTE format('SELECT EXISTS(SELECT 1 FROM %I WHERE "row" = $1)', tablename)
+    INTO taken
+    USING candidate;
+    IF NOT taken THEN
+        reserved := reserved + 1;
+        RETURN NEXT candidate;
+    END IF;
+END LOOP;
+END;$_$;
+
+ALTER FUNCTION reserve_rows(tablename text, n integer, exclude integer[]) OWNER TO kanabiadmin;
+
+CREATE SEQUENCE IF NOT EXISTS intake_row_seq AS integer START WITH 1 INCREMENT BY 1 NO MINVALUE NO MAXVALUE CACHE 1;
+ALTER TABLE intake_row_seq OWNER TO kanabiadmin;
+ALTER SEQUENCE intake_row_seq OWNED BY intake."row";
+ALTER TABLE ONLY intake ALTER COLUMN "row" SET DEFAULT nextval('intake_row_seq'::regclass);
+SELECT setval('intake_row_seq', COALESCE((SELECT MAX("row") FROM intake), 0) + 1, false);
+
+CREATE SEQUENCE IF NOT EXISTS violations_row_seq AS integer START WITH 1 INCREMENT BY 1 NO MINVALUE NO MAXVALUE CACHE 1;
+ALTER TABLE violations_row_seq OWNER TO kanabiadmin;
+ALTER SEQUENCE violations_row_seq OWNED BY violations."row";
+ALTER TABLE ONLY violations ALTER COLUMN "row" SET DEFAULT nextval('violations_row_seq'::regclass);
+SELECT setval('violations_row_seq', COALESCE((SELECT MAX("row") FROM violations), 0) + 1, false);
+
+CREATE SEQUENCE IF NOT EXISTS reports_row_seq AS integer START WITH 1 INCREMENT BY 1 NO MINVALUE NO MAXVALUE CACHE 1;
+ALTER TABLE reports_row_seq OWNER TO kanabiadmin;
+ALTER SEQUENCE reports_row_seq OWNED BY reports."row";
+ALTER TABLE ONLY reports ALTER COLUMN "row" SET DEFAULT nextval('reports_row_seq'::regclass);
+SELECT setval('reports_row_seq', COALESCE((SELECT MAX("row") FROM reports), 0) + 1, false);
+
+GRANT USAGE ON ALL SEQUENCES IN SCHEMA public TO writeaccess;
+GRANT ALL PRIVILEGES ON ALL SEQUENCES IN SCHEMA public TO adminaccess;
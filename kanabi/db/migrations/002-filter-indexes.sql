@@ -0,0 +1,24 @@
+/*
+Migration 002: index the columns that /list filters on and the txn_history/archive access paths.
+Without these, every filter on intake and every restore_row lookup is a sequential scan.
+Safe to run more than once.
+*/
+
+--
+-- Name: intake filter indexes
+-- Desc: Columns used by the GUI's /list filters
+--
+CREATE INDEX IF NOT EXISTS intake_neighborhood_association_idx ON intake (neighborhood_association);
+CREATE INDEX IF NOT EXISTS intake_compliance_region_idx ON intake (compliance_region);
+CREATE INDEX IF NOT EXISTS intake_license_type_idx ON intake (license_type);
+CREATE INDEX IF NOT EXISTS intake_submission_date_idx ON intake (submission_date);
+
+--
+-- Name: txn_history audit indexes
+-- Desc: History of one table in time order, and the join from restore_row to the archive
+--
+CREATE INDEX IF NOT EXISTS txn_history_tabname_tstamp_idx ON txn_history (tabname, tstamp);
+CREATE INDEX IF NOT EXISTS txn_history_archive_row_idx ON txn_history (archive_row);
+
+ANALYZE intake;
+ANALYZE txn_history;
@@ -0,0 +1,103 @@
+/*
+Migration 003: store intake dates, zip codes, receipt numbers and amounts as typed columns instead of text.
+Text comparisons made range filters such as cash_amount > 100 lexicographic and kept them off the indexes.
+Values that don't convert are stored as NULL, and their original text is kept in intake_untyped_values.
+Safe to run more than once: columns that are already typed are left alone.
+*/
+
+--
+-- Name: intake_untyped_values
+-- Desc: Original text of the intake values that could not be converted to their column's type
+--
+CREATE TABLE IF NOT EXISTS intake_untyped_values (
+    "row" integer NOT NULL,
+    column_name text NOT NULL,
+    value text,
+    PRIMARY KEY ("row", column_name)
+);
+ALTER TABLE intake_untyped_values OWNER TO kanabiadmin;
+GRANT SELECT ON intake_untyped_values TO readaccess;
+GRANT SELECT, INSERT, UPDATE, DELETE ON intake_untyped_values TO writeaccess;
+GRANT ALL PRIVILEGES ON intake_untyped_values TO adminaccess;
+
+--
+-- Name: conversion helpers
+-- Desc: Parse the text formats the spreadsheets and the API have stored, returning NULL for anything else
+--
+CREATE OR REPLACE FUNCTION intake_text_to_date(val text) RETURNS date
+    LANGUAGE plpgsql IMMUTABLE
+AS $$BEGIN
+val := btrim(val);
+IF val ~ '^\d{4}-\d{1,2}-\d{1,2}' THEN
+    RETURN to_date(substr(val, 1, 10), 'YYYY-MM-DD');
+ELSIF val ~ '^\d{1,2}/\d{1,2}/\d{4}$' THEN
+    RETURN to_date(val, 'MM/DD/YYYY');
+ELSIF val ~ '^\d{1,2}/\d{1,2}/\d{2}$' THEN
+    RETURN to_date(val, 'MM/DD/YY');
+END IF;
+RETURN NULL;
+EXCEPTION WHEN others THEN
+RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION intake_text_to_bigint(val text) RETURNS bigint
+    LANGUAGE plpgsql IMMUTABLE
+AS $$BEGIN
+val := btrim(val);
+IF val ~ '^\+?\d+(\.0*)?$' THEN
+    RETURN val::numeric::bigint;
+END IF;
+RETURN NULL;
+EXCEPTION WHEN others THEN
+RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION intake_text_to_money(val text) RETURNS numeric(12,2)
+    LANGUAGE plpgsql IMMUTABLE
+AS $$BEGIN
+val := replace(regexp_replace(btrim(val), '^\$', ''), ',', '');
+IF val ~ '^[-+]?(\d+\.?\d*|\.\d+)$' THEN
+    RETURN val::numeric(12,2);
+END IF;
+RETURN NULL;
+EXCEPTION WHEN others THEN
+RETURN NULL;
+END;
+$$;
+
+--
+-- Name: column conversion
+-- Desc: Keeps the text that won't convert, then changes each column's type. The change_fnc trigger doesn't fire
+--       for ALTER TABLE, so txn_history is not flooded with updates.
+--
+DO $$
+DECLARE
+col record;
+BEGIN
+FOR col IN SELECT * FROM (VALUES
+    ('submission_date', 'date', 'intake_text_to_date'),
+    ('facility_zip', 'integer', 'intake_text_to_bigint'),
+    ('receipt_num', 'bigint', 'intake_text_to_bigint'),
+    ('cash_amount', 'numeric(12,2)', 'intake_text_to_money'),
+    ('check_amount', 'numeric(12,2)', 'intake_text_to_money'),
+    ('card_amount', 'numeric(12,2)', 'intake_text_to_money')
+) AS c(name, sql_type, converter)
+LOOP
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = 'public' AND table_name = 'intake' AND column_name = col.name
+               AND data_type = 'text') THEN
+        EXECUTE format('INSERT INTO intake_untyped_values ("row", column_name, value) '
+                       'SELECT "row", %L, %I FROM intake '
+                       'WHERE btrim(%I) NOT IN (%L, %L, %L) AND %s(%I) IS NULL '
+                       'ON CONFLICT DO NOTHING',
+                       col.name, col.name, col.name, '', 'nan', 'NaN', col.converter, col.name);
+        EXECUTE format('ALTER TABLE intake ALTER COLUMN %I TYPE %s USING %s(%I)',
+                       col.name, col.sql_type, col.converter, col.name);
+    END IF;
+END LOOP;
+END;
+$$;
+
+ANALYZE intake;
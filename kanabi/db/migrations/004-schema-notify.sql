@@ -0,0 +1,34 @@
+/*
+Migration 004: notify the servers' schema catalogs (kanabi/db/catalog.py) when tables or columns change, so that
+they reload the table and column names they check requests against.
+Event triggers can only be created by a superuser; when run as another role, this step is skipped and catalogs are
+only refreshed by the NOTIFY sent at the end of `launch.bash migrate`.
+Safe to run more than once.
+*/
+
+--
+-- Name: schema_change_fnc(); Type: FUNCTION; Schema: public; Owner: kanabiadmin
+-- Desc: Sends a notification on the kanabi_schema channel after any DDL command
+--
+CREATE OR REPLACE FUNCTION schema_change_fnc() RETURNS event_trigger
+    LANGUAGE plpgsql
+AS $$BEGIN
+-- temporary tables, such as the staging tables of bulk loads, are of no interest
+IF EXISTS (SELECT 1 FROM pg_event_trigger_ddl_commands()
+           WHERE schema_name IS NULL OR schema_name NOT LIKE 'pg_temp%') THEN
+    PERFORM pg_notify('kanabi_schema', tg_tag);
+END IF;
+END;
+$$;
+
+DO $$
+BEGIN
+IF NOT EXISTS (SELECT 1 FROM pg_event_trigger WHERE evtname = 'schema_change_trigger') THEN
+    CREATE EVENT TRIGGER schema_change_trigger ON ddl_command_end EXECUTE FUNCTION schema_change_fnc();
+END IF;
+EXCEPTION WHEN insufficient_privilege THEN
+    RAISE NOTICE 'Not a superuser: schema_change_trigger not created';
+END;
+$$;
+
+NOTIFY kanabi_schema;
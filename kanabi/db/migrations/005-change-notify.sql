@@ -0,0 +1,37 @@
+/*
+Migration 005: have change_fnc notify the kanabi_changes channel with the name of the table written to, so that the
+servers' result caches (kanabi/db/resultcache.py) drop what they hold for it, whichever process made the change.
+Safe to run more than once.
+*/
+
+--
+-- Name: change_fnc(); Type: FUNCTION; Schema: public; Owner: kanabiadmin
+-- Desc: Same as in db-create.sql, plus the notification
+--
+CREATE OR REPLACE FUNCTION change_fnc() RETURNS TRIGGER
+    LANGUAGE plpgsql
+    AS $$BEGIN
+-- tell the servers' result caches that the table changed; repeats within a transaction are sent once
+PERFORM pg_notify('kanabi_changes', TG_RELNAME);
+IF TG_OP='INSERT'
+THEN
+INSERT INTO txn_history(tabname,schemaname,operation, new_val)
+VALUES(TG_RELNAME, TG_TABLE_SCHEMA, TG_OP, row_to_json(NEW));
+RETURN NEW;
+ELSIF TG_OP = 'UPDATE'
+THEN
+INSERT INTO txn_history(tabname,schemaname,operation, new_val, old_val)
+VALUES(TG_RELNAME,TG_TABLE_SCHEMA, TG_OP, row_to_json(NEW), row_to_json(OLD));
+RETURN NEW;
+ELSIF TG_OP = 'DELETE'
+THEN
+INSERT INTO archive (old_val)
+VALUES(row_to_json(OLD));
+INSERT INTO txn_history(tabname,schemaname,operation, archive_row)
+VALUES(TG_RELNAME,TG_TABLE_SCHEMA, TG_OP, (SELECT currval('archive_row_seq')));
+RETURN OLD;
+END IF;
+END;
+$$;
+
+ALTER FUNCTION change_fnc() OWNER TO kanabiadmin;
@@ -0,0 +1,66 @@
+/*
+Migration 006: add restore_rows, which restores a set of archived rows in one statement, so that restoring many rows
+takes one transaction instead of one per row. Archive rows that conflict with an existing row are skipped and
+reported, instead of failing the whole set.
+Safe to run more than once.
+*/
+
+-- earlier versions returned a boolean per row instead of a status
+DROP FUNCTION IF EXISTS restore_rows(integer[]);
+
+--
+-- Name: restore_rows
+-- Desc: Same as restore_row, for many archive rows at once. Rows are inserted into each table they were deleted from
+--       with one INSERT per table; rows that conflict with an existing row (same row number, MRL or
+--       receipt num) are skipped. Returns, in the order given, whether each archive row was 'restored',
+--       skipped as a 'conflict', or 'missing' from the archive.
+--
+CREATE FUNCTION restore_rows(row_nums integer[])
+    RETURNS TABLE(row_num integer, status text)
+    LANGUAGE 'plpgsql'
+AS $_$#variable_conflict use_column
+DECLARE
+tablename text;
+restored integer[] := '{}';
+inserted integer[];
+BEGIN
+FOR tablename IN
+    SELECT DISTINCT t.tabname
+    FROM txn_history AS t JOIN archive AS a
+    ON t.archive_row = a.row_id
+    WHERE a.row_id = ANY(row_nums)
+LOOP
+    -- of archive rows holding the same row number, only the first is tried, so that each row number inserted
+    -- stands for one archive row
+    EXECUTE
+    format('WITH source AS (
+        SELECT DISTINCT ON (r."row") a.row_id, r
+        FROM archive AS a
+        JOIN txn_history AS t ON t.archive_row = a.row_id AND t.tabname = $2,
+        LATERAL json_populate_record(NULL::%I, a.old_val) AS r
+        WHERE a.row_id = ANY($1)
+        ORDER BY r."row", a.row_id
+    ), inserted AS (
+        INSERT INTO %I
+        SELECT (s.r).* FROM source AS s
+        ON CONFLICT DO NOTHING
+        RETURNING "row"
+    )
+    SELECT coalesce(array_agg(s.row_id), ''{}'')
+    FROM source AS s JOIN inserted AS i ON (s.r)."row" = i."row"', tablename, tablename)
+    INTO inserted
+    USING row_nums, tablename;
+    restored := restored || inserted;
+END LOOP;
+RETURN QUERY
+SELECT n.row_num,
+    CASE
+        WHEN n.row_num = ANY(restored) THEN 'restored'
+        WHEN EXISTS(SELECT 1 FROM txn_history AS t WHERE t.archive_row = n.row_num) THEN 'conflict'
+        ELSE 'missing'
+    END
+FROM unnest(row_nums) WITH ORDINALITY AS n(row_num, ordinal)
+ORDER BY n.ordinal;
+END;$_$;
+
+ALTER FUNCTION restore_rows(row_nums integer[]) OWNER TO kanabiadmin;
@@ -0,0 +1,30 @@
+/*
+Migration 007: notify the kanabi_changes channel when the metadata table is written to, so that every server's result
+cache drops the metadata it holds, not only that of the process that wrote it.
+Safe to run more than once.
+*/
+
+--
+-- Name: notify_change_fnc(); Type: FUNCTION; Schema: public; Owner: kanabiadmin
+-- Desc: Notifies the kanabi_changes channel with the table name, like change_fnc, for tables whose changes are
+--       not recorded in txn_history
+--
+CREATE OR REPLACE FUNCTION notify_change_fnc() RETURNS TRIGGER
+    LANGUAGE plpgsql
+    AS $$BEGIN
+PERFORM pg_notify('kanabi_changes', TG_TABLE_NAME);
+RETURN NULL;
+END;
+$$;
+
+ALTER FUNCTION notify_change_fnc() OWNER TO kanabiadmin;
+
+DROP TRIGGER IF EXISTS metadata_changes ON metadata;
+
+--
+-- Name: metadata_changes
+-- Desc: After each statement that writes to the metadata table, calls notify_change_fnc
+--
+CREATE TRIGGER metadata_changes
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON metadata
+FOR EACH STATEMENT EXECUTE FUNCTION notify_change_fnc();
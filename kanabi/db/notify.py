@@ -0,0 +1,166 @@
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+from .dbConfig import connection_params, pgSqlConfig
+
+
+class Listener:
+    """
+    One connection that LISTENs on the channels the in-memory caches depend on, and hands each notification to the
+    handlers subscribed to its channel.
+    Nothing reads from the connection in the background: poll() picks up what the server has already sent, without
+    a round trip, so callers poll before trusting what they cached. When the connection has to be (re)made, every
+    handler is called with None, since notifications may have been missed in the meantime. Callers that must not wait
+    for a connection to be made, such as the caches consulted on every request, poll with connect=False: the
+    connection is then made by a background thread.
+    """
+
+    def __init__(self, params=None, retry_interval=5):
+        """
+        Args:
+            params ({}): keyword arguments passed to psycopg2.connect; read from database.ini if not given
+            retry_interval (int): seconds to wait after a failed connection attempt before making another
+        """
+        self.params = params
+        self.retry_interval = retry_interval
+        self._conn = None
+        self._failed_at = None
+        self._reconnecting = None  # the thread connecting in the background, if any
+        self._handlers = {}  # channel -> [handler]
+        self._lock = threading.RLock()
+        self.received = 0
+
+    def subscribe(self, channel, handler):
+        """
+        Calls a handler for every notification on a channel.
+        Args:
+            channel (str): notification channel
+            handler (function): called with the payload (str) of each notification, or None if some may have been
+                missed
+        Returns: None
+        """
+        with self._lock:
+            new = channel not in self._handlers
+            self._handlers.setdefault(channel, []).append(handler)
+            if new and self._conn is not None and not self._conn.closed:
+                try:
+                    with self._conn.cursor() as cur:
+                        cur.execute(f'LISTEN {channel}')
+                except psycopg2.Error:
+                    self._close()
+
+    def _connect(self):
+        """
+        Opens the connection and listens on every subscribed channel. Must be called with the lock held.
+        Returns ([(function, None)]): calls to make for the handlers
+        """
+        conn = psycopg2.connect(**connection_params(self.params or pgSqlConfig()))
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            for channel in self._handlers:
+                cur.execute(f'LISTEN {channel}')
+        self._conn = conn
+        return [(handler, None) for handlers in self._handlers.values() for handler in handlers]
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+        self._conn = None
+
+    def _collect(self):
+        """
+        Reads pending notifications, connecting first if needed. Must be called with the lock held.
+        Returns ([(function, str)]): calls to make for the handlers
+        """
+        if self._conn is None or self._conn.closed:
+            return self._connect()
+        self._conn.poll()
+        calls = []
+        for notify in self._conn.notifies:
+            self.received += 1
+            calls += [(handler, notify.payload) for handler in self._handlers.get(notify.channel, [])]
+        del self._conn.notifies[:]
+        return calls
+
+    def poll(self, connect=True):
+        """
+        Delivers the notifications received since the last poll.
+        Args:
+            connect (bool): whether to (re)connect, if the connection isn't open. If False, the call never waits: it
+                returns False at once if the connection isn't open, which a background thread then opens, or if
+                another thread is using it; notifications not delivered are kept for the next poll
+        Returns (bool): False if the database could not be reached
+        """
+        if not self._lock.acquire(blocking=connect):
+            return False
+        try:
+            if not connect and (self._conn is None or self._conn.closed):
+                self._reconnect_in_background()
+                return False
+            if self._conn is None and self._failed_at is not None \
+                    and time.monotonic() - self._failed_at < self.retry_interval:
+                return False
+            try:
+                calls = self._collect()
+                self._failed_at = None
+                ok = True
+            except psycopg2.Error:
+                self._close()
+                self._failed_at = time.monotonic()
+                calls = []
+                ok = False
+        finally:
+            self._lock.release()
+        for handler, payload in calls:
+            handler(payload)
+        return ok
+
+    def _reconnect_in_background(self):
+        """
+        Starts a thread that makes one attempt to connect, unless one is running already or the last attempt failed
+        less than retry_interval seconds ago. Must be called with the lock held.
+        Returns: None
+        """
+        if self._reconnecting is not None and self._reconnecting.is_alive():
+            return
+        if self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_interval:
+            return
+        self._reconnecting = threading.Thread(target=self.poll, name='notify-reconnect', daemon=True)
+        self._reconnecting.start()
+
+    def cursor(self):
+        """
+        Opens a cursor on the listening connection, for short autocommitted queries such as reading the schema.
+        Pending notifications are delivered first.
+        Returns: a psycopg2 cursor
+        Raises: psycopg2.Error if the database could not be reached
+        """
+        if not self.poll():
+            raise psycopg2.OperationalError('could not connect to the database to listen for notifications')
+        with self._lock:
+            return self._conn.cursor()
+
+    def close(self):
+        """
+        Closes the connection, e.g. before the process forks. The next poll connects again, and handlers are then
+        told that notifications may have been missed.
+        Returns: None
+        """
+        with self._lock:
+            self._close()
+            self._failed_at = None
+
+    def stats(self):
+        """
+        Returns (dict): number of notifications received, and whether the connection is open
+        """
+        return {'received': self.received, 'listening': self._conn is not None and not self._conn.closed}
+
+
+notifications = Listener()
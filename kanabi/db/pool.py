@@ -0,0 +1,348 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+from .connection import backoff
+from .dbConfig import connection_params, pgSqlConfig
+
+pool_defaults = {
+    'min_size': 1,
+    'max_size': 10,
+    'max_idle': 300,
+    'timeout': 30,
+    'check_after': 30,
+    'connect_retries': 2,
+}
+
+
+class PoolExhaustedException(Exception):
+    """
+    Thrown when no connection could be checked out of a pool before the timeout expired.
+    """
+    pass
+
+
+def pool_config(filename='kanabi/db/database.ini', section='pool'):
+    """
+    Reads the pool sizing parameters, falling back to defaults for anything not configured.
+    Args:
+        filename (str): file to parse
+        section (str): section of the file holding the pool parameters
+    Returns (dict): pool parameters as numbers
+    """
+    config = dict(pool_defaults)
+    try:
+        for key, value in pgSqlConfig(filename, section).items():
+            if key in config:
+                config[key] = type(pool_defaults[key])(value)
+    except Exception:
+        pass
+    return config
+
+
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of connections belonging to a single database role.
+    Connections are opened lazily up to max_size, handed back to the pool after use and closed once they have been
+    idle for longer than max_idle seconds (while keeping at least min_size of them open).
+    Connections use TCP keepalives, and one that has been idle for longer than check_after seconds is checked with a
+    round trip when it is checked out, so that recently used connections are handed out without a liveness query.
+    A connection that fails its check, or that can't be opened, is replaced transparently. One lost while it is
+    checked out (including between its last check and a query) fails that query; driver.read_with_retry runs reads
+    again on a fresh connection, writes are left to the caller.
+    """
+
+    def __init__(self, params, min_size=1, max_size=10, max_idle=300, timeout=30, check_after=30,
+                 connect_retries=2):
+        """
+        Args:
+            params ({}): keyword arguments passed to psycopg2.connect
+            min_size (int): number of idle connections that are never evicted
+            max_size (int): maximum number of connections, idle and in use
+            max_idle (int): seconds a connection may sit idle before it is closed
+            timeout (int): seconds to wait for a free connection before giving up
+            check_after (int): seconds of idleness after which a connection is checked before it is handed out
+            connect_retries (int): further attempts, with backoff, to open a connection that failed to open
+        """
+        self.params = params
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.check_after = check_after
+        self.connect_retries = connect_retries
+        self._idle = []  # list of (connection, time returned to pool), most recently used last
+        self._in_use = set()
+        self._lock = threading.Condition()
+        self._closed = False
+        self.waits = 0
+        self.wait_time = 0.0
+        self.created = 0
+        self.discarded = 0
+        self.checks = 0
+        self.retries = 0
+
+    def _connect(self):
+        """
+        Opens a connection, trying again with backoff if the server can't be reached.
+        Returns: a psycopg2 connection
+        Raises: psycopg2.OperationalError if the last attempt failed too
+        """
+        delays = backoff(base=0.1, cap=1.0)
+        for attempt in range(self.connect_retries + 1):
+            try:
+                conn = psycopg2.connect(**connection_params(self.params))
+                self.created += 1
+                return conn
+            except psycopg2.OperationalError:
+                if attempt == self.connect_retries:
+                    raise
+                self.retries += 1
+                time.sleep(next(delays))
+
+    def _is_alive(self, conn):
+        """
+        Checks a connection with a round trip to the server.
+        Args:
+            conn: idle connection to check
+        Returns (bool): whether the connection answered
+        """
+        self.checks += 1
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _is_healthy(conn):
+        """
+        Checks a connection without a round trip to the server.
+        Args:
+            conn: connection to check
+        Returns (bool): whether the connection can be handed out
+        """
+        return not conn.closed and \
+            conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+
+    def _discard(self, conn):
+        self.discarded += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _evict_idle(self):
+        """
+        Closes connections that have been idle for too long. Must be called with the lock held.
+        """
+        cutoff = time.monotonic() - self.max_idle
+        while len(self._idle) > self.min_size and self._idle[0][1] < cutoff:
+            conn, _ = self._idle.pop(0)
+            self._discard(conn)
+
+    def getconn(self):
+        """
+        Checks a connection out of the pool, opening a new one if there is room, or waiting for one to be returned.
+        A connection that was idle for longer than check_after seconds is checked first, and replaced if it is dead.
+        Returns: a psycopg2 connection
+        Raises: PoolExhaustedException if no connection became available in time; psycopg2.OperationalError if a
+            new connection could not be opened
+        """
+        while True:
+            conn, idle_since = self._checkout()
+            if idle_since is None or time.monotonic() - idle_since < self.check_after or self._is_alive(conn):
+                return conn
+            # the server closed it, or went away; the other idle connections are likely dead too, so they are
+            # checked (or evicted) as well
+            self.retries += 1
+            with self._lock:
+                self._in_use.discard(conn)
+                self._discard(conn)
+                self._idle = [(idle, 0) for idle, _ in self._idle]
+                self._lock.notify()
+
+    def _checkout(self):
+        """
+        Takes an idle connection, or opens a new one if there is room, or waits for one to be returned.
+        Returns ((connection, float)): the connection, and when it was returned to the pool (None if new)
+        """
+        with self._lock:
+            started = None
+            while True:
+                if self._closed:
+                    raise psycopg2.InterfaceError('connection pool is closed')
+                self._evict_idle()
+                while self._idle:
+                    conn, idle_since = self._idle.pop()
+                    if self._is_healthy(conn):
+                        self._in_use.add(conn)
+                        return conn, idle_since
+                    self._discard(conn)
+                if len(self._in_use) < self.max_size:
+                    break
+                if started is None:
+                    started = time.monotonic()
+                    self.waits += 1
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0 or not self._lock.wait(remaining):
+                    self.wait_time += time.monotonic() - started
+                    raise PoolExhaustedException(f'No connection available after {self.timeout}s')
+            if started is not None:
+                self.wait_time += time.monotonic() - started
+            # reserve the slot before releasing the lock to connect
+            placeholder = object()
+            self._in_use.add(placeholder)
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._lock:
+                self._in_use.discard(placeholder)
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._in_use.discard(placeholder)
+            self._in_use.add(conn)
+        return conn, None
+
+    def putconn(self, conn, close=False):
+        """
+        Returns a connection to the pool. Any open transaction is rolled back first.
+        Args:
+            conn: connection previously obtained from getconn
+            close (bool): close the connection instead of keeping it for reuse
+        Returns: None
+        """
+        broken = not self._is_healthy(conn)
+        if not close and not broken:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        with self._lock:
+            self._in_use.discard(conn)
+            if close or broken or self._closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            if broken:
+                # the connection was lost while in use; check the idle ones before they are handed out again
+                self._idle = [(idle, 0) for idle, _ in self._idle]
+            self._evict_idle()
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that checks a connection out and always returns it to the pool.
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        """
+        Returns (dict): current usage counters for this pool
+        """
+        with self._lock:
+            return {
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'max_size': self.max_size,
+                'waits': self.waits,
+                'wait_time': round(self.wait_time, 6),
+                'created': self.created,
+                'discarded': self.discarded,
+                'checks': self.checks,
+                'retries': self.retries,
+            }
+
+    def closeall(self):
+        """
+        Closes every idle connection; connections in use are closed when they are returned.
+        Returns: None
+        """
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+            self._lock.notify_all()
+
+
+class PoolManager:
+    """
+    Holds one ConnectionPool per database role, created on first use.
+    """
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+        self.config = None
+
+    def get_pool(self, role, password):
+        """
+        Returns the pool for a database role, creating it if needed. A changed password replaces the pool.
+        Args:
+            role (str): database role (user name) to connect as
+            password (str): password for the role
+        Returns (ConnectionPool): the role's pool
+        """
+        with self._lock:
+            pool = self._pools.get(role)
+            if pool is not None and pool.params.get('password') == password:
+                return pool
+            if self.config is None:
+                self.config = pool_config()
+            params = pgSqlConfig()
+            params['user'] = role
+            params['password'] = password
+            new_pool = ConnectionPool(params, **self.config)
+            self._pools[role] = new_pool
+        if pool is not None:
+            pool.closeall()
+        return new_pool
+
+    def remove(self, role):
+        """
+        Closes and forgets the pool of a role, e.g. once the role has been dropped.
+        Args:
+            role (str): database role
+        Returns: None
+        """
+        with self._lock:
+            pool = self._pools.pop(role, None)
+        if pool is not None:
+            pool.closeall()
+
+    def stats(self):
+        """
+        Returns (dict): usage counters for every pool, keyed by role, plus totals
+        """
+        with self._lock:
+            pools = dict(self._pools)
+        ret = {role: pool.stats() for role, pool in pools.items()}
+        totals = {'in_use': 0, 'idle': 0, 'waits': 0, 'wait_time': 0.0, 'checks': 0, 'retries': 0}
+        for s in ret.values():
+            for key in totals:
+                totals[key] += s[key]
+        totals['wait_time'] = round(totals['wait_time'], 6)
+        return {'pools': ret, 'total': totals}
+
+    def closeall(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.closeall()
+
+
+pools = PoolManager()
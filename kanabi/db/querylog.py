@@ -0,0 +1,63 @@
+import json
+import threading
+import time
+
+from .dbConfig import pgSqlConfig
+
+
+def querylog_config(filename='kanabi/db/database.ini', section='querylog'):
+    """
+    Reads where filter queries should be logged.
+    Args:
+        filename (str): file to parse
+        section (str): section of the file holding the query log parameters
+    Returns (str): path of the log file, or '' if queries are not logged
+    """
+    try:
+        return pgSqlConfig(filename, section).get('path', '')
+    except Exception:
+        return ''
+
+
+class QueryLog:
+    """
+    Appends the queries built by QueryParser, with their parameters and run time, to a file of JSON lines.
+    The log is what the index advisor (python -m kanabi.db.advisor) replays.
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str): log file; read from the [querylog] section of database.ini if not given, '' disables logging
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, query, params, duration):
+        """
+        Logs one query, if logging is enabled.
+        Args:
+            query (str): SQL with %s placeholders
+            params (tuple): parameter values
+            duration (float): seconds taken to run the query and fetch its results
+        Returns: None
+        """
+        if self.path is None:
+            self.path = querylog_config()
+        if not self.path:
+            return
+        line = json.dumps({
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'query': query,
+            'params': list(params),
+            'duration': round(duration, 6)
+        }, default=str)
+        with self._lock:
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(line + '\n')
+            except OSError:
+                pass
+
+
+query_log = QueryLog()
@@ -0,0 +1,198 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from .dbConfig import pgSqlConfig
+from .notify import notifications
+
+# channel notified by the change_fnc trigger with the name of each table written to
+changes_channel = 'kanabi_changes'
+# tables that change_fnc writes to whenever an audited table changes
+audit_tables = ('txn_history', 'archive')
+
+resultcache_defaults = {
+    'max_bytes': 64 * 1024 * 1024,
+    'max_entry_bytes': 8 * 1024 * 1024,
+    'ttl': 300,
+}
+
+
+def resultcache_config(filename='kanabi/db/database.ini', section='resultcache'):
+    """
+    Reads the result cache sizing parameters, falling back to defaults for anything not configured.
+    Args:
+        filename (str): file to parse
+        section (str): section of the file holding the result cache parameters
+    Returns (dict): result cache parameters as numbers
+    """
+    config = dict(resultcache_defaults)
+    try:
+        for key, value in pgSqlConfig(filename, section).items():
+            if key in config:
+                config[key] = type(resultcache_defaults[key])(value)
+    except Exception:
+        pass
+    return config
+
+
+class ResultCache:
+    """
+    Keeps the encoded responses of read endpoints, keyed by table, database role and query, so that repeated reads
+    of unchanged data are answered without running the query again.
+    Entries are dropped when their table is written to, whether by this process (see table_changed) or by another one
+    (through the change_fnc trigger's notifications), after ttl seconds, and least recently used first once the
+    cache holds more than max_bytes.
+    """
+
+    def __init__(self, max_bytes=None, max_entry_bytes=None, ttl=None, listener=None):
+        """
+        Args:
+            max_bytes (int): total size of the cached responses
+            max_entry_bytes (int): size above which a response is not cached
+            ttl (int): seconds an entry is served for; 0 disables the cache
+            listener (Listener): source of table change notifications; the shared one if not given
+        Sizes not given are read from the [resultcache] section of database.ini.
+        """
+        config = resultcache_config()
+        self.max_bytes = config['max_bytes'] if max_bytes is None else max_bytes
+        self.max_entry_bytes = config['max_entry_bytes'] if max_entry_bytes is None else max_entry_bytes
+        self.ttl = config['ttl'] if ttl is None else ttl
+        self.listener = listener or notifications
+        self.listener.subscribe(changes_channel, self._changed)
+        self._entries = OrderedDict()  # (table, role, key) -> (body, etag, expiry time)
+        self._generations = {}  # table -> number of times it was invalidated
+        self._epoch = 0  # number of times the whole cache was cleared
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _changed(self, payload):
+        if payload is None:
+            self.clear()
+        else:
+            self.table_changed(payload)
+
+    def _drop(self, key):
+        body, _, _ = self._entries.pop(key)
+        self._size -= len(body)
+
+    def get(self, table, role, key):
+        """
+        Looks up a response.
+        Args:
+            table (str): table the response was read from
+            role (str): database role of the user
+            key: hashable description of the query, e.g. its SQL and parameters
+        Returns ((bytes, str)): the response body and its ETag, or None if not cached
+        """
+        if not self.ttl:
+            return None
+        if not self.listener.poll():
+            # changes made by other processes can't be heard of, so nothing cached can be trusted
+            return None
+        with self._lock:
+            entry = self._entries.get((table, role, key))
+            if entry is not None and entry[2] < time.monotonic():
+                self._drop((table, role, key))
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((table, role, key))
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def generation(self, table):
+        """
+        Args:
+            table (str): table name
+        Returns ((int, int)): counters that change whenever the table's entries are invalidated; take them before
+            running a query and pass them to put, so that a result read before a write is not cached after it
+        """
+        with self._lock:
+            return self._epoch, self._generations.get(table, 0)
+
+    def put(self, table, role, key, body, generation=None):
+        """
+        Caches a response.
+        Args:
+            table (str): table the response was read from
+            role (str): database role of the user
+            key: hashable description of the query
+            body (bytes): encoded response
+            generation ((int, int)): the table's generation from before the query ran
+        Returns (str): the ETag of the response
+        """
+        etag = hashlib.md5(body).hexdigest()
+        if not self.ttl or len(body) > self.max_entry_bytes:
+            return etag
+        # hear of the writes made while the query ran, so that they invalidate this result
+        if not self.listener.poll():
+            return etag
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(table, 0)):
+                return etag
+            if (table, role, key) in self._entries:
+                self._drop((table, role, key))
+            self._entries[(table, role, key)] = (body, etag, time.monotonic() + self.ttl)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return etag
+
+    def invalidate(self, *tables):
+        """
+        Drops the entries of some tables.
+        Args:
+            tables (str): table names
+        Returns: None
+        """
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            stale = [key for key in self._entries if key[0] in tables]
+            for key in stale:
+                self._drop(key)
+            self.invalidations += len(stale)
+
+    def table_changed(self, table):
+        """
+        Drops the entries of a table that was written to, and of the audit tables its triggers write to.
+        Args:
+            table (str): table name
+        Returns: None
+        """
+        self.invalidate(table, *audit_tables)
+
+    def clear(self):
+        """
+        Drops every entry.
+        Returns: None
+        """
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        """
+        Returns (dict): hit, miss, eviction and invalidation counters, and the number and size of the entries
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self._size,
+            }
+
+
+result_cache = ResultCache()
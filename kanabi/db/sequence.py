@@ -0,0 +1,16 @@
+def reserve_rows(cur, table, count, exclude=None):
+    """
+    Reserves unused row numbers for a table from its <table>_row_seq sequence, in one round trip.
+    Numbers already used by the table, or listed in exclude, are skipped. Reserved numbers are never handed out
+    again, even if the transaction that reserved them rolls back.
+    Args:
+        cur ({}): the Postgres cursor
+        table (str): table name
+        count (int): how many row numbers to reserve
+        exclude ([int]): row numbers that must not be handed out, e.g. explicit row numbers of a pending batch
+    Returns ([int]): the reserved row numbers, in ascending order
+    """
+    if count <= 0:
+        return []
+    cur.execute("SELECT reserve_rows(%s, %s, %s::integer[])", (table, count, list(exclude or [])))
+    return [x[0] for x in cur.fetchall()]
@@ -0,0 +1,134 @@
+import hashlib
+import re
+import threading
+import weakref
+from collections import OrderedDict
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+statement_prefix = 'kq_'
+placeholder_pattern = re.compile(r'%(s|%)')
+
+
+def statement_name(query):
+    """
+    Derives a stable prepared statement name from the query text.
+    Args:
+        query (str): SQL with %s placeholders
+    Returns (str): statement name
+    """
+    return statement_prefix + hashlib.md5(query.encode()).hexdigest()[:16]
+
+
+def numbered_placeholders(query):
+    """
+    Rewrites psycopg2-style %s placeholders as the $1, $2, ... parameters that PREPARE expects.
+    Args:
+        query (str): SQL with %s placeholders
+    Returns ((str, int)): the rewritten SQL and its number of parameters
+    """
+    count = 0
+
+    def number(match):
+        nonlocal count
+        if match.group(1) == '%':
+            return '%'
+        count += 1
+        return f'${count}'
+
+    return placeholder_pattern.sub(number, query), count
+
+
+class StatementCache:
+    """
+    Keeps a server-side prepared statement for each distinct query shape run on a connection.
+    A query's shape is its SQL text with the operand values left out as placeholders, so repeated requests that only
+    differ in their values skip parsing and planning. Prepared statements live as long as the session, so they are
+    tracked per connection, and the least recently used ones are deallocated beyond max_size.
+    """
+
+    def __init__(self, max_size=100):
+        """
+        Args:
+            max_size (int): maximum number of statements kept prepared on one connection
+        """
+        self.max_size = max_size
+        self._prepared = weakref.WeakKeyDictionary()  # connection -> OrderedDict of query -> (name, parameter count)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _statements(self, conn):
+        with self._lock:
+            statements = self._prepared.get(conn)
+            if statements is None:
+                statements = self._prepared[conn] = OrderedDict()
+            return statements
+
+    def forget(self, conn):
+        """
+        Drops what is known about the statements of a connection, e.g. after they were deallocated behind our back.
+        Args:
+            conn: the connection
+        Returns: None
+        """
+        with self._lock:
+            self._prepared.pop(conn, None)
+
+    def execute(self, cur, query, params=()):
+        """
+        Runs a query through the connection's prepared statement for its shape, preparing it on first use.
+        If the session's statements turn out not to match what was recorded, they are rebuilt. That takes rolling the
+        transaction back, so it is only done when this is the first statement of its transaction; otherwise the error
+        is raised, and the statements are rebuilt by the next transaction that needs them.
+        Args:
+            cur ({}): the Postgres cursor
+            query (str): SQL with %s placeholders, as rendered from QueryParser.build_query
+            params (tuple): parameter values
+        Returns: None; results are read from the cursor as usual
+        """
+        idle = cur.connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        try:
+            self._execute(cur, query, params)
+        except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.DuplicatePreparedStatement):
+            if not idle:
+                # rolling back would undo the caller's earlier statements
+                self.forget(cur.connection)
+                raise
+            # something else prepared or deallocated statements on this session; start over with a clean slate
+            cur.connection.rollback()
+            cur.execute('DEALLOCATE ALL')
+            self.forget(cur.connection)
+            self._execute(cur, query, params)
+
+    def _execute(self, cur, query, params):
+        statements = self._statements(cur.connection)
+        entry = statements.get(query)
+        if entry is None:
+            self.misses += 1
+            body, count = numbered_placeholders(query)
+            entry = (statement_name(query), count)
+            cur.execute(f'PREPARE {entry[0]} AS {body}')
+            statements[query] = entry
+            if len(statements) > self.max_size:
+                _, (old_name, _) = statements.popitem(last=False)
+                cur.execute(f'DEALLOCATE {old_name}')
+        else:
+            self.hits += 1
+            statements.move_to_end(query)
+        name, count = entry
+        if count:
+            cur.execute(f"EXECUTE {name}({', '.join(['%s'] * count)})", params)
+        else:
+            cur.execute(f'EXECUTE {name}')
+
+    def stats(self):
+        """
+        Returns (dict): cache hit and miss counters
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+statements = StatementCache()
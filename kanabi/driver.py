@@ -1,65 +1,144 @@
-import collections
 import json
 import os
+import queue
 import sys
+import threading
 import time
+from contextlib import contextmanager
 
 import numpy as np
-import pandas as pd
 import psycopg2
+from psycopg2 import sql
 
-from openpyxl import load_workbook
-
+import kanabi.db.bulk as bulk
 import kanabi.db.connection as c
+from kanabi.db.catalog import catalog
+from kanabi.db.notify import notifications
+from kanabi.db.pool import pools
+from kanabi.db.querylog import query_log
+from kanabi.db.resultcache import result_cache
+from kanabi.db.sequence import reserve_rows
+from kanabi.db.statements import statements
+from kanabi.metrics import metrics
 from kanabi.models.IntakeRow import ColNames, intake_headers, IntakeRow
-from kanabi.query_parser import QueryParser, RequestParseException
-from kanabi.validation.intake_validation import validate_intake
-from .user import User
+from kanabi.query_parser import QueryParser, RequestParseException, encode_token, table_keys
+from kanabi.readers import reader_for
+from kanabi.validation.intake_conversion import ConversionException, convert_intake_frame, convert_value, \
+    intake_column_types
+from kanabi.validation.intake_validation import validate_intake, validate_intake_record, validate_intake_row
+from .user import User, users_channel
 
 test_file = 'resources/sample.xlsx'
 primary_table = 'intake'
 metadata_table = 'metadata'
 connection_error_msg = 'The connection to the database is closed and cannot be opened. Verify DB server is up.'
 login_required_msg = 'Must be logged in to perform action'
-row_seq = {"intake": 1, "violations": 1, "reports": 1}
-
-# TODO: refactor to remove duplicated code
+# outcome of each archive row given to restore_row, by the status restore_rows reports for it
+restore_messages = {
+    'restored': 'Successfully restored',
+    'conflict': "Can't restore the row. Duplicate row id, MRL, or receipt num.",
+    'missing': 'Not found in the archive'
+}
+stream_chunk_size = 2000
+upload_batch_size = 5000
+# bytes of COPY output handed to the response at a time, and blocks of it buffered ahead of a slow client
+copy_block_size = 64 * 1024
+copy_blocks_ahead = 16
+
+# the admin connection (pgSqlCur, pgSqlConn) is shared by the threads of the process; hold this lock to use it
+admin_lock = threading.RLock()
+
+# The admin connection is made by start(), or by the first request that needs it; importing this module doesn't
+# wait for the database
 is_connected = False
-wait_time = 0
-while not is_connected:
-    try:
-        pgSqlCur, pgSqlConn = c.pg_connect()
-        is_connected = True
-    except:
-        time.sleep(1)
-        wait_time += 1
-        sys.stdout.write(f'\rConnecting to DB ... {wait_time}\n')
-
-
-def reconnectDB():
+pgSqlCur = pgSqlConn = None
+# seconds a request waits for the admin connection to be made again before it gives up
+reconnect_timeout = 30
+# seconds the admin connection may sit idle before check_conn makes sure it still works
+admin_check_after = 30
+# times a read whose pooled connection turned out to be lost is run again on a fresh connection
+read_retries = 1
+_admin_used_at = 0.0  # time.monotonic() when check_conn last handed the admin connection out
+_connector = None  # thread of start()
+_connector_lock = threading.Lock()
+
+
+def reconnectDB(timeout=reconnect_timeout):
     """
-    Function to reconnect to the database if connection is closed for some reason
-    Args:   None
+    Function to reconnect to the database if connection is closed for some reason, retrying with exponential
+    backoff and jitter
+    Args:
+        timeout (float): seconds to keep trying; no limit if None
     Return (bool): True if connection successful, else False
     """
-    wait_time = 0
     global pgSqlConn, pgSqlCur
     global is_connected
     is_connected = False
-    while not is_connected:
-        try:
-            pgSqlCur, pgSqlConn = c.pg_connect()
+    connected = c.pg_connect_retry(timeout)
+    if connected is None:
+        return False
+    with admin_lock:
+        if is_connected:
+            # another thread got there first
+            c.pg_disconnect(*connected)
+        else:
+            pgSqlCur, pgSqlConn = connected
             is_connected = True
-            return is_connected
-        except:
-            time.sleep(1)
-            wait_time += 1
-            sys.stdout.write(f'\rConnecting to DB ... {wait_time}\n')
-            if wait_time >= 30:
-                return False
     return True
 
 
+def _connect_in_background():
+    try:
+        if reconnectDB(timeout=None):
+            # read the schema now rather than in the first request
+            catalog.schema()
+    except Exception as err:
+        sys.stderr.write(f'\nCould not connect to the database: {err}')
+
+
+def start():
+    """
+    Startup hook of a server process: connects to the database in a background thread, retrying with backoff
+    until the database is up, then reads the schema catalog. Meanwhile requests that need the database fail with
+    connection_error_msg and db_ready() is False. Does nothing if a connection attempt is already under way.
+    Returns (threading.Thread): the thread making the connection
+    """
+    global _connector
+    with _connector_lock:
+        if _connector is None or not _connector.is_alive():
+            _connector = threading.Thread(target=_connect_in_background, name='db-connect', daemon=True)
+            _connector.start()
+        return _connector
+
+
+def connecting():
+    """
+    Returns (bool): whether start() is still trying to connect
+    """
+    connector = _connector
+    return connector is not None and connector.is_alive()
+
+
+def db_ready():
+    """
+    Checks that the database can be reached, for readiness probes, with a round trip on the admin connection
+    unless another thread is busy with it. If the connection is down, start() makes it again in the background.
+    Returns (bool): whether the database is connected
+    """
+    global is_connected
+    if is_connected and admin_lock.acquire(timeout=1):
+        try:
+            pgSqlCur.execute('SELECT 1')
+            pgSqlConn.rollback()
+        except psycopg2.Error:
+            is_connected = False
+        finally:
+            admin_lock.release()
+    if not is_connected:
+        start()
+    return is_connected
+
+
 def table_rows_to_dicts(rows, cur, columns=None):
     """
     Constructs a dict from rows of a table.
@@ -95,53 +174,132 @@ def get_table_list():
     Gets the database's active tables.
     Returns ([str]): list of table names
     """
-    try:
-        pgSqlCur.execute("""
-        SELECT table_name 
-        FROM information_schema.tables
-        WHERE table_name 
-        NOT LIKE 'pg_%'
-            AND table_schema='public'; 
-        """)
-        return [str(x[0]) for x in pgSqlCur.fetchall()]
-    except psycopg2.Error as err:
-        sql_except(err)
-
-
-db_tables = get_table_list()
+    return sorted(catalog.tables())
 
 
 def check_conn():
     """
-    Function to check the connection to the database and reconnect if closed
+    Function to check the connection to the database and reconnect if closed. Only a connection that has been idle
+    for longer than admin_check_after seconds is checked with a round trip; a connection lost since its last use
+    shows as closed once a query on it has failed. Call with admin_lock held.
     Args:  None
     Return (bool): True if connected, False if connection could not be established
     """
-    if not is_connected:
-        return reconnectDB()
-    # check to make sure that the connection is open and active
-    try:
-        pgSqlCur.execute('SELECT 1')
-        return True
-    except psycopg2.Error:
-        return reconnectDB()
+    global _admin_used_at
+    if not is_connected or pgSqlConn.closed:
+        # don't wait on a database that start() is still waiting for
+        if connecting() or not reconnectDB():
+            return False
+    elif time.monotonic() - _admin_used_at > admin_check_after:
+        try:
+            pgSqlCur.execute('SELECT 1')
+            pgSqlConn.rollback()
+        except psycopg2.Error:
+            if not reconnectDB():
+                return False
+    _admin_used_at = time.monotonic()
+    return True
 
 
+@contextmanager
 def user_cursor(user):
     """
-    Creates a new Postgres connection cursor associated with the provided user.
+    Checks out a pooled Postgres connection associated with the provided user and opens a cursor on it.
+    The connection is returned to the user's pool (and any open transaction rolled back) when the block exits.
+    Usage:
+        with user_cursor(user) as (cur, conn):
+            ...
     Args:
         user (User): associated user
-    Returns (cursor, conn): Postgres connection and cursor
+    Yields (cursor, conn): Postgres cursor and connection, or (None, None) if no connection could be made
     """
     try:
-        conn = psycopg2.connect(sslmode="require", dbname="kanabi", user=user.email, password=user.password,
-                                host="db")
-        cur = conn.cursor()
-        conn.commit()
-    except psycopg2.DatabaseError:
-        return None, None
-    return cur, conn
+        with metrics.timer('connect'):
+            pool = pools.get_pool(user.email, user.password)
+            conn = pool.getconn()
+    except Exception:
+        yield None, None
+        return
+    cur = conn.cursor()
+    try:
+        yield cur, conn
+    finally:
+        cur.close()
+        pool.putconn(conn)
+
+
+def read_with_retry(user, read):
+    """
+    Runs a read on one of the user's pooled connections. The pool only checks connections that sat idle for a while,
+    so one may be lost (the server restarted, or dropped it) by the time a query runs on it; the read is then run
+    again, up to read_retries times, on a fresh connection. Only reads that change nothing and return their whole
+    result qualify: writes may have happened before the connection was lost, and streamed rows may have been sent.
+    Args:
+        user (User): associated user
+        read (function): called with (cursor, conn), returns the result of the read
+    Returns: the result of read, or None if no connection could be made
+    Raises: psycopg2.Error raised by read, other than a lost connection that could be retried
+    """
+    for attempt in range(read_retries + 1):
+        with user_cursor(user) as (cur, conn):
+            if cur is None:
+                return None
+            try:
+                return read(cur, conn)
+            except psycopg2.OperationalError:
+                # a lost connection reads as closed; a cancelled or timed out query leaves it open, and is not retried
+                if not conn.closed or attempt == read_retries:
+                    raise
+            # returning the lost connection has the pool check its idle ones before handing them out
+
+
+@contextmanager
+def admin_cursor():
+    """
+    Gives a thread sole use of the admin connection, reconnecting it first if it was closed.
+    Usage:
+        with admin_cursor() as (cur, conn):
+            ...
+    Yields (cursor, conn): Postgres cursor and connection
+    Raises: psycopg2.OperationalError if the database can't be reached
+    """
+    with admin_lock:
+        if not check_conn():
+            raise psycopg2.OperationalError(connection_error_msg)
+        yield pgSqlCur, pgSqlConn
+
+
+def close_connections():
+    """
+    Closes every database connection of the process: the admin connection, the pooled connections and the
+    notification listener's. Called before a server process forks its workers, so that no worker inherits a
+    connection another process uses, and when a worker exits. Connections are made again when next needed.
+    Returns: None
+    """
+    global is_connected
+    with admin_lock:
+        if is_connected:
+            try:
+                pgSqlConn.close()
+            except psycopg2.Error:
+                pass
+        is_connected = False
+    pools.closeall()
+    notifications.close()
+
+
+def pool_stats():
+    """
+    Reports usage of the per-role connection pools, of the prepared statements kept on their connections, of the
+    schema catalog and of the result cache.
+    Returns (dict): counters (in use, idle, waits, wait time) per role and in total, statement cache hits/misses,
+        the number of schema loads and result cache hits/misses
+    """
+    stats = pools.stats()
+    stats['statements'] = statements.stats()
+    stats['catalog'] = catalog.stats()
+    stats['results'] = result_cache.stats()
+    return stats
 
 
 def sql_except(err):
@@ -152,7 +310,12 @@ def sql_except(err):
     Returns: None
     """
     # roll back the last sql command
-    pgSqlCur.execute("ROLLBACK")
+    with admin_lock:
+        if is_connected:
+            try:
+                pgSqlCur.execute("ROLLBACK")
+            except psycopg2.Error:
+                pass
     # get the details for exception
     err_type, err_obj, traceback = sys.exc_info()
 
@@ -184,23 +347,13 @@ def fmt(s):
 
 def table_exists(cur, table):
     """
-    Checks whether the named table exists.
+    Checks whether the named table exists, against the schema catalog rather than with a query.
     Args:
         cur ({}): the Postgres cursor
         table (str): the table to validate
     Returns (bool): whether the table was found
     """
-    # check to make sure that the connection is open and active
-    if not check_conn():
-        return connection_error_msg
-    try:
-        cur.execute("select exists(select relname from pg_class where relname='" + table + "')")
-        exists = cur.fetchone()[0]
-
-    except psycopg2.Error:
-        exists = False
-
-    return exists
+    return catalog.has_table(table)
 
 
 class InvalidTableException(Exception):
@@ -226,45 +379,84 @@ def filter_table(request_body: json, user: User) -> (str, json, int):
         request_body ({}): a JSON object, which must conform to a defined schema and is parsed to build the query
         user: a User object holding the information for user making function call
     Returns:
-         query (str): the query string passed to the database
-         response ({}): the retrieved data
+         query (str): the query string passed to the database, with %s placeholders for the operands
+         response ({}): the retrieved data; for a request with a limit, {'results': <one page>, 'next': <token>}
+            where passing the token back as 'after' fetches the following page (null on the last page)
          status (int): the HTTP status code of the response
     """
     if not user.is_authenticated:
         return None, login_required_msg, 400
-    cur, conn = user_cursor(user)
-    if cur is None:
-        return None, connection_error_msg, 500
     try:
-        qp = QueryParser(db_tables)
-        query = qp.build_query(request_body)
+        with metrics.timer('compile'):
+            qp = QueryParser(catalog.schema())
+            query, params = qp.build_query(request_body)
     except RequestParseException as e:
         return 'JSON could not be parsed', e.msg, 400
+
+    def read(cur, conn):
+        # get our query results, through the connection's prepared statement for this query shape
+        sql = query.as_string(conn)
+        started = time.monotonic()
+        with metrics.timer('execute'):
+            statements.execute(cur, sql, params)
+        with metrics.timer('fetch'):
+            rows = cur.fetchall()
+        query_log.record(sql, params, time.monotonic() - started)
+        return sql, rows
+
     try:
-        # get our query results
-        cur.execute(query)
-        results = cur.fetchall()
-        # get our column names
-        table = request_body['table']
-        col_names = request_body.get('columns')
-        if col_names is None:
-            if table == 'intake':
-                col_names = IntakeRow.__slots__
-            else:
-                return None, f"Querying table {table} is not supported", 400
-        # we need an array of objects where the keys are column names
-        ret = []
-        # results are in arrays, ordered by table index
-        num_results = len([x for x in results])
+        fetched = read_with_retry(user, read)
+    except psycopg2.Error as err:
+        sql_except(err)
+        return None, str(err), 400
+    if fetched is None:
+        return None, connection_error_msg, 500
+    query, results = fetched
+    # get our column names
+    table = request_body['table']
+    col_names = request_body.get('columns')
+    if col_names is None:
+        if table == 'intake':
+            col_names = IntakeRow.__slots__
+        else:
+            return None, f"Querying table {table} is not supported", 400
+    # we need an array of objects where the keys are column names
+    ret = []
+    # results are in arrays, ordered by table index
+    num_results = len([x for x in results])
+    if qp.limit is not None:
+        # the query asks for one row more than the page size, to find out whether there is a next page
+        has_next = num_results > qp.limit
+        num_results = min(num_results, qp.limit)
+    with metrics.timer('serialize'):
         for row_num in range(num_results):
             row_result = {}
             for i, n in enumerate(col_names):
                 row_result[n] = results[row_num][i]
             ret.append(row_result)
+    if qp.limit is None:
         return query, ret, 200
-    except psycopg2.Error as err:
-        sql_except(err)
-        return None, str(err), 400
+
+    # paged request: the sort column values of the last row (appended after the requested columns) continue from it
+    next_token = None
+    if has_next and num_results and table_keys.get(table) in [col for col, _ in qp.keyset]:
+        next_token = encode_token(qp.keyset, results[num_results - 1][-len(qp.keyset):])
+    return query, {'results': ret, 'next': next_token}, 200
+
+
+def filter_cache_key(request_body: json):
+    """
+    Compiles a filter request without running it, to look its results up in the result cache.
+    Args:
+        request_body ({}): a JSON object, as passed to filter_table
+    Returns ((str, tuple)): the compiled query and its parameters, or None if the request can't be parsed
+    """
+    try:
+        with metrics.timer('compile'):
+            query, params = QueryParser(catalog.schema()).build_query(request_body)
+    except RequestParseException:
+        return None
+    return repr(query), params
 
 
 def get_table(table_name, columns, user):
@@ -278,57 +470,293 @@ def get_table(table_name, columns, user):
     """
     if not user.is_authenticated:
         return 'Must be logged in to perform action'
-    result = []
-    cur, conn = user_cursor(user)
-    if cur is None:
+
+    def read(cur, conn):
+        if not table_exists(cur, table_name):
+            raise InvalidTableException
+        with metrics.timer('execute'):
+            cur.execute(f"select * from {table_name}")
+        with metrics.timer('fetch'):
+            rows = cur.fetchall()
+        with metrics.timer('serialize'):
+            return table_rows_to_dicts(rows, cur, columns)
+
+    try:
+        return read_with_retry(user, read)
+    except InvalidTableException:
+        raise
+    except Exception as err:
+        sql_except(err)
+        return []
+
+
+def stream_table(table_name, columns, user, chunk_size=stream_chunk_size):
+    """
+    Streams table data through a server-side cursor, so that only one chunk of rows is held in memory at a time.
+    The table is checked and the query started before this returns, so errors surface before any data is sent.
+    Args:
+        table_name (str): the table to fetch
+        columns ([str]): a list of columns to include in the results
+        user (User): object holding user info making the function call
+        chunk_size (int): number of rows fetched from the server at a time
+    Returns (([str], generator)): the column names, and a generator of lists of row tuples holding those columns;
+        None if no connection could be made or the query failed
+    """
+    if not user.is_authenticated:
+        return 'Must be logged in to perform action'
+    chunks = _table_chunks(table_name, columns, user, chunk_size)
+    try:
+        names = next(chunks)
+    except StopIteration:
         return None
+    return names, chunks
 
-    if not table_exists(cur, table_name) or table_name not in db_tables:
-        raise InvalidTableException
 
+def _table_chunks(table_name, columns, user, chunk_size):
+    """
+    Generator behind stream_table. Yields the column names once the query is running, then the rows in chunks.
+    The pooled connection is held until the generator is exhausted or closed.
+    """
+    with user_cursor(user) as (cur, conn):
+        if cur is None:
+            return
+
+        if not table_exists(cur, table_name):
+            raise InvalidTableException
+
+        stream_cur = conn.cursor(name=f'stream_{table_name}')
+        try:
+            try:
+                with metrics.timer('execute'):
+                    stream_cur.execute(f"select * from {table_name}")
+                    rows = stream_cur.fetchmany(chunk_size)
+            except psycopg2.Error as err:
+                sql_except(err)
+                return
+
+            names = [col.name for col in stream_cur.description]
+            keep = [i for i, col in enumerate(names) if not columns or col in columns]
+            yield [names[i] for i in keep]
+
+            while rows:
+                if len(keep) == len(names):
+                    yield rows
+                else:
+                    yield [tuple(row[i] for i in keep) for row in rows]
+                with metrics.timer('fetch'):
+                    rows = stream_cur.fetchmany(chunk_size)
+        finally:
+            stream_cur.close()
+
+
+def export_query(request_body: json):
+    """
+    Compiles an export request: the table, the columns to project and the same 'where' filters as a filter request.
+    Args:
+        request_body ({}): a JSON object with 'table', and optionally 'columns' and 'where'
+    Returns (sql.Composed, tuple): the SQL query, with %s placeholders, and its parameters
+    Raises: RequestParseException if the request is malformed or names unknown tables or columns
+    """
+    export_request = {key: request_body[key] for key in ['table', 'columns', 'where'] if key in request_body}
+    with metrics.timer('compile'):
+        return QueryParser(catalog.schema()).build_query(export_request)
+
+
+def stream_query(query, params, user, chunk_size=stream_chunk_size):
+    """
+    Streams the results of a compiled query through a server-side cursor, a chunk of rows at a time.
+    The query is started before this returns, so errors surface before any data is sent.
+    Args:
+        query (sql.Composed): the query, as compiled by export_query
+        params (tuple): its parameters
+        user (User): object holding user info making the function call
+        chunk_size (int): number of rows fetched from the server at a time
+    Returns ((tuple, generator)): the cursor description of the result columns, and a generator of lists of row
+        tuples; the error message (str) if the query failed, or None if no connection could be made
+    """
+    if not user.is_authenticated:
+        return login_required_msg
+    chunks = _query_chunks(query, params, user, chunk_size)
     try:
-        cur.execute(f"select * from {table_name}")
-        rows = cur.fetchall()
+        description = next(chunks)
+    except StopIteration:
+        return None
+    if isinstance(description, psycopg2.Error):
+        return str(description)
+    return description, chunks
 
-        result = table_rows_to_dicts(rows, cur, columns)
 
-    except Exception as err:
-        sql_except(err)
+def _query_chunks(query, params, user, chunk_size):
+    """
+    Generator behind stream_query. Yields the cursor description once the query is running, or the error if it
+    failed, then the rows in chunks. The pooled connection is held until the generator is exhausted or closed.
+    """
+    with user_cursor(user) as (cur, conn):
+        if cur is None:
+            return
 
-    return result
+        stream_cur = conn.cursor(name='stream_query')
+        try:
+            try:
+                with metrics.timer('execute'):
+                    stream_cur.execute(query, params)
+                    rows = stream_cur.fetchmany(chunk_size)
+            except psycopg2.Error as err:
+                sql_except(err)
+                yield err
+                return
+
+            yield stream_cur.description
+            while rows:
+                yield rows
+                with metrics.timer('fetch'):
+                    rows = stream_cur.fetchmany(chunk_size)
+        finally:
+            stream_cur.close()
+
+
+class CopyAbandonedException(Exception):
+    """
+    Raised in a COPY thread when the client stopped reading its output.
+    """
+    pass
+
+
+class _CopySink:
+    """
+    File-like target of copy_expert that collects the COPY output into blocks and hands them to the response through
+    a bounded queue, so that a slow client holds back the COPY instead of letting its output pile up in memory.
+    """
+
+    def __init__(self):
+        self.blocks = queue.Queue(copy_blocks_ahead)
+        self.abandoned = False
+        self._parts = []
+        self._size = 0
+
+    def write(self, data):
+        self._parts.append(data)
+        self._size += len(data)
+        if self._size >= copy_block_size:
+            self.flush()
+
+    def flush(self):
+        if self._parts:
+            self.put(b''.join(self._parts))
+            self._parts = []
+            self._size = 0
+
+    def put(self, item):
+        while True:
+            if self.abandoned:
+                raise CopyAbandonedException
+            try:
+                self.blocks.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+
+# put on a COPY sink's queue when no connection could be made
+_no_connection = object()
+
+
+def _copy_out(query, params, user, sink):
+    """
+    Runs a COPY ... TO STDOUT on a thread of its own, since copy_expert only returns once the COPY is complete.
+    Puts the blocks of output on the sink's queue, followed by None when done or by the error if it failed.
+    """
+    with user_cursor(user) as (cur, conn):
+        if cur is None:
+            sink.put(_no_connection)
+            return
+        try:
+            # COPY takes no parameters, so the operands are bound into the statement here
+            copy_sql = cur.mogrify(sql.SQL("COPY ({}) TO STDOUT WITH CSV HEADER").format(query), params or None)
+            cur.copy_expert(copy_sql, sink)
+            sink.flush()
+            sink.put(None)
+        except CopyAbandonedException:
+            # the COPY was cut off mid-stream; the connection can't be reused
+            conn.close()
+        except psycopg2.Error as err:
+            conn.rollback()
+            try:
+                sink.put(err)
+            except CopyAbandonedException:
+                pass
+
+
+def copy_csv(query, params, user):
+    """
+    Streams the results of a compiled query as CSV with a header row. The CSV is produced by the database server with
+    COPY (query) TO STDOUT and passed through as it arrives, without handling rows one at a time here.
+    The query is started before this returns, so errors surface before any data is sent.
+    Args:
+        query (sql.Composed): the query, as compiled by export_query
+        params (tuple): its parameters
+        user (User): object holding user info making the function call
+    Returns (generator): bytes pieces of the CSV document; the error message (str) if the query failed, or None if
+        no connection could be made
+    """
+    if not user.is_authenticated:
+        return login_required_msg
+    sink = _CopySink()
+    threading.Thread(target=_copy_out, args=(query, params, user, sink), name='copy-out', daemon=True).start()
+    first = sink.blocks.get()
+    if first is _no_connection:
+        return None
+    if isinstance(first, psycopg2.Error):
+        return str(first)
+    return _copy_blocks(first, sink)
 
 
-def read_metadata(f):
+def _copy_blocks(first, sink):
+    """
+    Generator behind copy_csv. Yields the blocks of COPY output, and tells the COPY thread to stop if the response
+    is closed before the end.
+    """
+    try:
+        block = first
+        while block is not None:
+            if isinstance(block, psycopg2.Error):
+                sys.stderr.write(f"\nCOPY stopped mid-stream: {block}")
+                return
+            yield block
+            block = sink.blocks.get()
+    finally:
+        sink.abandoned = True
+
+
+def read_metadata(reader):
     """
     Collects metadata about a spreadsheet to be consumed.
     Args:
-        f (str): the filename of the spreadsheet
+        reader (FileReader): reader of the file, whose rows have been read
     Returns (dict): the metadata collection
     """
     data = {}
-    workbook = load_workbook(f)
-    file_data = workbook.properties.__dict__
-    sheet_data = workbook.worksheets[0]
-    os_data = os.stat(f)
+    file_data = reader.properties()
+    os_data = os.stat(reader.filename)
 
-    data['filename'] = fmt(os.path.basename(f))
+    data['filename'] = fmt(os.path.basename(reader.filename))
     data['creator'] = fmt(file_data.get('creator'))
     data['size'] = os_data.st_size
     data['created'] = fmt(file_data.get('created').strftime('%Y-%m-%d %H:%M:%S+08'))
     data['modified'] = fmt(file_data.get('modified').strftime('%Y-%m-%d %H:%M:%S+08'))
     data['lastModifiedBy'] = fmt(file_data.get('lastModifiedBy'))
     data['title'] = fmt(file_data.get('title'))
-    data['columns'] = sheet_data.max_column
+    data['columns'] = reader.column_count
 
     # adjust row count to account for header row, if necessary
     headerMatches = 0
-    for cell in sheet_data[1]:
-        if cell.value in intake_headers:
+    for value in reader.header or ():
+        if value in intake_headers:
             headerMatches += 1
     if headerMatches == len(intake_headers):
-        data['rows'] = sheet_data.max_row - 1
+        data['rows'] = reader.row_count - 1
     else:
-        data['rows'] = sheet_data.max_row
+        data['rows'] = reader.row_count
 
     return data
 
@@ -338,16 +766,70 @@ def write_info_data(df, table, user):
     Write data from spreadsheet to the named table.
     Args:
         table (str): name of target table
-        df (pd.DataFrame): data from spreadsheet
+        df (DataFrame): data from spreadsheet
         user (User): User object holding info on user making funciton call
     Returns (dict): status report
     """
     # check if the connection is alive
     if not user.is_authenticated:
         return False, 'Must be logged in to perform action', 404
+    row_array = np.ndenumerate(df.values).iter.base
+    total_count = len(row_array)
+
+    # stage all rows with COPY and merge them into the table in a single transaction
+    with user_cursor(user) as (cur, conn):
+        if cur is None:
+            return write_info_rows(row_array, table, user)
+        try:
+            columns = bulk.stage_rows(cur, table, row_array)
+            taken, failed = bulk.merge_staged(cur, table, columns)
+            conn.commit()
+            result_cache.table_changed(table)
+        except (psycopg2.Error, ValueError) as err:
+            conn.rollback()
+            sys.stderr.write(f"\nBulk load into {table} failed, inserting row by row: {err}")
+            taken = failed = None
+    if taken is None:
+        return write_info_rows(row_array, table, user)
+
+    failed_validations = []
+    for src_idx in sorted(set(taken) | set(failed)):
+        row = row_array[src_idx]
+        if src_idx in taken:
+            failed_validations.append({
+                'row': row[0],
+                'message': f'Row number {row[0]} already taken.'
+            })
+        elif table == 'intake':
+            failed_validations.append({
+                'mrl': row[ColNames.MRL.value],
+                'exception': failed[src_idx]
+            })
+        else:
+            failed_validations.append({
+                # TODO: once other tables have unique IDs, use them here
+                'row': row[0]
+            })
+
+    return {
+        'insertions_attempted': total_count,
+        'insertions_successful': total_count - len(failed_validations),
+        'insertions_failed': failed_validations
+    }
+
+
+def write_info_rows(row_array, table, user):
+    """
+    Write rows to the named table one at a time. Slower than the bulk path of write_info_data, but isolates rows
+    that the database rejects for reasons other than a conflicting key, such as unparseable values.
+    Args:
+        row_array ([[]]): rows of values
+        table (str): name of target table
+        user (User): User object holding info on user making function call
+    Returns (dict): status report
+    """
     failed_validations = []
     success_count = 0
-    row_array = np.ndenumerate(df.values).iter.base
     total_count = len(row_array)
     for row in row_array:
         try:
@@ -379,16 +861,18 @@ def write_metadata(metadata, user):
     cmd = "INSERT INTO {}(filename, creator, size, created_date, last_modified_date, last_modified_by, title, rows, columns) " \
           "VALUES(" + "{} " + ", {}" * 8 + ") ON CONFLICT DO NOTHING"
 
-    cur, conn = user_cursor(user)
-
-    try:
-        cur.execute(cmd.format(metadata_table, metadata['filename'], metadata['creator'], metadata['size'],
-                               metadata['created'], metadata['modified'], metadata['lastModifiedBy'],
-                               metadata['title'], metadata['rows'], metadata['columns']))
-        conn.commit()
+    with user_cursor(user) as (cur, conn):
+        if cur is None:
+            return False, connection_error_msg, 500
+        try:
+            cur.execute(cmd.format(metadata_table, metadata['filename'], metadata['creator'], metadata['size'],
+                                   metadata['created'], metadata['modified'], metadata['lastModifiedBy'],
+                                   metadata['title'], metadata['rows'], metadata['columns']))
+            conn.commit()
+            result_cache.table_changed(metadata_table)
 
-    except psycopg2.Error as err:
-        sql_except(err)
+        except psycopg2.Error as err:
+            sql_except(err)
 
 
 def row_number_exists(cur, row_number, table=primary_table):
@@ -410,22 +894,18 @@ def row_number_exists(cur, row_number, table=primary_table):
     return exists
 
 
+@metrics.timed('validate')
 def validate_row(json_item, table):
     """
-    Preps a JSON input row and passes it to the data validator. Returns the validator's response.
+    Passes an input row to the data validator. Returns the validator's response.
     Args:
         json_item ({}): input JSON
         table (str): table name
     Returns ((bool, str)): <whether row is valid>, <error message>
     """
-    # If the incoming json object doesn't have a row associated with it, we add a temporary one for validation
-    if 'row' not in json_item:
-        json_item = collections.OrderedDict(json_item)
-        json_item.update({'row': 999})
-        json_item.move_to_end('row', last=False)
-    df = pd.json_normalize(json_item)
     if table == 'intake':
-        return validate_intake(df)
+        # a row without a number of its own is reported as row 999
+        return validate_intake_record(json_item)
     # add more entries here once other tables have validators
     else:
         raise InvalidTableException
@@ -442,97 +922,117 @@ def insert_row(table, row, user):
     """
     if not user.is_authenticated:
         return False, {'Message': login_required_msg}
-    cur, conn = user_cursor(user)
-    global row_seq
-    row_temp = row_seq[table]
-
-    cmd = f"INSERT INTO {table} VALUES ("
-    try:
-
-        # Determine whether to insert at a specific row number or use default
-        if row[0] is not None and str(row[0]).isdigit():
-            if row_number_exists(pgSqlCur, int(row[0]), table):
-                failed_row = {
-                    'row': row[0],
-                    'message': f'Row number {row[0]} already taken.'
-                }
-                return False, failed_row
-            else:
-                cmd += str(row[0])
-        else:
-            # Loop through and update row seq to first available spot
-            while row_number_exists(cur, row_temp, table):
-                row_temp += 1
-            cmd += f"{row_temp}"
-
-            # if first column is not row#, then almost certain this is the header
-            # after add a row#, add this first column as string
-            if not isinstance(row[0], int) and row[0] is not None:
-                cmd += "," + fmt(row[0])
-
-        for i in range(1, len(row)):
-            cmd += f", {fmt(row[i])}"
-        cmd += ")"
+    with user_cursor(user) as (cur, conn):
+        cmd = f"INSERT INTO {table} VALUES ("
         try:
-            cur.execute(cmd)
-            conn.commit()
-            if cur.rowcount == 1:
-                row_seq[table] = row_temp
-                return True, None
-            else:
-                raise psycopg2.Error
-        except psycopg2.Error as err:
-            sql_except(err)
-            if table == 'intake':
-                failed_row = {
-                    'mrl': row[ColNames.MRL.value],
-                    'exception': err.diag.message_detail
-                }
+
+            # Determine whether to insert at a specific row number or take one from the table's row sequence
+            if row[0] is not None and str(row[0]).isdigit():
+                if row_number_exists(cur, int(row[0]), table):
+                    failed_row = {
+                        'row': row[0],
+                        'message': f'Row number {row[0]} already taken.'
+                    }
+                    return False, failed_row
+                else:
+                    cmd += str(row[0])
             else:
-                failed_row = {
-                    # TODO: once other tables have unique IDs, use them here
-                    'row': row[0]
-                }
-            return False, failed_row
-    except:
-        return False, connection_error_msg
+                cmd += str(reserve_rows(cur, table, 1)[0])
+
+                # if first column is not row#, then almost certain this is the header
+                # after add a row#, add this first column as string
+                if not isinstance(row[0], int) and row[0] is not None:
+                    cmd += "," + fmt(row[0])
+
+            for i in range(1, len(row)):
+                cmd += f", {fmt(row[i])}"
+            cmd += ")"
+            try:
+                with metrics.timer('execute'):
+                    cur.execute(cmd)
+                    conn.commit()
+                result_cache.table_changed(table)
+                if cur.rowcount == 1:
+                    return True, None
+                else:
+                    raise psycopg2.Error
+            except psycopg2.Error as err:
+                sql_except(err)
+                if table == 'intake':
+                    failed_row = {
+                        'mrl': row[ColNames.MRL.value],
+                        'exception': err.diag.message_detail
+                    }
+                else:
+                    failed_row = {
+                        # TODO: once other tables have unique IDs, use them here
+                        'row': row[0]
+                    }
+                return False, failed_row
+        except:
+            return False, connection_error_msg
 
 
-def process_file(table, file, user):
+def process_file(table, file, user, progress=None):
     """
-    Read an Excel file; put info data into info table, metadata into metadata table
+    Read a spreadsheet, CSV or Parquet file; put info data into info table, metadata into metadata table
     Args:
         table (str): table into which to insert
-        file (str): filename of spreadsheet
+        file (str): filename of the file; its format is picked by kanabi.readers.reader_for
         user (User): User obj holding info on user making func call
+        progress (function): called with keyword counts (rows_parsed, rows_validated, rows_inserted) so far as each
+            batch of rows passes a stage; it may raise to abandon the file before the next one
     Returns (bool, dict): bool is successful or not, dict includes processing info
     """
     if not user.is_authenticated:
         return False, {'Message': login_required_msg}
-    if table not in db_tables:
+    if not catalog.has_table(table):
         raise InvalidTableException
+    if progress is None:
+        def progress(**counts):
+            pass
+
+    result_obj = {
+        'insertions_attempted': 0,
+        'insertions_successful': 0,
+        'insertions_failed': []
+    }
+    failed_rows = {}
+    rows_parsed = rows_validated = 0
 
-    # read file content
-    df = pd.read_excel(file)
+    # read the file once, a batch of rows at a time, so that memory use doesn't grow with the file
+    with reader_for(file, upload_batch_size) as reader:
+        for df in reader.batches():
+            rows_parsed += len(df)
+            progress(rows_parsed=rows_parsed)
 
-    if table == 'intake':
-        # Validate data frame
-        valid, error_msg = validate_intake(df)
-    else:
-        # not validating other table than primary table for now
-        valid = True
-        error_msg = None
-
-    # Write the data to the DB
-    result_obj = write_info_data(df, table, user)
-    # insert metadata into metadata table
-    # should add version and revision to this schema, but don't know types yet
-    metadata = read_metadata(file)
+            if table == 'intake':
+                # Validate data frame
+                _, error_msg = validate_intake(df)
+                failed_rows.update(error_msg or {})
+                # store dates, zips, receipt numbers and amounts in their typed columns
+                df = convert_intake_frame(df)
+            else:
+                # not validating other table than primary table for now
+                error_msg = None
+            rows_validated += len(df) - len(error_msg or {})
+            progress(rows_validated=rows_validated)
+
+            # Write the batch to the DB; each batch is committed on its own
+            batch_result = write_info_data(df, table, user)
+            result_obj['insertions_attempted'] += batch_result['insertions_attempted']
+            result_obj['insertions_successful'] += batch_result['insertions_successful']
+            result_obj['insertions_failed'] += batch_result['insertions_failed']
+            progress(rows_inserted=result_obj['insertions_successful'])
+
+        # insert metadata into metadata table
+        # should add version and revision to this schema, but don't know types yet
+        metadata = read_metadata(reader)
 
     write_metadata(metadata, user)
 
-    if not valid:
-        result_obj['failed_rows'] = error_msg
+    if failed_rows:
+        result_obj['failed_rows'] = failed_rows
     failed_insertions = result_obj['insertions_attempted'] - result_obj['insertions_successful']
     return failed_insertions == 0, result_obj
 
@@ -547,141 +1047,197 @@ def delete_row(table, row_nums, user):
     """
     if not user.is_authenticated:
         return False, login_required_msg
-    cur, conn = user_cursor(user)
-    if cur is None:
-        return False, connection_error_msg
-    success = False
-    delete_info = {}
-    # verify table is within the db
-    if table not in db_tables:
-        raise InvalidTableException
-    # convert each row_num to digit;
-    try:
-        row_nums = list(map(int, row_nums))
-    except ValueError:
-        raise InvalidRowException
-    for row in row_nums:
-        if row <= 0:
-            delete_info[f'Row {str(row)}'] = 'Invalid row number'
-            continue
-        cmd = f'DELETE FROM {table} WHERE "row" = {row};'
+    with user_cursor(user) as (cur, conn):
+        if cur is None:
+            return False, connection_error_msg
+        success = False
+        delete_info = {}
+        # verify table is within the db
+        if not catalog.has_table(table):
+            raise InvalidTableException
+        # convert each row_num to digit;
         try:
-            cur.execute(cmd)
-            conn.commit()
-            if cur.rowcount == 1:
+            row_nums = list(map(int, row_nums))
+        except ValueError:
+            raise InvalidRowException
+        valid_rows = [row for row in row_nums if row > 0]
+        # delete all the rows in one statement and one transaction
+        deleted = set()
+        if valid_rows:
+            try:
+                cur.execute(f'DELETE FROM {table} WHERE "row" = ANY(%s) RETURNING "row"', (valid_rows,))
+                deleted = {x[0] for x in cur.fetchall()}
+                conn.commit()
+                result_cache.table_changed(table)
+            except psycopg2.Error as err:
+                sql_except(err)
+                conn.rollback()
+        for row in row_nums:
+            if row <= 0:
+                delete_info[f'Row {str(row)}'] = 'Invalid row number'
+            elif row in deleted:
                 success = True
                 delete_info[f'Row {str(row)}'] = 'Successfully deleted'
             else:
                 delete_info[f'Row {str(row)}'] = 'Failed to delete'
-
-        except psycopg2.Error as err:
-            sql_except(err)
-    if success:
-        return 'Deletion successful', delete_info
-    else:
-        return 'Some/all deletions failed', delete_info
+        if success:
+            return 'Deletion successful', delete_info
+        else:
+            return 'Some/all deletions failed', delete_info
 
 
-def update_table(table, row, update_columns, user):
+def _update_row(cur, table, row, update_columns):
     """
-    Update one row (multiple columns) for a target table
+    Updates one row (multiple columns) of a table and validates the result, without committing.
+    The UPDATE runs through the connection's prepared statement for the set of columns updated, and returns the
+    updated row, which is validated as it now stands.
     Args:
+        cur ({}): the Postgres cursor
         table (str): table name
         row (str/int): row number
         update_columns (dict): obj of {column_name: new value, ... }
-        user (User): User obj holding info for user making func call
-    Returns (bool, str): bool is successful or not, str includes processing info
+    Returns (bool, str): bool is successful or not, str includes processing info; the caller must roll back the
+        update if it was not successful
     """
-    cur, conn = user_cursor(user)
-    if cur is None:
-        return False, connection_error_msg
-    col_str = ''
-    arg_str = ''
-    exe_arg_str = ''
-    arg_num = 1
-
+    table_columns = catalog.columns(table)
+    typed = catalog.column_types(table) if table == 'intake' else {}
+    values = {}
     for key in update_columns:
-        col_str += f', {key} = ${arg_num}'
-        if isinstance(update_columns[key], int):
-            arg_str += ',integer'
-            exe_arg_str += f",{update_columns[key]}"
-        else:
-            exe_arg_str += f",'{update_columns[key]}'"
-            arg_str += ',text'
-        arg_num += 1
-
-    col_str = col_str[1:]
-    arg_str = arg_str[1:]
-    exe_arg_str = exe_arg_str[1:]
-
+        col = key.lower()
+        if col not in table_columns or col == 'row':
+            return False, f'Invalid column: {key}'
+        value = update_columns[key]
+        if col in intake_column_types and typed.get(col, 'text') != 'text':
+            try:
+                value = convert_value(col, value)
+            except ConversionException as err:
+                return False, f'Invalid value for {key}: {err}'
+        values[col] = value
+
+    # the same columns in the same order give the same statement, whatever order the request listed them in
+    columns = sorted(values)
+    query = sql.SQL('UPDATE {} SET {} WHERE "row" = %s RETURNING *').format(
+        sql.Identifier(table),
+        sql.SQL(', ').join(sql.SQL('{} = %s').format(sql.Identifier(col)) for col in columns))
     try:
-        cur.execute(f"deallocate all;\
-        prepare update_table({arg_str},integer) as \
-        update {table} \
-        set {col_str} \
-        where row = ${arg_num};")
-        cur.execute(f'execute update_table({exe_arg_str},{row});')
+        with metrics.timer('execute'):
+            statements.execute(cur, query.as_string(cur), tuple(values[col] for col in columns) + (int(row),))
 
         if cur.rowcount != 1:
             # the target row is not updated
             return False, 'Update failed, please check if the row exists'
 
-        # validate inserted row
-        cur.execute(f"select * from {table} where row = {row}")
-        new_row = cur.fetchall()
-        valid, error_msg = validate_intake(pd.json_normalize(table_rows_to_dicts(new_row, cur)), 1)
-        if not valid:
-            cur.execute("ROLLBACK")
-            conn.commit()
-            return False, error_msg
+        # validate the updated row
+        new_row = cur.fetchone()
+        if table == 'intake':
+            with metrics.timer('validate'):
+                valid, error_msg = validate_intake_row(new_row, 1)
+            if not valid:
+                return False, error_msg
 
     except psycopg2.Error as err:
         sql_except(err)
         return False, str(err)
 
-    # commit if no error
-    conn.commit()
     return True, 'Updated successfully'
 
 
+def update_table(table, row, update_columns, user):
+    """
+    Update one row (multiple columns) for a target table
+    Args:
+        table (str): table name
+        row (str/int): row number
+        update_columns (dict): obj of {column_name: new value, ... }
+        user (User): User obj holding info for user making func call
+    Returns (bool, str): bool is successful or not, str includes processing info
+    """
+    with user_cursor(user) as (cur, conn):
+        if cur is None:
+            return False, connection_error_msg
+        success, message = _update_row(cur, table, row, update_columns)
+        if not success:
+            conn.rollback()
+            return False, message
+
+        # commit if no error
+        conn.commit()
+        result_cache.table_changed(table)
+        return True, message
+
+
+def update_rows(table, patches, user):
+    """
+    Update many rows of a target table in one transaction. Each row is updated under a savepoint, so a row that
+    fails is rolled back on its own and the rest are committed together.
+    Args:
+        table (str): table name
+        patches ([dict]): list of {'row': row number, 'columns': {column_name: new value, ... }}
+        user (User): User obj holding info for user making func call
+    Returns (bool, dict): bool is whether every row was updated, dict holds the result of each row
+    """
+    if not user.is_authenticated:
+        return False, login_required_msg
+    with user_cursor(user) as (cur, conn):
+        if cur is None:
+            return False, connection_error_msg
+        update_info = {}
+        all_updated = True
+        try:
+            for patch in patches:
+                row = patch['row']
+                cur.execute('SAVEPOINT update_row')
+                success, message = _update_row(cur, table, row, patch['columns'])
+                if success:
+                    cur.execute('RELEASE SAVEPOINT update_row')
+                else:
+                    cur.execute('ROLLBACK TO SAVEPOINT update_row')
+                    all_updated = False
+                update_info[f'Row {row}'] = message
+            conn.commit()
+        except psycopg2.Error as err:
+            sql_except(err)
+            conn.rollback()
+            return False, str(err)
+        result_cache.table_changed(table)
+        return all_updated, update_info
+
+
 def restore_row(row_num, user):
     """
-    Function to restore a row that was previously deleted from a table
+    Function to restore rows that were previously deleted from a table, all in one transaction
     Args:
         row_num ([int]): row number(s) in the archive table of data to restore
         user (User): User obj holding info on user making func call
-    Returns (bool, str):  Bool success or not, str contains process info
+    Returns (bool, dict):  Bool whether every row was restored, dict contains the outcome for each row
     """
     if not user.is_authenticated:
         return False, login_required_msg
-    cur, conn = user_cursor(user)
-    if cur is None:
-        return False, connection_error_msg
-    restore_info = {}
-    try:
-        row_num = list(map(int, row_num))
-    except ValueError:
-        raise InvalidRowException
-    # get the archive row to be restored
-    try:
-        success = []
-        for row in row_num:
-            cmd = f'SELECT restore_row({row});'
-            cur.execute(cmd)
-            success = cur.fetchone()
-            if success[0]:
-                restore_info[f'Row {str(row)}'] = 'Successfully restored'
-                conn.commit()
-            else:
-                restore_info[f'Row {str(row)}'] = 'Failed to restore'
-        return success[0], restore_info
-
-    except psycopg2.IntegrityError:
-        return False, "Can't restore the row. Duplicate row id, MRL, or receipt num."
+    with user_cursor(user) as (cur, conn):
+        if cur is None:
+            return False, connection_error_msg
+        restore_info = {}
+        try:
+            row_num = list(map(int, row_num))
+        except ValueError:
+            raise InvalidRowException
+        # restore the archive rows with one call, which inserts them with one statement per original table and skips
+        # those that conflict with existing rows
+        try:
+            cur.execute('SELECT row_num, status FROM restore_rows(%s)', (list(dict.fromkeys(row_num)),))
+            results = cur.fetchall()
+            conn.commit()
+            for row, status in results:
+                restore_info[f'Row {str(row)}'] = restore_messages[status]
+            if any(status == 'restored' for _, status in results):
+                # the rows may go back to any table
+                result_cache.clear()
+            return all(status == 'restored' for _, status in results), restore_info
 
-    except psycopg2.Error as err:
-        sql_except(err)
-        return False, str(err)
+        except psycopg2.Error as err:
+            sql_except(err)
+            conn.rollback()
+            return False, str(err)
 
 
 def create_db_user(name, password, admin):
@@ -697,12 +1253,13 @@ def create_db_user(name, password, admin):
             cmd = f'CREATE USER "{name}" WITH PASSWORD \'{password}\' IN GROUP adminaccess;'
         else:
             cmd = f'CREATE USER "{name}" WITH PASSWORD \'{password}\' IN GROUP writeaccess;'
-        pgSqlCur.execute(cmd)
-        if pgSqlCur.statusmessage == "CREATE ROLE":
-            pgSqlConn.commit()
-            return 1, f'User {name} created in the postgresDB'
-        else:
-            return 0, f'User {name} could not be added to the postgresDB'
+        with admin_cursor() as (cur, conn):
+            cur.execute(cmd)
+            if cur.statusmessage == "CREATE ROLE":
+                conn.commit()
+                return 1, f'User {name} created in the postgresDB'
+            else:
+                return 0, f'User {name} could not be added to the postgresDB'
 
     except psycopg2.Error as err:
         sql_except(err)
@@ -712,15 +1269,16 @@ def create_db_user(name, password, admin):
 def make_db_admin(name, password):
     cmd = f'SELECT usename FROM pg_shadow;'
     try:
-        pgSqlCur.execute(cmd)
-        users=[str(x[0]) for x in pgSqlCur.fetchall()]
-        if name in users:
-            cmd = f'GRANT adminaccess to {name};'
-            pgSqlCur.execute(cmd)
-            pgSqlConn.commit()
-            return 1, f'User {name} granted admin access'
-        else:
-            return create_db_user(name, password, True)
+        with admin_cursor() as (cur, conn):
+            cur.execute(cmd)
+            users=[str(x[0]) for x in cur.fetchall()]
+            if name in users:
+                cmd = f'GRANT adminaccess to {name};'
+                cur.execute(cmd)
+                conn.commit()
+                return 1, f'User {name} granted admin access'
+            else:
+                return create_db_user(name, password, True)
     except psycopg2.Error as err:
         sql_except(err)
         return 0, str(err)
@@ -729,13 +1287,14 @@ def make_db_admin(name, password):
 def remove_db_admin(name):
     cmd = f'SELECT usename FROM pg_shadow;'
     try:
-        pgSqlCur.execute(cmd)
-        users = [str(x[0]) for x in pgSqlCur.fetchall()]
-        if name in users:
-            cmd = f'REVOKE adminaccess from {name};'
-            pgSqlCur.execute(cmd)
-            pgSqlConn.commit()
-            return 1, f'User {name} revoked admin access'
+        with admin_cursor() as (cur, conn):
+            cur.execute(cmd)
+            users = [str(x[0]) for x in cur.fetchall()]
+            if name in users:
+                cmd = f'REVOKE adminaccess from {name};'
+                cur.execute(cmd)
+                conn.commit()
+                return 1, f'User {name} revoked admin access'
     except psycopg2.Error as err:
         sql_except(err)
         return 0, str(err)
@@ -743,11 +1302,31 @@ def remove_db_admin(name):
 
 def remove_db_user(name):
     cmd = f'DROP USER IF EXISTS {name};'
+    pools.remove(name)
     try:
-        pgSqlCur.execute(cmd)
-        pgSqlConn.commit()
+        with admin_cursor() as (cur, conn):
+            cur.execute(cmd)
+            conn.commit()
         return 1, f'User {name} removed from db'
     except psycopg2.Error as err:
         sql_except(err)
         return 0, str(err)
 
+
+def notify_user_changed(user_id):
+    """
+    Tells every server process that a user's account changed, so that they drop the user from their user cache.
+    Args:
+        user_id (int): id of the user
+    Returns (bool): whether the notification was sent; if not, other processes serve the user for up to their
+        cache's ttl
+    """
+    try:
+        with admin_cursor() as (cur, conn):
+            cur.execute('SELECT pg_notify(%s, %s)', (users_channel, str(user_id)))
+            conn.commit()
+        return True
+    except psycopg2.Error as err:
+        sql_except(err)
+        return False
+
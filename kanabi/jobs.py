@@ -0,0 +1,374 @@
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from .configure import db
+
+job_states = ['queued', 'running', 'done', 'failed', 'cancelled']
+finished_states = ['done', 'failed', 'cancelled']
+default_job_workers = 2
+
+
+class Job(db.Model):
+    """
+    A spreadsheet upload processed in the background. Kept in the local auth database, so that jobs still queued or
+    running when the server stops are picked up again when it restarts.
+    """
+    __tablename__ = 'Job'
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, index=True)
+    table_name = db.Column(db.String(100))
+    filename = db.Column(db.String(1000))
+    status = db.Column(db.String(20), default='queued')
+    cancel_requested = db.Column(db.Boolean(), default=False)
+    rows_parsed = db.Column(db.Integer)
+    rows_validated = db.Column(db.Integer)
+    rows_inserted = db.Column(db.Integer)
+    report = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        """
+        Returns (dict): the job's state, progress and, once finished, its report
+        """
+        return {
+            'id': self.id,
+            'table': self.table_name,
+            'file': upload_name(self.id, self.filename),
+            'status': self.status,
+            'cancel_requested': bool(self.cancel_requested),
+            'rows_parsed': self.rows_parsed,
+            'rows_validated': self.rows_validated,
+            'rows_inserted': self.rows_inserted,
+            'report': json.loads(self.report) if self.report else None,
+            'error': self.error,
+            'created': self.created.isoformat() if self.created else None,
+            'updated': self.updated.isoformat() if self.updated else None,
+        }
+
+
+def upload_path(folder, job_id, filename):
+    """
+    Names the saved copy of an uploaded file after the job that reads it, so that uploads of files with the same
+    name, queued at the same time or resumed after a restart, don't overwrite each other.
+    Args:
+        folder (str): folder uploads are saved in
+        job_id (str): id of the job that processes the file
+        filename (str): name of the file, as sent by the client
+    Returns (str): path to save the file at
+    """
+    return os.path.join(folder, f'{job_id}-{os.path.basename(filename)}')
+
+
+def upload_name(job_id, path):
+    """
+    Returns (str): the name of an uploaded file as sent by the client, given the path it was saved at
+    """
+    name = os.path.basename(path or '')
+    prefix = f'{job_id}-'
+    return name[len(prefix):] if name.startswith(prefix) else name
+
+
+def remove_upload(job_id, path):
+    """
+    Deletes the saved copy of an uploaded file once its job has finished. Files not saved by upload_path for this
+    job are left alone.
+    Args:
+        job_id (str): job id
+        path (str): path of the file
+    Returns: None
+    """
+    if not path or not os.path.basename(path).startswith(f'{job_id}-'):
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as err:
+        sys.stderr.write(f'\nCould not remove upload {path} of job {job_id}: {err}')
+
+
+class JobCancelledException(Exception):
+    """
+    Raised in a worker when the job it is running was cancelled.
+    """
+    pass
+
+
+class JobUser:
+    """
+    Stands in for the uploading user in a worker process, where the driver only needs the database role to connect
+    as.
+    """
+    is_authenticated = True
+
+    def __init__(self, email, password):
+        self.email = email
+        self.password = password
+
+
+# State of a worker process, set by _init_worker
+_progress = None
+_cancelled = None
+
+
+def _init_worker(progress, cancelled):
+    global _progress, _cancelled
+    _progress = progress
+    _cancelled = cancelled
+
+
+def run_job(job_id, table, filename, email, password):
+    """
+    Runs the upload pipeline of one job in a worker process: read, validate, insert and record the file's metadata.
+    Progress is sent back to the server as each stage completes, and cancellation is checked in between.
+    Args:
+        job_id (str): job id
+        table (str): table to insert into
+        filename (str): uploaded spreadsheet
+        email (str): database role of the uploading user
+        password (str): password of the role
+    Returns (dict): final status, and the report of driver.process_file or the error
+    """
+    def progress(**counts):
+        _progress.put((job_id, counts))
+        if _cancelled.get(job_id):
+            raise JobCancelledException
+
+    try:
+        if _cancelled.get(job_id):
+            raise JobCancelledException
+        _progress.put((job_id, {'status': 'running'}))
+        # imported in the worker only, which connects to the database on its own
+        import kanabi.driver as driver
+        success, report = driver.process_file(table, filename, JobUser(email, password), progress)
+        return {'status': 'done', 'success': success, 'report': report}
+    except JobCancelledException:
+        return {'status': 'cancelled'}
+    except Exception as err:
+        return {'status': 'failed', 'error': f'{type(err).__name__}: {err}'}
+
+
+class JobQueue:
+    """
+    Runs spreadsheet uploads on a pool of worker processes, since reading and validating them is CPU-bound, and
+    keeps their progress in the Job table.
+    The pool is started on first use. Workers report progress through a queue that a thread of the server drains
+    into the Job table; cancellation requests reach them through a shared dict.
+    """
+
+    def __init__(self, workers=None):
+        """
+        Args:
+            workers (int): number of worker processes; the app's JOB_WORKERS setting if not given
+        """
+        self.workers = workers
+        self.app = None
+        self._pool = None
+        self._manager = None
+        self._progress = None
+        self._cancelled = None
+        self._outstanding = set()  # ids of the jobs dispatched to the pool and not yet finished
+        self._lock = threading.Condition()
+
+    def init_app(self, app, resume=True):
+        """
+        Binds the queue to the app, and resubmits the jobs a previous run of the server left unfinished.
+        Args:
+            app (Flask): the app
+            resume (bool): whether to resubmit unfinished jobs now; a server that forks several processes resumes
+                them in one of those instead, by calling resume()
+        Returns: None
+        """
+        self.app = app
+        if self.workers is None:
+            self.workers = app.config.get('JOB_WORKERS', default_job_workers)
+        # worker processes import the app too; only the server resumes jobs
+        if resume and multiprocessing.current_process().name == 'MainProcess':
+            self.resume()
+
+    def resume(self):
+        """
+        Resubmits the jobs that were still queued or running when the server last stopped.
+        Returns: None
+        """
+        with self.app.app_context():
+            unfinished = Job.query.filter(Job.status.in_(['queued', 'running'])).all()
+        for job in unfinished:
+            self._resume(job)
+
+    def drain(self, timeout=None):
+        """
+        Stops taking jobs and waits for those already submitted to finish, e.g. before the server process exits.
+        Jobs still unfinished after the timeout are stopped, and stay queued or running in the Job table, to be
+        resumed when the server next starts.
+        Args:
+            timeout (float): seconds to wait; no limit if None
+        Returns (bool): whether every job finished
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            pool, manager = self._pool, self._manager
+            if pool is None:
+                return True
+            pool.close()
+            while self._outstanding:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+            drained = not self._outstanding
+            self._pool = None
+        if drained:
+            pool.join()
+        else:
+            sys.stderr.write(f'\nStopping {len(self._outstanding)} unfinished jobs; they resume on the next start')
+            pool.terminate()
+        manager.shutdown()
+        return drained
+
+    def _done(self, job_id):
+        with self._lock:
+            self._outstanding.discard(job_id)
+            self._lock.notify_all()
+
+    def _start(self):
+        """
+        Starts the worker pool and the progress thread. Must be called with the lock held.
+        """
+        # spawn rather than fork, so that workers don't share the server's database connections
+        ctx = multiprocessing.get_context('spawn')
+        self._manager = ctx.Manager()
+        self._progress = self._manager.Queue()
+        self._cancelled = self._manager.dict()
+        self._pool = ctx.Pool(self.workers, initializer=_init_worker, initargs=(self._progress, self._cancelled),
+                              maxtasksperchild=10)
+        threading.Thread(target=self._record_progress, name='job-progress', daemon=True).start()
+
+    def _update(self, job_id, progress=False, **fields):
+        with self.app.app_context():
+            job = Job.query.get(job_id)
+            if job is None:
+                return
+            if progress and job.status in finished_states:
+                # progress travels apart from results and may arrive after them; it mustn't reopen the job
+                fields.pop('status', None)
+            if progress and job.cancel_requested and self._cancelled is not None:
+                # the cancellation may have been asked of another server process, which can't reach this one's
+                # workers; the job stops at its next stage instead
+                self._cancelled[job_id] = True
+            for name, value in fields.items():
+                setattr(job, name, value)
+            db.session.commit()
+            if job.status in finished_states:
+                remove_upload(job.id, job.filename)
+
+    def _record_progress(self):
+        while True:
+            try:
+                job_id, counts = self._progress.get()
+            except (EOFError, OSError):
+                return
+            try:
+                self._update(job_id, progress=True, **counts)
+            except Exception as err:
+                sys.stderr.write(f'\nCould not record progress of job {job_id}: {err}')
+
+    def _finished(self, job_id, result):
+        # runs on the pool's result thread, which must not die
+        try:
+            fields = {'status': result['status']}
+            if 'report' in result:
+                fields['report'] = json.dumps(result['report'], default=str)
+                if not result['success']:
+                    fields['error'] = 'Some rows could not be inserted'
+            if 'error' in result:
+                fields['error'] = result['error']
+            self._update(job_id, **fields)
+            self._cancelled.pop(job_id, None)
+        except Exception as err:
+            sys.stderr.write(f'\nCould not record result of job {job_id}: {err}')
+        finally:
+            self._done(job_id)
+
+    def _failed(self, job_id, err):
+        try:
+            self._update(job_id, status='failed', error=f'{type(err).__name__}: {err}')
+        except Exception as db_err:
+            sys.stderr.write(f'\nCould not record failure of job {job_id}: {db_err}')
+        finally:
+            self._done(job_id)
+
+    def _dispatch(self, job_id, table, filename, email, password):
+        with self._lock:
+            if self._pool is None:
+                self._start()
+            self._outstanding.add(job_id)
+            self._pool.apply_async(run_job, (job_id, table, filename, email, password),
+                                   callback=lambda result: self._finished(job_id, result),
+                                   error_callback=lambda err: self._failed(job_id, err))
+
+    def _resume(self, job):
+        from .user import User
+        if job.cancel_requested:
+            self._update(job.id, status='cancelled')
+            return
+        with self.app.app_context():
+            user = User.query.get(job.user_id)
+            if user is None or not os.path.exists(job.filename):
+                self._update(job.id, status='failed', error='Job was interrupted and can no longer be resumed')
+                return
+            email, password = user.email, user.password
+        self._update(job.id, status='queued')
+        self._dispatch(job.id, job.table_name, job.filename, email, password)
+
+    @staticmethod
+    def new_id():
+        """
+        Returns (str): an id for a job to submit, e.g. to save its file with upload_path first
+        """
+        return uuid.uuid4().hex
+
+    def submit(self, user, table, filename, job_id=None):
+        """
+        Queues the upload of a saved spreadsheet. A file saved with upload_path is deleted once the job finishes.
+        Args:
+            user (User): the uploading user
+            table (str): table to insert into
+            filename (str): path of the saved spreadsheet
+            job_id (str): id of the job, from new_id; a new one if not given
+        Returns (str): the job id
+        """
+        job = Job(id=job_id or self.new_id(), user_id=user.id, table_name=table, filename=filename, status='queued')
+        db.session.add(job)
+        db.session.commit()
+        self._dispatch(job.id, table, filename, user.email, user.password)
+        return job.id
+
+    def cancel(self, job_id):
+        """
+        Asks for a job to stop. A queued job never starts; a running one stops before its next stage, so rows it has
+        already inserted stay in place.
+        Args:
+            job_id (str): job id
+        Returns (bool): False if the job had already finished
+        """
+        job = Job.query.get(job_id)
+        if job is None or job.status not in ['queued', 'running']:
+            return False
+        job.cancel_requested = True
+        db.session.commit()
+        with self._lock:
+            if self._cancelled is not None:
+                self._cancelled[job_id] = True
+        return True
+
+
+jobs = JobQueue()
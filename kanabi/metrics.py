@@ -0,0 +1,238 @@
+import bisect
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context, request, session
+from flask_login import current_user
+
+# upper bounds, in seconds, of the histogram buckets
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# number of functions listed in a ?profile=1 summary
+profile_limit = 40
+
+
+class Histogram:
+    """
+    Counts observed durations in cumulative buckets, as a Prometheus histogram does.
+    """
+
+    def __init__(self, buckets=default_buckets):
+        """
+        Args:
+            buckets ((float)): ascending upper bounds of the buckets; an unbounded bucket follows the last
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        Returns ([(str, int)]): the upper bound of each bucket, '+Inf' for the last, and the number of observations
+            no greater than it
+        """
+        ret = []
+        total = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            ret.append((str(bound), total))
+        return ret
+
+
+def _labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in labels)
+
+
+def _endpoint():
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'none'
+
+
+class Metrics:
+    """
+    Times requests, and the phases of their work (connect, compile, execute, fetch, serialize, validate, ...),
+    per endpoint, and renders the measurements in the Prometheus text format for GET /metrics.
+    Phases are timed with the timer context manager or the timed decorator; the endpoint is that of the request
+    being handled, or 'none' outside of one. Measurements are kept per server process.
+    An admin can add profile=1 to the query string of any request to get a cProfile summary of it instead of its
+    response.
+    Usage:
+        with metrics.timer('execute'):
+            cur.execute(query)
+
+        @metrics.timed('validate')
+        def validate_row(json_item, table):
+            ...
+    """
+
+    def __init__(self, buckets=default_buckets):
+        """
+        Args:
+            buckets ((float)): upper bounds, in seconds, of the histogram buckets
+        """
+        self.buckets = buckets
+        self._requests = {}  # (endpoint, method) -> Histogram
+        self._responses = {}  # (endpoint, method, status) -> count
+        self._phases = {}  # (endpoint, phase) -> Histogram
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Times every request of the app, and profiles those that ask for it.
+        Args:
+            app (Flask): the app
+        Returns: None
+        """
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def observe(self, phase, seconds, endpoint=None):
+        """
+        Records the duration of a phase.
+        Args:
+            phase (str): phase name
+            seconds (float): its duration
+            endpoint (str): endpoint it was part of; that of the current request if not given
+        Returns: None
+        """
+        endpoint = endpoint or _endpoint()
+        with self._lock:
+            histogram = self._phases.get((endpoint, phase))
+            if histogram is None:
+                histogram = self._phases[(endpoint, phase)] = Histogram(self.buckets)
+            histogram.observe(seconds)
+        if has_request_context() and 'metrics_phases' in g:
+            g.metrics_phases[phase] = g.metrics_phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, phase):
+        """
+        Times the block as one occurrence of a phase, whether or not it raises.
+        Args:
+            phase (str): phase name
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - started)
+
+    def timed(self, phase):
+        """
+        Decorator that times each call of a function as one occurrence of a phase.
+        Args:
+            phase (str): phase name
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(phase):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _record_request(self, endpoint, method, status, seconds):
+        with self._lock:
+            histogram = self._requests.get((endpoint, method))
+            if histogram is None:
+                histogram = self._requests[(endpoint, method)] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            key = (endpoint, method, status)
+            self._responses[key] = self._responses.get(key, 0) + 1
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_phases = {}
+        if request.args.get('profile') == '1' and current_user.is_authenticated and session.get('is_admin'):
+            g.metrics_profiler = cProfile.Profile()
+            g.metrics_profiler.enable()
+
+    def _after_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        profiler = g.pop('metrics_profiler', None)
+        if profiler is not None:
+            # run a streamed body here, so that its work is part of the profile
+            response.get_data()
+            profiler.disable()
+            self._profile_response(response, profiler, time.perf_counter() - started)
+
+        endpoint, method, status = _endpoint(), request.method, response.status_code
+        # streamed bodies are produced after this returns; the request is over once the response is closed
+        response.call_on_close(
+            lambda: self._record_request(endpoint, method, status, time.perf_counter() - started))
+        return response
+
+    def _profile_response(self, response, profiler, seconds):
+        """
+        Replaces the body of a profiled response with the profile summary: the time spent in each phase and the
+        functions that took the most time, including the functions they called.
+        """
+        out = io.StringIO()
+        out.write(f'{request.method} {request.full_path.rstrip("?")} -> {response.status_code} '
+                  f'in {seconds * 1000:.1f} ms\n')
+        for phase, phase_seconds in sorted(g.metrics_phases.items(), key=lambda item: -item[1]):
+            out.write(f'  {phase:<12}{phase_seconds * 1000:10.1f} ms\n')
+        out.write('\n')
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(profile_limit)
+        response.set_data(out.getvalue())
+        response.status_code = 200
+        response.mimetype = 'text/plain'
+        response.headers.pop('ETag', None)
+
+    def render(self, extra=()):
+        """
+        Renders the measurements in the Prometheus text exposition format.
+        Args:
+            extra ([(str, str, str, float)]): further samples to include, as (name, type, help, value)
+        Returns (str): the metrics
+        """
+        with self._lock:
+            requests = {key: (h.cumulative(), h.sum, h.count) for key, h in self._requests.items()}
+            responses = dict(self._responses)
+            phases = {key: (h.cumulative(), h.sum, h.count) for key, h in self._phases.items()}
+
+        lines = []
+
+        def histogram(name, help_text, label_names, histograms):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for key in sorted(histograms):
+                buckets, total, count = histograms[key]
+                labels = list(zip(label_names, key))
+                for bound, bucket_count in buckets:
+                    lines.append(f'{name}_bucket{{{_labels(labels + [("le", bound)])}}} {bucket_count}')
+                lines.append(f'{name}_sum{{{_labels(labels)}}} {total}')
+                lines.append(f'{name}_count{{{_labels(labels)}}} {count}')
+
+        histogram('kanabi_request_duration_seconds', 'Time taken to handle requests, including streaming the response.',
+                  ('endpoint', 'method'), requests)
+        lines.append('# HELP kanabi_responses_total Responses sent, by status.')
+        lines.append('# TYPE kanabi_responses_total counter')
+        for key in sorted(responses):
+            lines.append(f'kanabi_responses_total{{{_labels(zip(("endpoint", "method", "status"), key))}}} '
+                         f'{responses[key]}')
+        histogram('kanabi_phase_duration_seconds', 'Time taken by each phase of the work of requests.',
+                  ('endpoint', 'phase'), phases)
+        for name, kind, help_text, value in extra:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
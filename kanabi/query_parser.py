@@ -1,5 +1,34 @@
+import base64
+import binascii
 import json
 
+from psycopg2 import sql
+
+from .validation.intake_conversion import ConversionException, converters, intake_column_types
+
+# column identifying a row of each table, used to break ties in the sort order when paging
+table_keys = {
+    'intake': 'row',
+    'reports': 'row',
+    'violations': 'row',
+    'txn_history': 'id',
+    'archive': 'row_id',
+}
+sort_directions = ['asc', 'desc']
+# filter operators, and the SQL operator of those that compare a column with a single operand
+operators = {
+    '<': '<',
+    '<=': '<=',
+    '>': '>',
+    '>=': '>=',
+    '=': '=',
+    'like': 'LIKE',
+    'ilike': 'ILIKE',
+    'in': None,
+    'between': None,
+    'is_null': None,
+}
+
 
 class RequestParseException(Exception):
     def __init__(self, msg: str):
@@ -26,73 +55,298 @@ def invalid_binary_operation(o: str) -> str:
     return f"Found an AND or OR construct with invalid structure. Construct was: {json.dumps(o)}"
 
 
+def array_literal(values: []) -> str:
+    """
+    Writes a list as a Postgres array literal. Being untyped text, it is cast to whatever array type it is compared
+    with, just as single operands are.
+    Args:
+        values ([]): array elements; None becomes NULL
+    Returns (str): the array literal
+    """
+    def element(v):
+        if v is None:
+            return 'NULL'
+        return '"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return '{' + ','.join(element(v) for v in values) + '}'
+
+
+def invalid_token_msg() -> str:
+    return "Continuation token is invalid or does not match the requested ordering"
+
+
+def encode_token(keyset: [(str, str)], values: []) -> str:
+    """
+    Builds the continuation token handed out with a page of results.
+    Args:
+        keyset ([(str, str)]): (column, direction) pairs the results are sorted by
+        values ([]): the sort column values of the last row of the page
+    Returns (str): opaque token; passing it back as 'after' fetches the next page
+    """
+    body = {
+        'order': [list(k) for k in keyset],
+        'after': [None if v is None else str(v) for v in values]
+    }
+    return base64.urlsafe_b64encode(json.dumps(body).encode()).decode()
+
+
+def decode_token(token: str, keyset: [(str, str)]) -> []:
+    """
+    Reads the sort column values back out of a continuation token.
+    Args:
+        token (str): token produced by encode_token
+        keyset ([(str, str)]): (column, direction) pairs of the current request, which must match the token's
+    Returns ([]): the sort column values of the last row seen
+    Raises: RequestParseException if the token is malformed or was issued for a different ordering
+    """
+    try:
+        body = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        order = [tuple(k) for k in body['order']]
+        values = body['after']
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError, AttributeError):
+        raise RequestParseException(invalid_token_msg())
+    if order != list(keyset) or not isinstance(values, list) or len(values) != len(keyset):
+        raise RequestParseException(invalid_token_msg())
+    return values
+
+
 class QueryParser:
 
-    def __init__(self, tables: [str]):
-        self.db_tables = tables
-        self.col_names = []
+    def __init__(self, schema):
+        """
+        Args:
+            schema (Schema): tables and columns that requests may name, as kept by kanabi.db.catalog
+        """
+        self.schema = schema
+        self.db_tables = schema.tables
+        self.col_names = frozenset()
+        self.keyset = []
+        self.limit = None
+        self.params = []
+        self.column_types = {}
 
-    def parse_or(self, op_block: json) -> str:
+    def parse_or(self, op_block: json) -> sql.Composed:
         """
         Parses an OR-block in a request.
         Args:
             op_block ({}): JSON block containing an OR operation
-        Returns (str): the SQL query string corresponding to the JSON request
+        Returns (sql.Composed): the SQL corresponding to the JSON request, with its operands added to self.params
         Raises: RequestParseException if op cannot be parsed
         """
-        or_block = op_block.get('or')
-        try:
-            if len(or_block) != 2:
-                raise IndexError
-            left = or_block[0]
-            right = or_block[1]
-            return f"({self.parse_op(left)} OR {self.parse_op(right)})"
-        except IndexError:
-            raise RequestParseException(invalid_binary_operation(op_block))
+        return self.parse_bool(op_block, 'or')
 
-    def parse_and(self, op_block: json) -> str:
+    def parse_and(self, op_block: json) -> sql.Composed:
         """
         Parses an AND-block in a request.
         Args:
             op_block ({}): JSON block containing an AND operation
-        Returns (str): the SQL query string corresponding to the JSON request
+        Returns (sql.Composed): the SQL corresponding to the JSON request, with its operands added to self.params
         Raises: RequestParseException if op cannot be parsed
         """
-        and_block = op_block.get('and')
-        try:
-            if len(and_block) != 2:
-                raise IndexError
-            left = and_block[0]
-            right = and_block[1]
-            return f"({self.parse_op(left)} AND {self.parse_op(right)})"
-        except IndexError:
+        return self.parse_bool(op_block, 'and')
+
+    def parse_bool(self, op_block: json, kind: str) -> sql.Composed:
+        """
+        Parses an AND- or OR-block holding any number of operations. Blocks of the same kind nested inside it are
+        flattened into it without recursing, and in an OR-block, equality tests on the same column are merged into
+        a single "= ANY" test, so long chains of alternatives compile to one compact condition.
+        Args:
+            op_block ({}): JSON block containing the operation
+            kind (str): 'and' or 'or'
+        Returns (sql.Composed): the SQL corresponding to the JSON request, with its operands added to self.params
+        Raises: RequestParseException if op cannot be parsed
+        """
+        items = op_block.get(kind)
+        if not isinstance(items, list) or len(items) == 0:
             raise RequestParseException(invalid_binary_operation(op_block))
 
-    def parse_op(self, op_block: json) -> str:
+        # flatten, keeping the operations in request order
+        ops = []
+        pending = list(reversed(items))
+        while pending:
+            item = pending.pop()
+            if isinstance(item, dict) and len(item) == 1 and isinstance(item.get(kind), list) and item[kind]:
+                pending.extend(reversed(item[kind]))
+            else:
+                ops.append(item)
+
+        # group the values compared for equality with each column, at the position of the column's first test
+        merged = {}
+        if kind == 'or':
+            for item in ops:
+                if isinstance(item, dict) and item.get('op') in ['=', 'in'] and isinstance(item.get('column'), str):
+                    self.validate_column(item['column'])
+                    values = item.get('operand') if item['op'] == 'in' else [item.get('operand')]
+                    if not isinstance(values, list):
+                        raise RequestParseException("The 'in' operator requires a list operand")
+                    merged.setdefault(item['column'].lower(), []).extend(values)
+
+        grouped = set(merged)
+        terms = []
+        for item in ops:
+            if isinstance(item, dict) and item.get('op') in ['=', 'in'] and \
+                    isinstance(item.get('column'), str) and item['column'].lower() in grouped:
+                col = item['column'].lower()
+                if col in merged:
+                    terms.append(self.compare_any(col, merged.pop(col)))
+            else:
+                terms.append(self.parse_op(item))
+        if len(terms) == 1:
+            return terms[0]
+        return sql.SQL('({})').format(sql.SQL(f' {kind.upper()} ').join(terms))
+
+    def compare_any(self, col: str, values: []) -> sql.Composed:
+        """
+        Builds a test of a column against a list of values, with the list passed as one array parameter.
+        Args:
+            col (str): column name, already validated
+            values ([]): values to compare with
+        Returns (sql.Composed): SQL condition
+        """
+        if len(values) == 1:
+            self.params.append(self.operand(col, values[0]))
+            return sql.SQL("({} = %s)").format(sql.Identifier(col))
+        self.params.append(array_literal([self.operand(col, v) for v in values]))
+        return sql.SQL("({} = ANY(%s))").format(sql.Identifier(col))
+
+    def parse_op(self, op_block: json) -> sql.Composed:
         """
         Parses an operation in a request.
         Args:
             op_block ({}): JSON block containing the operation
-        Returns (str): the SQL query string corresponding to the JSON request
+        Returns (sql.Composed): the SQL corresponding to the JSON request, with its operands added to self.params
         Raises: RequestParseException if op cannot be parsed
         """
-        if op_block.get('and') is not None and op_block.get('or') is not None:
+        if not isinstance(op_block, dict):
+            raise RequestParseException(invalid_request_msg(op_block))
+        if len([k for k in ['and', 'or', 'not'] if op_block.get(k) is not None]) > 1:
             raise RequestParseException(invalid_request_msg(op_block))
         if op_block.get('and') is not None:
             return self.parse_and(op_block)
         if op_block.get('or') is not None:
             return self.parse_or(op_block)
+        if op_block.get('not') is not None:
+            return sql.SQL("(NOT {})").format(self.parse_op(op_block['not']))
         # basic operator
         op = op_block.get('op')
         if op is None:
             raise RequestParseException("No operation requested in block: " + json.dumps(op_block))
-        if op in ['<', '<=', '>', '>=', '=']:
-            col = op_block.get('column')
+        if op not in operators:
+            raise RequestParseException(unknown_operator_msg(op))
+        col = op_block.get('column')
+        self.validate_column(col)
+        column = sql.Identifier(col.lower())
+        operand = op_block.get('operand')
+        if op == 'is_null':
+            return sql.SQL("({} IS NULL)").format(column)
+        if op == 'in':
+            if not isinstance(operand, list) or len(operand) == 0:
+                raise RequestParseException("The 'in' operator requires a non-empty list operand")
+            return self.compare_any(col.lower(), operand)
+        if op == 'between':
+            if not isinstance(operand, list) or len(operand) != 2:
+                raise RequestParseException("The 'between' operator requires a list of two operands")
+            self.params.extend(self.operand(col.lower(), x) for x in operand)
+            return sql.SQL("({} BETWEEN %s AND %s)").format(column)
+        if op in ('like', 'ilike'):
+            # patterns match the text of a value, whatever the column's type
+            self.params.append(str(operand))
+            if col.lower() in self.column_types:
+                column = sql.SQL("{}::text").format(column)
+            return sql.SQL("({} {} %s)").format(column, sql.SQL(operators[op]))
+        self.params.append(self.operand(col.lower(), operand))
+        return sql.SQL("({} {} %s)").format(column, sql.SQL(operators[op]))
+
+    def operand(self, col: str, value):
+        """
+        Converts an operand to the type of the column it is compared with, so that dates and amounts compare by value
+        and through their indexes rather than as text. Operands of text columns are passed as text, and Postgres
+        coerces them as it always did for quoted literals.
+        Args:
+            col (str): column name, already validated
+            value (any): operand from the request
+        Returns (any): the parameter value
+        Raises: RequestParseException if the operand can't be converted to the column's type
+        """
+        sql_type = self.column_types.get(col)
+        if sql_type is None:
+            return str(value)
+        try:
+            return converters[sql_type](value)
+        except ConversionException:
+            raise RequestParseException(f"Operand {value} does not match the type of column {col} ({sql_type})")
+
+    def parse_order_by(self, order_by: json, table: str) -> [(str, str)]:
+        """
+        Parses the sort order of a request. The table's key column is appended as a final tie-breaker, so that
+        every row has a distinct position and pages never overlap.
+        Args:
+            order_by ([]): list of column names or {"column": <name>, "direction": "asc"|"desc"} objects
+            table (str): the table being queried
+        Returns ([(str, str)]): (column, direction) pairs
+        Raises: RequestParseException if the sort order cannot be parsed
+        """
+        if order_by is None:
+            order_by = []
+        elif not isinstance(order_by, list):
+            order_by = [order_by]
+        keyset = []
+        for item in order_by:
+            if isinstance(item, str):
+                col, direction = item, 'asc'
+            elif isinstance(item, dict) and isinstance(item.get('column'), str):
+                col, direction = item['column'], str(item.get('direction', 'asc')).lower()
+            else:
+                raise RequestParseException(f"Invalid order_by entry: {json.dumps(item)}")
             self.validate_column(col)
-            operand = op_block.get('operand')
-            return f"({col} {op} '{operand}')"
+            if direction not in sort_directions:
+                raise RequestParseException(f"Sort direction must be one of {sort_directions}, found {direction}")
+            keyset.append((col.lower(), direction))
+        key = table_keys.get(table)
+        if key is not None and key not in [col for col, _ in keyset]:
+            keyset.append((key, 'asc'))
+        return keyset
+
+    def parse_after(self, after: json, keyset: [(str, str)]) -> sql.Composed:
+        """
+        Builds the condition selecting the rows that sort after a given position.
+        Args:
+            after (str or {}): a continuation token, or an object giving values for the leading sort columns,
+                e.g. {"row": 100} or {"tstamp": "2020-06-01 12:00:00"}
+            keyset ([(str, str)]): (column, direction) pairs the results are sorted by
+        Returns (sql.Composed): SQL condition, with its values added to self.params
+        Raises: RequestParseException if the position cannot be parsed
+        """
+        if isinstance(after, str):
+            values = decode_token(after, keyset)
+        elif isinstance(after, dict) and after:
+            cols = [col for col, _ in keyset]
+            if [c.lower() for c in after] != cols[:len(after)]:
+                raise RequestParseException(f"'after' must give values for the leading order_by columns {cols}")
+            values = list(after.values())
+            keyset = keyset[:len(values)]
         else:
-            raise RequestParseException(unknown_operator_msg(op))
+            raise RequestParseException("'after' must be a continuation token or an object of column values")
+
+        # Postgres sorts NULL above every value: last in ascending order, first in descending order
+        def later(col, direction, value):
+            if value is None:
+                return sql.SQL('FALSE' if direction == 'asc' else '{} IS NOT NULL').format(sql.Identifier(col))
+            self.params.append(self.operand(col, value))
+            if direction == 'asc':
+                return sql.SQL("({0} > %s OR {0} IS NULL)").format(sql.Identifier(col))
+            return sql.SQL("{} < %s").format(sql.Identifier(col))
+
+        def same(col, value):
+            if value is None:
+                return sql.SQL("{} IS NULL").format(sql.Identifier(col))
+            self.params.append(self.operand(col, value))
+            return sql.SQL("{} = %s").format(sql.Identifier(col))
+
+        terms = []
+        for i, (col, direction) in enumerate(keyset):
+            term = [same(c, v) for (c, _), v in zip(keyset[:i], values[:i])] + [later(col, direction, values[i])]
+            terms.append(sql.SQL('({})').format(sql.SQL(' AND ').join(term)))
+        return sql.SQL('({})').format(sql.SQL(' OR ').join(terms))
 
     def validate_column(self, col: str) -> None:
         """
@@ -102,16 +356,18 @@ class QueryParser:
         Returns: None
         Raises: RequestParseException if col is not a valid column name
         """
-        if col.lower() not in self.col_names:
+        if not isinstance(col, str) or col.lower() not in self.col_names:
             raise RequestParseException(invalid_column_msg(col))
 
-    def build_query(self, q: json) -> str:
+    def build_query(self, q: json) -> (sql.Composed, tuple):
         """
-        Constructs a SQL query from a JSON input.
+        Constructs a SQL query from a JSON input. Operand values are never part of the SQL itself, so requests that
+        differ only in their operands produce the same SQL, which lets the database reuse its plan.
         Args:
             q ({}): JSON query input
-        Returns (str): the SQL query string
+        Returns (sql.Composed, tuple): the SQL query, with %s placeholders, and its parameters
         """
+        self.params = []
         try:
             # table name required
             table = q.get('table')
@@ -120,26 +376,13 @@ class QueryParser:
             elif table not in self.db_tables:
                 raise RequestParseException(invalid_table_msg(table))
 
+            self.col_names = self.schema.columns[table]
+            self.column_types = {}
             if table == 'intake':
-                from .models import IntakeRow
-                self.col_names = [x.name.lower() for x in IntakeRow.ColNames]
-            elif table == 'archive':
-                from .models import ArchiveRow
-                self.col_names = [x.name.lower() for x in ArchiveRow.ColNames]
-            elif table == 'metadata':
-                from .models import MetadataRow
-                self.col_names = [x.name.lower() for x in MetadataRow.ColNames]
-            elif table == 'txn_history':
-                from .models import TxnHistoryRow
-                self.col_names = [x.name.lower() for x in TxnHistoryRow.ColNames]
-            elif table == 'reports':
-                from .models import ReportsRow
-                self.col_names = [x.name.lower() for x in ReportsRow.ColNames]
-            elif table == 'violations':
-                from .models import ViolationsRow
-                self.col_names = [x.name.lower() for x in ViolationsRow.ColNames]
-            else:
-                raise RequestParseException("Requested table not found")
+                # operands are only converted for the columns the database actually stores typed
+                db_types = self.schema.column_types[table]
+                self.column_types = {col: sql_type for col, sql_type in intake_column_types.items()
+                                     if db_types.get(col, 'text') != 'text'}
 
             # if columns not listed, assume all
             columns = q.get('columns')
@@ -151,15 +394,42 @@ class QueryParser:
                 for col in columns:
                     self.validate_column(col)
 
-            query = f"SELECT {', '.join(columns)} FROM {table} "
+            # paging: sort order, page size and the position to continue from
+            limit = q.get('limit')
+            if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 1):
+                raise RequestParseException("Limit must be a positive integer")
+            after = q.get('after')
+            order_by = q.get('order_by')
+            self.keyset = []
+            self.limit = limit
+            if order_by is not None or limit is not None or after is not None:
+                self.keyset = self.parse_order_by(order_by, table)
+
+            select = [sql.SQL('*')] if columns == '*' else [sql.Identifier(col.lower()) for col in columns]
+            if limit is not None:
+                # the sort columns follow the requested ones, so the last row of a page gives the next page's token
+                select += [sql.Identifier(col) for col, _ in self.keyset]
+            query = [sql.SQL("SELECT {} FROM {}").format(sql.SQL(', ').join(select), sql.Identifier(table))]
             # get extended filtering
+            conditions = []
             where = q.get('where')
             if where is not None:
-                query += 'WHERE '
                 # iterate over operators
-                query += self.parse_op(where)
+                conditions.append(self.parse_op(where))
+            if after is not None:
+                conditions.append(self.parse_after(after, self.keyset))
+            if conditions:
+                query.append(sql.SQL("WHERE {}").format(sql.SQL(' AND ').join(conditions)))
+            if self.keyset:
+                query.append(sql.SQL("ORDER BY {}").format(sql.SQL(', ').join(
+                    sql.SQL("{} {}").format(sql.Identifier(col), sql.SQL(direction.upper()))
+                    for col, direction in self.keyset)))
+            if limit is not None:
+                # one extra row tells whether there is a next page
+                query.append(sql.SQL("LIMIT %s"))
+                self.params.append(limit + 1)
 
-            return query + ';'
+            return sql.SQL(' ').join(query), tuple(self.params)
 
         except RequestParseException as e:
             e.msg = invalid_request_msg(e.msg)
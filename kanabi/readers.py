@@ -0,0 +1,295 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+default_batch_size = 5000
+# text that pd.read_excel reads as a blank cell
+na_values = frozenset(['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>',
+                       'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null'])
+
+
+def column_names(header):
+    """
+    Names the columns of a header row the way pd.read_excel does: blank cells become 'Unnamed: <position>' and
+    repeated names get a '.<n>' suffix.
+    Args:
+        header (()): values of the header row
+    Returns ([str]): column names
+    """
+    names = []
+    seen = {}
+    for i, value in enumerate(header):
+        name = f'Unnamed: {i}' if value is None else value
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def cell_value(value):
+    """
+    Normalizes a cell value the way pd.read_excel does: blank cells and na_values are NaN, and whole floats are ints.
+    """
+    if value is None or (isinstance(value, str) and value in na_values):
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+class UnsupportedFileException(Exception):
+    """
+    Raised when an uploaded file is in none of the formats there is a reader for, or its reader can't be used.
+    """
+    pass
+
+
+class FileReader:
+    """
+    Reads the rows of an uploaded file in DataFrames of at most batch_size rows, shaped like those of pd.read_excel,
+    and counts its rows and columns along the way for its metadata. Subclasses implement batches() for one format.
+    Usage:
+        with reader_for(filename) as reader:
+            for df in reader.batches():
+                ...
+            metadata = read_metadata(reader)
+    """
+    # file extensions and leading bytes of the format, used by reader_for
+    extensions = ()
+    signature = None
+
+    def __init__(self, filename, batch_size=default_batch_size):
+        """
+        Args:
+            filename (str): the file
+            batch_size (int): number of rows in each DataFrame
+        """
+        self.filename = filename
+        self.batch_size = batch_size
+        self.header = None
+        self.row_count = 0
+        self.column_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Releases the file.
+        Returns: None
+        """
+        pass
+
+    def batches(self):
+        """
+        Reads the rows of the file. The first row is the header.
+        Returns (generator): DataFrames of at most batch_size rows
+        """
+        raise NotImplementedError
+
+    def properties(self):
+        """
+        Returns (dict): the document properties of the file: creator, created, modified, lastModifiedBy and title. The
+            times default to those of the file itself.
+        """
+        os_data = os.stat(self.filename)
+        return {
+            'creator': None,
+            'created': datetime.fromtimestamp(os_data.st_ctime),
+            'modified': datetime.fromtimestamp(os_data.st_mtime),
+            'lastModifiedBy': None,
+            'title': None,
+        }
+
+    def _count(self, df):
+        self.header = tuple(df.columns)
+        self.column_count = len(df.columns)
+        self.row_count += len(df)
+        return df
+
+
+class WorkbookReader(FileReader):
+    """
+    Reads the first sheet of an .xlsx file in a single pass, in openpyxl's read-only mode, which streams rows from the
+    file instead of loading the whole sheet.
+    """
+    extensions = ('xlsx', 'xlsm')
+    signature = b'PK\x03\x04'
+
+    def __init__(self, filename, batch_size=default_batch_size):
+        super().__init__(filename, batch_size)
+        self._file = None
+        self._workbook = None
+
+    def close(self):
+        """
+        Closes the file; read-only workbooks hold it open until then.
+        Returns: None
+        """
+        if self._workbook is not None:
+            self._workbook.close()
+            self._workbook = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        if self._workbook is None:
+            # opened here rather than by openpyxl, which refuses file names without an Excel extension
+            self._file = open(self.filename, 'rb')
+            self._workbook = load_workbook(self._file, read_only=True, data_only=True)
+        return self._workbook
+
+    def _frame(self, rows, columns):
+        df = pd.DataFrame.from_records(rows, columns=columns)
+        # a column left blank throughout a batch would be read as floats; keep it as text like the rest of the file
+        blank = [name for name in df.columns if df[name].isna().all()]
+        if blank:
+            df[blank] = df[blank].astype(object)
+        return df
+
+    def batches(self):
+        """
+        Reads the rows of the first sheet. The first row is the header; rows that are entirely blank are skipped.
+        Returns (generator): DataFrames of at most batch_size rows
+        """
+        sheet = self._open().worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        self.header = next(rows, None)
+        if self.header is None:
+            return
+        self.row_count = 1
+        self.column_count = len(self.header)
+        columns = column_names(self.header)
+        width = len(columns)
+
+        batch = []
+        for row in rows:
+            self.row_count += 1
+            self.column_count = max(self.column_count, len(row))
+            if all(value is None for value in row):
+                continue
+            values = [cell_value(value) for value in row[:width]]
+            values += [np.nan] * (width - len(values))
+            batch.append(values)
+            if len(batch) == self.batch_size:
+                yield self._frame(batch, columns)
+                batch = []
+        if batch:
+            yield self._frame(batch, columns)
+
+    def properties(self):
+        properties = super().properties()
+        workbook_properties = self._open().properties.__dict__
+        for name in properties:
+            if workbook_properties.get(name) is not None:
+                properties[name] = workbook_properties[name]
+        return properties
+
+
+class LegacyWorkbookReader(FileReader):
+    """
+    Reads the first sheet of an .xls file with pd.read_excel. The format can't be streamed, so the whole sheet is
+    read before it is handed out in batches.
+    """
+    extensions = ('xls',)
+    signature = b'\xd0\xcf\x11\xe0'
+
+    def batches(self):
+        df = pd.read_excel(self.filename)
+        # count the header row, as the other spreadsheet readers do
+        self.row_count = 1
+        for start in range(0, len(df), self.batch_size):
+            yield self._count(df.iloc[start:start + self.batch_size].reset_index(drop=True))
+
+
+class CsvReader(FileReader):
+    """
+    Reads a .csv file in chunks. Every column is declared as text, which spares pandas inferring types and keeps a
+    column's type the same from one chunk to the next; the insert stage converts the values to the table's types.
+    """
+    extensions = ('csv',)
+
+    def batches(self):
+        self.row_count = 1
+        for df in pd.read_csv(self.filename, chunksize=self.batch_size, dtype=str):
+            yield self._count(df)
+
+
+class ParquetReader(FileReader):
+    """
+    Reads a .parquet file a row group batch at a time with pyarrow, memory-mapping the file rather than reading it
+    into memory. Columns keep the types the file declares.
+    """
+    extensions = ('parquet', 'pq')
+    signature = b'PAR1'
+
+    def batches(self):
+        if pq is None:
+            raise UnsupportedFileException('Reading Parquet files requires pyarrow')
+        parquet_file = pq.ParquetFile(self.filename, memory_map=True)
+        metadata = parquet_file.metadata
+        self.header = tuple(parquet_file.schema_arrow.names)
+        self.column_count = metadata.num_columns
+        self.row_count = 1
+        for batch in parquet_file.iter_batches(batch_size=self.batch_size):
+            yield self._count(batch.to_pandas())
+
+    def properties(self):
+        properties = super().properties()
+        if pq is not None:
+            properties['creator'] = pq.read_metadata(self.filename).created_by
+        return properties
+
+
+# readers by file extension; files with any other extension are identified by their leading bytes
+readers = {}
+for _reader in [WorkbookReader, LegacyWorkbookReader, CsvReader, ParquetReader]:
+    for _extension in _reader.extensions:
+        readers[_extension] = _reader
+
+
+def sniff(filename):
+    """
+    Identifies the format of a file from its leading bytes. Files that match no binary format are taken to be CSV.
+    Args:
+        filename (str): the file
+    Returns (type): the FileReader subclass for the format
+    """
+    with open(filename, 'rb') as f:
+        head = f.read(8)
+    for reader in [WorkbookReader, LegacyWorkbookReader, ParquetReader]:
+        if head.startswith(reader.signature):
+            return reader
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError:
+        raise UnsupportedFileException(f'Format of {os.path.basename(filename)} is not recognized')
+    return CsvReader
+
+
+def reader_for(filename, batch_size=default_batch_size):
+    """
+    Picks the reader for a file by its extension, or by its content if the extension is not a known one.
+    Args:
+        filename (str): the file
+        batch_size (int): number of rows in each DataFrame
+    Returns (FileReader): the reader
+    """
+    extension = filename.rsplit('.', 1)[1].lower() if '.' in os.path.basename(filename) else ''
+    reader = readers.get(extension) or sniff(filename)
+    return reader(filename, batch_size)
@@ -1,10 +1,28 @@
+from datetime import date, datetime
+from decimal import Decimal
+
 from flask import make_response, jsonify, session
+from flask.json import JSONEncoder
 from flask_login import current_user, AnonymousUserMixin
 from .cors import cors_setup
 
 origin_list = []
 
 
+class KanabiJSONEncoder(JSONEncoder):
+    """
+    Serializes the typed intake columns: dates as YYYY-MM-DD and amounts as strings, which keeps their cents exact.
+    Timestamps keep Flask's default format.
+    """
+
+    def default(self, o):
+        if isinstance(o, date) and not isinstance(o, datetime):
+            return o.isoformat()
+        if isinstance(o, Decimal):
+            return str(o)
+        return super().default(o)
+
+
 # Makes a response formatted for use with the frontend GUI
 def make_gui_response(headers, return_code, status_msg):
     '''
@@ -42,12 +60,16 @@ def make_gui_response(headers, return_code, status_msg):
     '''
 
     global origin_list
+    from .user import user_cache
     if 'read_only_mode' not in session:
         session['read_only_mode'] = False
 
-    if not isinstance(current_user._get_current_object(), AnonymousUserMixin):
-        user_dict = {'name': current_user.name, 'email': current_user.email,
-                     'read_only_mode': session['read_only_mode'], 'is_admin': current_user.is_admin}
+    user = current_user._get_current_object()
+    if not isinstance(user, AnonymousUserMixin):
+        # the cached snapshot, which is up to date even if the request changed the user
+        user = user_cache.get(user.get_id()) or user
+        user_dict = {'name': user.name, 'email': user.email,
+                     'read_only_mode': session['read_only_mode'], 'is_admin': user.is_admin}
     else:
         user_dict = {'logged_in': False}
 
@@ -5,23 +5,31 @@ from sqlite3 import DatabaseError
 
 import markdown
 import markdown.extensions.fenced_code
-from flask import Blueprint, jsonify, make_response, request, session, Response
+from flask import Blueprint, jsonify, make_response, request, session, Response, stream_with_context
+from flask import json as flask_json
 from flask_login import login_required, current_user
 from flask_principal import Permission, RoleNeed
-from pandas import json_normalize
-from pandas.io.json import json_normalize
 from werkzeug.security import generate_password_hash
 
 import kanabi.driver as driver
 from .auth import logout
 from .configure import db
+from .jobs import Job, jobs, upload_path
+from .metrics import metrics
+from .readers import readers
 from .responses import make_gui_response
-from .user import User
+from .user import User, user_cache
+from .writers import parquet_available, parquet_chunks, parquet_row_group_size
 
 UPLOAD_FOLDER = 'kanabi/resources'
-ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
+ALLOWED_EXTENSIONS = set(readers)
 json_header = {"Content-Type": "application/json"}
 admin_only_tables = ['archive', 'txn_history']
+export_types = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
 
 main_bp = Blueprint('main_bp', __name__)
 
@@ -113,6 +121,7 @@ def user_admin(req: {}, mode: str) -> Response:
     user = User.query.filter_by(email=email).one()
     if user is None:
         return make_gui_response(json_header, 400, 'Target user could not be found')
+    user_id = user.id
 
     if mode == 'makeadmin':
         user.is_admin = True
@@ -144,12 +153,25 @@ def user_admin(req: {}, mode: str) -> Response:
         driver.remove_db_user(user.email)
         if user == current_user:
             db.session.commit()
+            user_changed(user_id)
             return logout()
 
     db.session.commit()
+    user_changed(user_id)
     return make_gui_response(json_header, 200, 'OK')
 
 
+def user_changed(user_id):
+    """
+    Drops a changed user from the user cache of this server process, and of the others.
+    Args:
+        user_id (int): id of the user
+    Returns: None
+    """
+    user_cache.invalidate(user_id)
+    driver.notify_user_changed(user_id)
+
+
 def list_users(mode: str) -> Response:
     """
     Allows a user with admin credentials to list active users and admins.
@@ -202,6 +224,11 @@ def admin_tools(mode: str) -> Response:
                 return list_users(mode)
             else:
                 return make_gui_response(json_header, 400, 'This resource only supports GET method')
+        elif mode == 'poolstats':
+            if request.method == 'GET':
+                return make_response(jsonify(driver.pool_stats()), 200)
+            else:
+                return make_gui_response(json_header, 400, 'This resource only supports GET method')
         else:
             return make_gui_response(json_header, 400, 'Unrecognized operation requested')
 
@@ -289,6 +316,104 @@ def test_read_only():
     return make_gui_response(json_header, 200, 'OK')
 
 
+def json_array_chunks(names, chunks):
+    """
+    Encodes streamed table rows as a JSON array of row objects, one chunk of rows at a time.
+    Args:
+        names ([str]): column names
+        chunks (generator): lists of row tuples, as produced by driver.stream_table
+    Returns (generator): str pieces of the JSON document
+    """
+    yield '['
+    sep = ''
+    for rows in chunks:
+        with metrics.timer('serialize'):
+            piece = sep + ','.join(flask_json.dumps(dict(zip(names, row)), separators=(',', ':')) for row in rows)
+        yield piece
+        sep = ','
+    yield ']\n'
+
+
+def ndjson_chunks(names, chunks):
+    """
+    Encodes streamed rows as newline-delimited JSON, one row object per line, a chunk of rows at a time.
+    Args:
+        names ([str]): column names
+        chunks (generator): lists of row tuples, as produced by driver.stream_query
+    Returns (generator): str pieces of the document
+    """
+    for rows in chunks:
+        with metrics.timer('serialize'):
+            piece = ''.join(flask_json.dumps(dict(zip(names, row)), separators=(',', ':')) + '\n' for row in rows)
+        yield piece
+
+
+def etag_response(body, etag, mimetype):
+    """
+    Builds a response carrying an ETag, or an empty 304 response if the client already holds that version.
+    Args:
+        body (bytes): response body
+        etag (str): entity tag of the body
+        mimetype (str): response type
+    Returns (Response): the response
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, 200, mimetype=mimetype)
+    response.set_etag(etag)
+    return response
+
+
+def caching_stream(pieces, table, key, generation):
+    """
+    Passes a streamed response through, and caches it once it is complete unless it grew too large for the cache.
+    Args:
+        pieces (generator): str or bytes pieces of the response
+        table (str): table the response is read from
+        key: hashable description of the query
+        generation ((int, int)): the table's cache generation from before the query ran
+    Returns (generator): bytes pieces of the response
+    """
+    kept, size = [], 0
+    for piece in pieces:
+        data = piece if isinstance(piece, bytes) else piece.encode()
+        if kept is not None:
+            size += len(data)
+            if size <= driver.result_cache.max_entry_bytes:
+                kept.append(data)
+            else:
+                kept = None
+        yield data
+    if kept is not None:
+        driver.result_cache.put(table, current_user.email, key, b''.join(kept), generation)
+
+
+def cached_response(table, key, mimetype, produce):
+    """
+    Answers a read request from the result cache, or runs it and caches its response. Cached responses carry an
+    ETag, so clients that send it back in If-None-Match get a 304 while the table is unchanged.
+    Args:
+        table (str): table the response is read from
+        key: hashable description of the query, as compiled for the user's database role
+        mimetype (str): response type
+        produce (function): runs the query and returns the response body, as bytes or as a generator of str or bytes
+            pieces to stream, or a Response to send as is (e.g. an error), which is not cached
+    Returns (Response): the response
+    """
+    cached = driver.result_cache.get(table, current_user.email, key)
+    if cached is not None:
+        return etag_response(cached[0], cached[1], mimetype)
+    generation = driver.result_cache.generation(table)
+    body = produce()
+    if isinstance(body, Response):
+        return body
+    if isinstance(body, bytes):
+        etag = driver.result_cache.put(table, current_user.email, key, body, generation)
+        return etag_response(body, etag, mimetype)
+    return Response(stream_with_context(caching_stream(body, table, key, generation)), 200, mimetype=mimetype)
+
+
 @main_bp.route("/list", methods=["GET", "POST"])
 @login_required
 def fetch_data():
@@ -308,8 +433,17 @@ def fetch_data():
         if table in admin_only_tables and not session['is_admin']:
             return make_response(jsonify('User must be logged in as admin to access this resource'), 403)
 
-        query, response, status = driver.filter_table(request.json, current_user)
-        return make_response(jsonify(response), status)
+        def produce():
+            query, response, status = driver.filter_table(request.json, current_user)
+            if status != 200:
+                return make_response(jsonify(response), status)
+            with metrics.timer('serialize'):
+                return jsonify(response).get_data()
+
+        key = driver.filter_cache_key(request.json)
+        if key is None:
+            return produce()
+        return cached_response(table, ('filter',) + key, 'application/json', produce)
 
     if request.method == 'GET':
         table_name = request.args.get('table')
@@ -324,8 +458,15 @@ def fetch_data():
             if table_name in admin_only_tables and not session['is_admin']:
                 return make_response(jsonify('User must be logged in as admin to access this resource'), 403)
 
-            table_info_obj = driver.get_table(table_name, columns, current_user)
-            return make_response(jsonify(table_info_obj), 200)
+            def produce():
+                stream = driver.stream_table(table_name, columns, current_user)
+                if stream is None:
+                    return make_response(jsonify(driver.connection_error_msg), 500)
+                names, chunks = stream
+                return json_array_chunks(names, chunks)
+
+            key = ('list', tuple(columns) if columns else None)
+            return cached_response(table_name, key, 'application/json', produce)
         except driver.InvalidTableException:
             return make_response(jsonify('Table ' + table_name + ' does not exist.'), 404)
 
@@ -338,7 +479,7 @@ def load_data():
     Load data into the database. PUT inserts a single row; POST uploads a file.
     Usage:
         PUT: /load?table=<table> -H "Content-Type: application/json" -d [<JSON object> | <filename>]
-        POST: /load?file=</path/to/file.xlsx>
+        POST: /load?file=</path/to/file.xlsx | .xls | .csv | .parquet>
     Returns ({}): HTTPS response
     """
     table_name = request.args.get('table')
@@ -347,9 +488,7 @@ def load_data():
         return make_response(jsonify(result), 400)
 
     if request.method == 'PUT':
-        try:
-            driver.get_table(table_name, None, current_user)
-        except driver.InvalidTableException:
+        if not driver.table_exists(None, table_name):
             return make_response(jsonify(f"Table {table_name} does not exist."), 404)
 
         request_json = request.get_json(force=True)
@@ -361,7 +500,8 @@ def load_data():
         try:
             if table_name.lower() == 'intake':
                 from .models import IntakeRow
-                row_data = IntakeRow.IntakeRow(request_json).value_array()
+                from .validation.intake_conversion import convert_intake_row
+                row_data = convert_intake_row(IntakeRow.IntakeRow(request_json).value_array())
             # further tables require implementation and validation
             # elif table_name.lower() == 'reports':
             #     from .models import ReportsRow
@@ -406,28 +546,46 @@ def load_data():
                 result = {'message': f'Filename \"{file.filename}\" is not supported.'}
                 return make_response(jsonify(result), 400)
 
-            filename = f'{UPLOAD_FOLDER}/' + file.filename
+            if not driver.table_exists(None, table_name):
+                return make_response(jsonify(f"Table {table_name} does not exist."), 404)
+
+            # the file is processed in the background; its progress and report are found at /jobs/<id>
+            job_id = jobs.new_id()
+            filename = upload_path(UPLOAD_FOLDER, job_id, file.filename)
             file.save(filename)
-            success, result_obj = driver.process_file(table_name, filename, current_user)
-            if success:
-                result = {
-                    'message': 'File processed successfully',
-                    'result': result_obj
-                }
-                return make_response(jsonify(result), 200)
-            else:
-                if result_obj.get('status', '') == 'invalid':
-                    return make_response(jsonify(result_obj.get('error_msg')), 400)
-                result = {
-                    'message': 'File processed, but with failed rows:',
-                    'result': result_obj
-                }
-                return make_response(jsonify(result), 400)
+            jobs.submit(current_user, table_name, filename, job_id)
+            result = {
+                'message': 'File queued for processing',
+                'job': job_id,
+                'status': f'/jobs/{job_id}'
+            }
+            return make_response(jsonify(result), 202)
 
     result = {'message': 'Unsupported operation.'}
     return make_response(jsonify(result), 404)
 
 
+@main_bp.route('/jobs/<job_id>', methods=['GET', 'DELETE'])
+@login_required
+def job_status(job_id):
+    """
+    Reports on or cancels a file upload queued by POST /load.
+    Usage:
+        GET /jobs/<id> for the job's status, rows parsed, validated and inserted so far, and its final report
+        DELETE /jobs/<id> to cancel it
+    Returns ({}): the job
+    """
+    job = Job.query.get(job_id)
+    if job is None or (job.user_id != current_user.id and not session.get('is_admin')):
+        return make_response(jsonify(f'Job {job_id} does not exist.'), 404)
+
+    if request.method == 'DELETE':
+        if not jobs.cancel(job_id):
+            return make_response(jsonify(f'Job {job_id} has already finished.'), 409)
+        db.session.refresh(job)
+    return make_response(jsonify(job.to_dict()), 200)
+
+
 @main_bp.route('/metadata', methods=['GET'])
 @login_required
 def show_metadata():
@@ -435,32 +593,77 @@ def show_metadata():
     Display the contents of the metadata table.
     Returns ({}): response object containing the contents of the table.
     """
-    response_body = jsonify(driver.get_table('metadata', None, current_user))
-    return make_response(response_body, 200)
+    def produce():
+        table = driver.get_table('metadata', None, current_user)
+        with metrics.timer('serialize'):
+            return jsonify(table).get_data()
+
+    return cached_response('metadata', ('metadata',), 'application/json', produce)
 
 
-@main_bp.route('/export', methods=['GET'])
+@main_bp.route('/export', methods=['GET', 'POST'])
 @login_required
 def export_csv():
     """
-    Returns CSV of the table listed in the request.
+    Exports the table listed in the request, or the rows and columns of it selected by the request.
     Usage:
-        GET /export?table=<table_name> -o outputfile.csv to retrieve CSV of table
-    Returns ({}): CSV object of table data
+        GET /export?table=<table_name>[&format=csv|ndjson|parquet][&columns=<col1 col2 ...>][&where=<JSON filter>]
+            -o outputfile.csv
+        POST /export with a JSON body holding 'table', and optionally 'format', 'columns' and 'where' as in POST /list
+    Returns ({}): the table data as CSV (the default), newline-delimited JSON or Parquet
     """
-    if request.method == 'GET':
-        table_name = request.args.get('table')
-        if table_name is None:
-            return make_response(jsonify('Table name not supplied.'), 400)
-        try:
-            table_output = driver.get_table(table_name, None, current_user)
-            if isinstance(table_output, str):
-                return make_response(jsonify(table_output), 400)
-            df = json_normalize(table_output)
-            table_info_obj = df.to_csv(index=False)
-            return make_response(table_info_obj, 200)
-        except driver.InvalidTableException:
-            return make_response(jsonify('Table ' + table_name + ' does not exist.'), 404)
+    if request.method == 'POST':
+        request_body = request.get_json(force=True, silent=True)
+        if not isinstance(request_body, dict):
+            return make_response(jsonify('Export request must be a JSON object.'), 400)
+    else:
+        request_body = {'table': request.args.get('table')}
+        if request.args.get('format') is not None:
+            request_body['format'] = request.args.get('format')
+        if request.args.get('columns') is not None:
+            request_body['columns'] = request.args.get('columns').replace(',', ' ').split()
+        if request.args.get('where') is not None:
+            try:
+                request_body['where'] = json.loads(request.args.get('where'))
+            except ValueError:
+                return make_response(jsonify('Filter could not be parsed as JSON.'), 400)
+
+    table_name = request_body.get('table')
+    if table_name is None:
+        return make_response(jsonify('Table name not supplied.'), 400)
+    export_format = request_body.get('format', 'csv')
+    if export_format not in export_types:
+        return make_response(jsonify(f"Format must be one of {', '.join(export_types)}."), 400)
+    if export_format == 'parquet' and not parquet_available():
+        return make_response(jsonify('Parquet export requires pyarrow, which is not installed.'), 400)
+    if not driver.table_exists(None, table_name):
+        return make_response(jsonify('Table ' + table_name + ' does not exist.'), 404)
+    try:
+        # the projection and filters become part of the query, so only the selected data leaves the database
+        query, params = driver.export_query(request_body)
+    except driver.RequestParseException as e:
+        return make_response(jsonify(e.msg), 400)
+
+    def produce():
+        if export_format == 'csv':
+            stream = driver.copy_csv(query, params, current_user)
+        elif export_format == 'parquet':
+            stream = driver.stream_query(query, params, current_user, parquet_row_group_size)
+        else:
+            stream = driver.stream_query(query, params, current_user)
+        if isinstance(stream, str):
+            return make_response(jsonify(stream), 400)
+        if stream is None:
+            return make_response(jsonify(driver.connection_error_msg), 500)
+        if export_format == 'csv':
+            return stream
+        description, chunks = stream
+        if export_format == 'parquet':
+            return parquet_chunks(description, chunks)
+        return ndjson_chunks([column.name for column in description], chunks)
+
+    key = ('export', export_format, repr(query), params)
+    return cached_response(table_name, key, export_types[export_format], produce)
 
 
 @main_bp.route("/delete", methods=["GET"])
@@ -490,11 +693,20 @@ def delete_row():
 def update_table():
     """
     Update the contents of the intake table.
+    Usage:
+        POST /update with {"row": <row_num>, <column>: <value>, ...} to update one row
+        POST /update with [{"row": <row_num>, "columns": {<column>: <value>, ...}}, ...] to update many rows in one
+            transaction
     Returns ({}): result of updating the contents of the table.
     """
     update_columns = {}
     row = None
     request_param = get_post_param(request)
+    if isinstance(request_param, Response):
+        return request_param
+
+    if isinstance(request_param, list):
+        return update_rows(request_param)
 
     for key in request_param:
         if key == 'row':
@@ -527,6 +739,38 @@ def update_table():
         return make_response(jsonify(result), 200)
 
 
+def update_rows(patches):
+    """
+    Updates many rows of the intake table in one transaction.
+    Args:
+        patches ([{}]): list of {'row': <row_num>, 'columns': {<column>: <value>, ...}}
+    Returns (Response): the result of each row
+    """
+    if len(patches) == 0:
+        result = {'message': 'No rows provided to update.'}
+        return make_response(jsonify(result), 400)
+    for patch in patches:
+        if not isinstance(patch, dict) or not isinstance(patch.get('columns'), dict) or len(patch['columns']) == 0:
+            result = {'message': 'Each update must hold a row number and the columns to update.'}
+            return make_response(jsonify(result), 400)
+        try:
+            patch['row'] = int(patch.get('row'))
+        except (TypeError, ValueError):
+            result = {'message': 'Row must be a number.'}
+            return make_response(jsonify(result), 400)
+
+    # only update intake table now
+    success, update_info = driver.update_rows('intake', patches, current_user)
+    if not isinstance(update_info, dict):
+        result = {'message': update_info}
+        return make_response(jsonify(result), 400)
+    result = {
+        'message': 'Updated successfully' if success else 'Some/all updates failed',
+        'rows': update_info
+    }
+    return make_response(jsonify(result), 200 if success else 400)
+
+
 @main_bp.route('/restore', methods=['PUT'])
 @login_required
 def restore_record():
@@ -547,6 +791,54 @@ def restore_record():
                                                             'Contact your admin to have it restored'), 404)
 
 
+@main_bp.route('/metrics', methods=['GET'])
+def show_metrics():
+    """
+    Reports request and phase timings per endpoint, and connection pool and cache counters, in the Prometheus text
+    format. Open to scrapers without a login; the timings are those of this server process only.
+    Returns (Response): the metrics
+    """
+    stats = driver.pool_stats()
+    users = user_cache.stats()
+    extra = [
+        ('kanabi_pool_connections_in_use', 'gauge', 'Pooled database connections checked out.',
+         stats['total']['in_use']),
+        ('kanabi_pool_connections_idle', 'gauge', 'Pooled database connections idle.', stats['total']['idle']),
+        ('kanabi_pool_waits_total', 'counter', 'Checkouts that waited for a connection.', stats['total']['waits']),
+        ('kanabi_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection.',
+         stats['total']['wait_time']),
+        ('kanabi_pool_checks_total', 'counter', 'Idle connections checked with a round trip at checkout.',
+         stats['total']['checks']),
+        ('kanabi_pool_retries_total', 'counter', 'Connections replaced or reopened after failing.',
+         stats['total']['retries']),
+        ('kanabi_statement_cache_hits_total', 'counter', 'Queries run through an existing prepared statement.',
+         stats['statements']['hits']),
+        ('kanabi_statement_cache_misses_total', 'counter', 'Queries that prepared a new statement.',
+         stats['statements']['misses']),
+        ('kanabi_catalog_loads_total', 'counter', 'Times the schema catalog was read.', stats['catalog']['loads']),
+        ('kanabi_result_cache_hits_total', 'counter', 'Responses served from the result cache.',
+         stats['results']['hits']),
+        ('kanabi_result_cache_misses_total', 'counter', 'Responses not found in the result cache.',
+         stats['results']['misses']),
+        ('kanabi_result_cache_bytes', 'gauge', 'Size of the cached responses.', stats['results']['bytes']),
+        ('kanabi_user_cache_hits_total', 'counter', 'Users of requests loaded from the user cache.', users['hits']),
+        ('kanabi_user_cache_misses_total', 'counter', 'Users of requests loaded from the auth database.',
+         users['misses']),
+    ]
+    return Response(metrics.render(extra), 200, mimetype='text/plain; version=0.0.4')
+
+
+@main_bp.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness probe: whether this server process can reach the database. Open without a login.
+    Returns (Response): 200 once connected, 503 while the database can't be reached
+    """
+    if driver.db_ready():
+        return make_response(jsonify({'database': 'connected'}), 200)
+    return make_response(jsonify({'database': 'unavailable'}), 503)
+
+
 @main_bp.route('/')
 def landing_page():
     readme = open("./README.md", "r")
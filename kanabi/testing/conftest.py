@@ -0,0 +1,35 @@
+"""
+Fixtures of the tests that need a scratch database set up with db-create.sql, named by a database.ini in
+KANABI_DB_CONFIG (as for the benchmark suite with --config); its data tables are emptied before each test. Without
+one, those tests are skipped.
+"""
+import os
+
+import psycopg2
+import pytest
+
+from kanabi.benchmark.postgres import reset_tables
+from kanabi.db.dbConfig import config_env, pgSqlConfig
+
+
+@pytest.fixture
+def params():
+    if not os.environ.get(config_env):
+        pytest.skip(f'{config_env} does not name a scratch database')
+    params = pgSqlConfig()
+    try:
+        reset_tables(params)
+    except psycopg2.OperationalError as err:
+        pytest.skip(f'scratch database unavailable: {err}')
+    return params
+
+
+@pytest.fixture
+def cur(params):
+    conn = psycopg2.connect(**params)
+    try:
+        with conn.cursor() as cur:
+            yield cur
+    finally:
+        conn.rollback()
+        conn.close()
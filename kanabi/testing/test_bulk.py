@@ -0,0 +1,60 @@
+"""
+Tests of loading spreadsheet rows through the COPY path of kanabi.db.bulk. They need a scratch database (see
+conftest.py) and are skipped without one.
+Run from the repository root with:
+    KANABI_DB_CONFIG=<database.ini> python -m pytest kanabi/testing
+"""
+import random
+from types import SimpleNamespace
+
+import pandas as pd
+
+from kanabi.benchmark.sheets import intake_row, violations_row
+from kanabi.db import bulk
+from kanabi.validation.intake_conversion import convert_intake_row
+
+
+def rows_of(make_row, count):
+    rng = random.Random(0)
+    return [make_row(n, rng) for n in range(1, count + 1)]
+
+
+def test_rows_without_row_numbers_are_numbered(cur):
+    # violations sheets have no row number column
+    rows = rows_of(violations_row, 5)
+    columns = bulk.stage_rows(cur, 'violations', rows)
+    assert bulk.merge_staged(cur, 'violations', columns) == ({}, {})
+    cur.execute('SELECT "row", dba FROM violations ORDER BY "row"')
+    loaded = cur.fetchall()
+    assert [dba for _, dba in loaded] == [row[0] for row in rows]
+    assert len({number for number, _ in loaded}) == 5
+
+
+def test_numbered_rows_keep_their_numbers(cur):
+    # typed as process_file stores them
+    rows = [convert_intake_row(row) for row in rows_of(intake_row, 6)]
+    for row in rows[::2]:
+        row[0] = None
+    rows[1][0] = 2
+    rows[3][0] = 3
+    rows[5][0] = 3
+    columns = bulk.stage_rows(cur, 'intake', rows)
+    taken, failed = bulk.merge_staged(cur, 'intake', columns)
+    assert taken == {5: 3} and failed == {}
+    cur.execute('SELECT "row", mrl FROM intake ORDER BY mrl')
+    numbers = dict((mrl, number) for number, mrl in cur.fetchall())
+    assert numbers['MRL2'] == 2 and numbers['MRL4'] == 3
+    # the rows without a number were given ones other than the batch's own
+    assert len(set(numbers.values())) == 5 and not {numbers['MRL1'], numbers['MRL3'], numbers['MRL5']} & {2, 3}
+
+
+def test_upload_takes_the_bulk_path(params, monkeypatch):
+    import kanabi.driver as driver
+
+    def insert_row_by_row(*args):
+        raise AssertionError('the bulk load fell back to inserting row by row')
+    monkeypatch.setattr(driver, 'write_info_rows', insert_row_by_row)
+    user = SimpleNamespace(is_authenticated=True, email=params['user'], password=params['password'])
+    df = pd.DataFrame(rows_of(violations_row, 20))
+    report = driver.write_info_data(df, 'violations', user)
+    assert report == {'insertions_attempted': 20, 'insertions_successful': 20, 'insertions_failed': []}
@@ -0,0 +1,42 @@
+"""
+Tests of the notifications on the kanabi_changes channel that tell every server's result cache which table was written
+to. They need a scratch database (see conftest.py) and are skipped without one.
+Run from the repository root with:
+    KANABI_DB_CONFIG=<database.ini> python -m pytest kanabi/testing
+"""
+import select
+
+import psycopg2
+import pytest
+
+from kanabi.db.resultcache import changes_channel
+
+
+@pytest.fixture
+def listener(params):
+    conn = psycopg2.connect(**params)
+    conn.autocommit = True
+    try:
+        conn.cursor().execute(f'LISTEN {changes_channel}')
+        yield conn
+    finally:
+        conn.close()
+
+
+def changed_tables(conn):
+    select.select([conn], [], [], 1)
+    conn.poll()
+    tables = [notify.payload for notify in conn.notifies]
+    conn.notifies.clear()
+    return tables
+
+
+@pytest.mark.parametrize('table, write', [
+    ('metadata', "INSERT INTO metadata(filename, title) VALUES ('sample.xlsx', 'Sample')"),
+    ('violations', "INSERT INTO violations(dba) VALUES ('Green Leaf')"),
+])
+def test_writes_are_notified_on_commit(cur, listener, table, write):
+    cur.execute(write)
+    assert changed_tables(listener) == []
+    cur.connection.commit()
+    assert changed_tables(listener) == [table]
@@ -0,0 +1,100 @@
+"""
+Tests of the notification Listener, run against a stand-in for psycopg2.connect.
+Run from the repository root with:
+    python -m pytest kanabi/testing
+"""
+import threading
+import time
+from collections import namedtuple
+
+import psycopg2
+import pytest
+
+from kanabi.db import notify
+from kanabi.db.notify import Listener
+
+Notify = namedtuple('Notify', ['channel', 'payload'])
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query):
+        self.connection.executed.append(query)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.executed = []
+        self.notifies = []
+
+    def set_isolation_level(self, level):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def poll(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connect(monkeypatch):
+    """
+    Replaces psycopg2.connect with one that waits for allow to be set, then fails unless connections are made to work.
+    """
+    state = {'allow': threading.Event(), 'works': False, 'attempts': 0, 'connections': []}
+
+    def fake_connect(**params):
+        state['attempts'] += 1
+        state['allow'].wait(5)
+        if not state['works']:
+            raise psycopg2.OperationalError('could not connect to server')
+        state['connections'].append(FakeConnection())
+        return state['connections'][-1]
+    monkeypatch.setattr(notify.psycopg2, 'connect', fake_connect)
+    return state
+
+
+def test_poll_without_connect_does_not_wait_for_the_connection(connect):
+    listener = Listener(params={}, retry_interval=60)
+    payloads = []
+    listener.subscribe('kanabi_users', payloads.append)
+
+    started = time.monotonic()
+    assert not listener.poll(connect=False)
+    assert not listener.poll(connect=False)
+    assert time.monotonic() - started < 1
+    # one attempt is made, in the background
+    reconnecting = listener._reconnecting
+    assert reconnecting.is_alive() and reconnecting is not threading.current_thread()
+
+    connect['works'] = True
+    connect['allow'].set()
+    reconnecting.join(5)
+    assert connect['attempts'] == 1 and payloads == [None]
+    assert connect['connections'][0].executed == ['LISTEN kanabi_users']
+
+    connect['connections'][0].notifies.append(Notify('kanabi_users', '7'))
+    assert listener.poll(connect=False)
+    assert payloads == [None, '7']
+
+
+def test_failed_background_attempts_are_spaced_out(connect):
+    connect['allow'].set()
+    listener = Listener(params={}, retry_interval=60)
+    assert not listener.poll(connect=False)
+    listener._reconnecting.join(5)
+    assert not listener.poll(connect=False)
+    assert not listener._reconnecting.is_alive() and connect['attempts'] == 1
@@ -0,0 +1,255 @@
+"""
+Tests of the SQL that QueryParser builds from filter requests, and of the continuation tokens of paged requests.
+Run from the repository root with:
+    python -m pytest kanabi/testing
+"""
+import base64
+import json
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from psycopg2 import sql
+
+from kanabi.db.catalog import Schema
+from kanabi.models.IntakeRow import IntakeRow
+from kanabi.query_parser import QueryParser, RequestParseException, decode_token, encode_token
+from kanabi.validation.intake_conversion import intake_column_types
+
+intake_types = {col: intake_column_types.get(col, 'text') for col in IntakeRow.__slots__}
+schema = Schema(
+    tables=frozenset(['intake']),
+    columns={'intake': frozenset(IntakeRow.__slots__)},
+    column_names={'intake': tuple(IntakeRow.__slots__)},
+    column_types={'intake': intake_types}
+)
+
+
+def render(query):
+    """
+    Writes a composed query out as text. sql.Composable.as_string needs a connection, which these tests don't have.
+    Args:
+        query (sql.Composable): query built by QueryParser
+    Returns (str): the SQL, with %s placeholders
+    """
+    if isinstance(query, sql.Composed):
+        return ''.join(render(part) for part in query.seq)
+    if isinstance(query, sql.Identifier):
+        return '.'.join('"' + s.replace('"', '""') + '"' for s in query.strings)
+    if isinstance(query, sql.SQL):
+        return query.string
+    raise TypeError(f'Unexpected {type(query).__name__} in query')
+
+
+def build(request):
+    """
+    Returns ((str, tuple)): the rendered SQL and the parameters of a request
+    """
+    query, params = QueryParser(schema).build_query(request)
+    return render(query), params
+
+
+def where(condition):
+    """
+    Returns ((str, tuple)): the rendered WHERE condition and the parameters of a request on the intake table
+    """
+    query, params = build({'table': 'intake', 'columns': ['row'], 'where': condition})
+    prefix = 'SELECT "row" FROM "intake" WHERE '
+    assert query.startswith(prefix)
+    return query[len(prefix):], params
+
+
+def token(order, after):
+    return base64.urlsafe_b64encode(json.dumps({'order': order, 'after': after}).encode()).decode()
+
+
+def test_select_columns():
+    assert build({'table': 'intake'}) == ('SELECT * FROM "intake"', ())
+    assert build({'table': 'intake', 'columns': ['DBA', 'mrl']}) == ('SELECT "dba", "mrl" FROM "intake"', ())
+
+
+@pytest.mark.parametrize('op', ['<', '<=', '>', '>=', '='])
+def test_comparison(op):
+    assert where({'column': 'mrl', 'op': op, 'operand': 'MRL48'}) == (f'("mrl" {op} %s)', ('MRL48',))
+
+
+def test_operands_take_the_column_type():
+    assert where({'column': 'submission_date', 'op': '>=', 'operand': '06/01/20'}) == \
+        ('("submission_date" >= %s)', (date(2020, 6, 1),))
+    assert where({'column': 'cash_amount', 'op': '<', 'operand': '$1,000.50'}) == \
+        ('("cash_amount" < %s)', (Decimal('1000.50'),))
+    assert where({'column': 'facility_zip', 'op': '=', 'operand': '97201'}) == ('("facility_zip" = %s)', (97201,))
+    # text columns are compared with the operand's text
+    assert where({'column': 'row', 'op': '<', 'operand': 5}) == ('("row" < %s)', ('5',))
+
+
+def test_operand_of_the_wrong_type():
+    with pytest.raises(RequestParseException):
+        build({'table': 'intake', 'where': {'column': 'submission_date', 'op': '=', 'operand': 'someday'}})
+
+
+def test_and():
+    assert where({'and': [{'column': 'mrl', 'op': '=', 'operand': 'MRL48'},
+                          {'column': 'row', 'op': '<', 'operand': 5}]}) == \
+        ('(("mrl" = %s) AND ("row" < %s))', ('MRL48', '5'))
+
+
+def test_nested_blocks_of_the_same_kind_are_flattened():
+    condition = {'and': [
+        {'column': 'dba', 'op': '=', 'operand': 'a'},
+        {'and': [{'column': 'mrl', 'op': '=', 'operand': 'b'},
+                 {'and': [{'column': 'row', 'op': '>', 'operand': 1}]}]},
+        {'column': 'entity', 'op': '=', 'operand': 'c'},
+    ]}
+    assert where(condition) == ('(("dba" = %s) AND ("mrl" = %s) AND ("row" > %s) AND ("entity" = %s))',
+                                ('a', 'b', '1', 'c'))
+
+
+def test_long_chains_are_flattened():
+    condition = {'column': 'row', 'op': '=', 'operand': 0}
+    for i in range(1, 2000):
+        condition = {'and': [condition, {'column': 'row', 'op': '>', 'operand': i}]}
+    query, params = where(condition)
+    assert query.count('AND') == 1999 and query.count('(') == 2001
+    assert params == tuple(str(i) for i in range(2000))
+
+
+def test_nested_blocks_of_the_other_kind_are_kept():
+    condition = {'or': [{'column': 'dba', 'op': '<', 'operand': 'a'},
+                        {'and': [{'column': 'mrl', 'op': '<', 'operand': 'b'},
+                                 {'column': 'row', 'op': '>', 'operand': 1}]}]}
+    assert where(condition) == ('(("dba" < %s) OR (("mrl" < %s) AND ("row" > %s)))', ('a', 'b', '1'))
+
+
+def test_or_of_equalities_is_merged_into_any():
+    condition = {'or': [
+        {'column': 'mrl', 'op': '=', 'operand': 'MRL1'},
+        {'column': 'dba', 'op': 'like', 'operand': 'A%'},
+        {'column': 'MRL', 'op': 'in', 'operand': ['MRL2', 'MRL "3"']},
+        {'or': [{'column': 'mrl', 'op': '=', 'operand': 'MRL4'}]},
+    ]}
+    # the merged test takes the place of the column's first one
+    assert where(condition) == ('(("mrl" = ANY(%s)) OR ("dba" LIKE %s))',
+                                ('{"MRL1","MRL2","MRL \\"3\\"","MRL4"}', 'A%'))
+
+
+def test_or_of_one_equality_per_column():
+    condition = {'or': [{'column': 'mrl', 'op': '=', 'operand': 'MRL1'},
+                        {'column': 'dba', 'op': 'in', 'operand': ['x']}]}
+    assert where(condition) == ('(("mrl" = %s) OR ("dba" = %s))', ('MRL1', 'x'))
+
+
+def test_merged_operands_take_the_column_type():
+    condition = {'or': [{'column': 'submission_date', 'op': '=', 'operand': '06/01/20'},
+                        {'column': 'submission_date', 'op': '=', 'operand': '2020-06-02'}]}
+    assert where(condition) == ('("submission_date" = ANY(%s))', ('{"2020-06-01","2020-06-02"}',))
+
+
+def test_in():
+    assert where({'column': 'mrl', 'op': 'in', 'operand': ['MRL1', 'MRL2']}) == \
+        ('("mrl" = ANY(%s))', ('{"MRL1","MRL2"}',))
+    assert where({'column': 'mrl', 'op': 'in', 'operand': ['MRL1']}) == ('("mrl" = %s)', ('MRL1',))
+    with pytest.raises(RequestParseException):
+        build({'table': 'intake', 'where': {'column': 'mrl', 'op': 'in', 'operand': []}})
+
+
+def test_between():
+    assert where({'column': 'receipt_num', 'op': 'between', 'operand': ['10', 20]}) == \
+        ('("receipt_num" BETWEEN %s AND %s)', (10, 20))
+    with pytest.raises(RequestParseException):
+        build({'table': 'intake', 'where': {'column': 'receipt_num', 'op': 'between', 'operand': [1]}})
+
+
+def test_like():
+    assert where({'column': 'dba', 'op': 'like', 'operand': 'Green%'}) == ('("dba" LIKE %s)', ('Green%',))
+    assert where({'column': 'dba', 'op': 'ilike', 'operand': '%leaf'}) == ('("dba" ILIKE %s)', ('%leaf',))
+
+
+def test_like_on_typed_columns_matches_their_text():
+    assert where({'column': 'submission_date', 'op': 'like', 'operand': '2020-06%'}) == \
+        ('("submission_date"::text LIKE %s)', ('2020-06%',))
+    assert where({'column': 'cash_amount', 'op': 'ilike', 'operand': '%.50'}) == \
+        ('("cash_amount"::text ILIKE %s)', ('%.50',))
+
+
+def test_is_null():
+    assert where({'column': 'email', 'op': 'is_null'}) == ('("email" IS NULL)', ())
+    assert where({'not': {'column': 'email', 'op': 'is_null'}}) == ('(NOT ("email" IS NULL))', ())
+
+
+@pytest.mark.parametrize('condition', [
+    {'column': 'mrl', 'op': 'regex', 'operand': 'x'},
+    {'column': 'nope', 'op': '=', 'operand': 'x'},
+    {'and': []},
+    {'and': [{'column': 'mrl', 'op': '=', 'operand': 'x'}], 'or': [{'column': 'mrl', 'op': '=', 'operand': 'x'}]},
+])
+def test_invalid_conditions(condition):
+    with pytest.raises(RequestParseException):
+        build({'table': 'intake', 'where': condition})
+
+
+def test_paged_request():
+    query, params = build({'table': 'intake', 'columns': ['dba'], 'order_by': [{'column': 'dba', 'direction': 'desc'}],
+                           'limit': 50})
+    assert query == 'SELECT "dba", "dba", "row" FROM "intake" ORDER BY "dba" DESC, "row" ASC LIMIT %s'
+    assert params == (51,)
+
+
+def test_after_values():
+    query, params = build({'table': 'intake', 'columns': ['dba'], 'order_by': ['submission_date'],
+                           'after': {'submission_date': '06/01/20'}})
+    assert query == 'SELECT "dba" FROM "intake" WHERE ((("submission_date" > %s OR "submission_date" IS NULL))) ' \
+                    'ORDER BY "submission_date" ASC, "row" ASC'
+    assert params == (date(2020, 6, 1),)
+
+
+def test_after_token():
+    keyset = [('submission_date', 'asc'), ('row', 'asc')]
+    after = encode_token(keyset, [date(2020, 6, 1), 17])
+    query, params = build({'table': 'intake', 'columns': ['dba'], 'order_by': ['submission_date'], 'limit': 10,
+                           'after': after})
+    assert query == 'SELECT "dba", "submission_date", "row" FROM "intake" ' \
+                    'WHERE ((("submission_date" > %s OR "submission_date" IS NULL)) ' \
+                    'OR ("submission_date" = %s AND ("row" > %s OR "row" IS NULL))) ' \
+                    'ORDER BY "submission_date" ASC, "row" ASC LIMIT %s'
+    assert params == (date(2020, 6, 1), date(2020, 6, 1), '17', 11)
+
+
+def test_after_null_in_ascending_order():
+    # NULLs sort last in ascending order: nothing sorts after one but the ties that follow it
+    keyset = [('submission_date', 'asc'), ('row', 'asc')]
+    query, params = build({'table': 'intake', 'order_by': ['submission_date'], 'limit': 10,
+                           'after': token([list(k) for k in keyset], [None, '17'])})
+    assert '((FALSE) OR ("submission_date" IS NULL AND ("row" > %s OR "row" IS NULL)))' in query
+    assert params == ('17', 11)
+
+
+def test_after_null_in_descending_order():
+    # NULLs sort first in descending order: every non-NULL value sorts after one
+    keyset = [('email', 'desc'), ('row', 'desc')]
+    query, params = build({'table': 'intake', 'order_by': [{'column': 'email', 'direction': 'desc'},
+                                                           {'column': 'row', 'direction': 'desc'}],
+                           'limit': 10, 'after': encode_token(keyset, [None, 17])})
+    assert '(("email" IS NOT NULL) OR ("email" IS NULL AND "row" < %s))' in query
+    assert params == ('17', 11)
+
+
+def test_token_round_trip():
+    keyset = [('email', 'desc'), ('row', 'asc')]
+    assert decode_token(encode_token(keyset, [None, 17]), keyset) == [None, '17']
+
+
+@pytest.mark.parametrize('after', [
+    'not a token',
+    token([['email', 'asc'], ['row', 'asc']], [None, '1']),
+    token([['submission_date', 'asc'], ['row', 'asc']], ['06/01/20']),
+    base64.urlsafe_b64encode(b'[1, 2]').decode(),
+])
+def test_invalid_tokens(after):
+    with pytest.raises(RequestParseException):
+        build({'table': 'intake', 'order_by': ['submission_date'], 'limit': 10, 'after': after})
+
+
+def test_after_values_must_lead_the_order():
+    with pytest.raises(RequestParseException):
+        build({'table': 'intake', 'order_by': ['submission_date'], 'after': {'row': 5}})
@@ -0,0 +1,74 @@
+"""
+Tests of restoring deleted rows from the archive with restore_rows. They need a scratch database (see conftest.py) and
+are skipped without one.
+Run from the repository root with:
+    KANABI_DB_CONFIG=<database.ini> python -m pytest kanabi/testing
+"""
+import random
+from types import SimpleNamespace
+
+from kanabi.benchmark.sheets import violations_row
+from kanabi.db import bulk
+
+
+def load_violations(cur, count):
+    rng = random.Random(0)
+    columns = bulk.stage_rows(cur, 'violations', [violations_row(n, rng) for n in range(1, count + 1)])
+    bulk.merge_staged(cur, 'violations', columns)
+    cur.execute('SELECT "row" FROM violations ORDER BY "row"')
+    return [row for row, in cur.fetchall()]
+
+
+def archive_rows(cur, rows):
+    """
+    Deletes rows of the violations table.
+    Returns ([int]): the archive rows that hold them, in the order given
+    """
+    archived = []
+    for row in rows:
+        cur.execute('DELETE FROM violations WHERE "row" = %s', (row,))
+        cur.execute("SELECT max(archive_row) FROM txn_history WHERE tabname = 'violations'")
+        archived.append(cur.fetchone()[0])
+    return archived
+
+
+def test_rows_are_restored_unless_they_conflict(cur):
+    rows = load_violations(cur, 4)
+    archived = archive_rows(cur, rows[:3])
+    # the second row's number is taken again before it is restored
+    cur.execute('INSERT INTO violations ("row", dba) VALUES (%s, %s)', (rows[1], 'taken'))
+    missing = max(archived) + 100
+    cur.execute('SELECT row_num, status FROM restore_rows(%s)', ([archived[2], missing, archived[1], archived[0]],))
+    assert cur.fetchall() == [(archived[2], 'restored'), (missing, 'missing'), (archived[1], 'conflict'),
+                              (archived[0], 'restored')]
+    cur.execute('SELECT "row", dba FROM violations ORDER BY "row"')
+    restored = dict(cur.fetchall())
+    assert sorted(restored) == rows and restored[rows[1]] == 'taken'
+
+
+def test_one_of_two_archive_rows_with_the_same_number_is_restored(cur):
+    rows = load_violations(cur, 1)
+    cur.execute('SELECT dba FROM violations')
+    original = cur.fetchall()
+    first, = archive_rows(cur, rows)
+    cur.execute('INSERT INTO violations ("row", dba) VALUES (%s, %s)', (rows[0], 'again'))
+    second, = archive_rows(cur, rows)
+    cur.execute('SELECT row_num, status FROM restore_rows(%s)', ([second, first],))
+    assert cur.fetchall() == [(second, 'conflict'), (first, 'restored')]
+    cur.execute('SELECT dba FROM violations')
+    assert cur.fetchall() == original
+
+
+def test_restore_row_reports_each_row(params, cur):
+    import kanabi.driver as driver
+    rows = load_violations(cur, 2)
+    archived = archive_rows(cur, rows)
+    cur.execute('INSERT INTO violations ("row", dba) VALUES (%s, %s)', (rows[0], 'taken'))
+    cur.connection.commit()
+    user = SimpleNamespace(is_authenticated=True, email=params['user'], password=params['password'])
+    success, info = driver.restore_row([str(n) for n in archived], user)
+    assert not success
+    assert info == {f'Row {archived[0]}': driver.restore_messages['conflict'],
+                    f'Row {archived[1]}': driver.restore_messages['restored']}
+    cur.execute('SELECT count(*) FROM violations')
+    assert cur.fetchone() == (2,)
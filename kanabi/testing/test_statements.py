@@ -0,0 +1,85 @@
+"""
+Tests of the prepared statements StatementCache keeps for each connection, run against a stand-in connection that
+records the SQL it is sent.
+Run from the repository root with:
+    python -m pytest kanabi/testing
+"""
+import psycopg2.extensions
+
+from kanabi.db.statements import StatementCache, numbered_placeholders, statement_name
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.executed = []
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class RecordingCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, params=None):
+        self.connection.executed.append((query, params))
+
+
+def test_numbered_placeholders():
+    assert numbered_placeholders('SELECT * FROM "intake" WHERE ("row" < %s)') == \
+        ('SELECT * FROM "intake" WHERE ("row" < $1)', 1)
+    assert numbered_placeholders('SELECT 1') == ('SELECT 1', 0)
+
+
+def test_numbered_placeholders_keep_literal_percent_signs():
+    # psycopg2 writes a literal % as %%, which PREPARE must see as a single %
+    query = "SELECT * FROM \"intake\" WHERE (\"dba\" LIKE 'A%%') AND (\"row\" BETWEEN %s AND %s) AND (\"mrl\" = %s)"
+    assert numbered_placeholders(query) == \
+        ("SELECT * FROM \"intake\" WHERE (\"dba\" LIKE 'A%') AND (\"row\" BETWEEN $1 AND $2) AND (\"mrl\" = $3)", 3)
+    assert numbered_placeholders('SELECT 100 %% 7, %s, %%s') == ('SELECT 100 % 7, $1, %s', 1)
+
+
+def test_statement_is_prepared_once_and_executed_with_params():
+    cache = StatementCache()
+    conn = RecordingConnection()
+    cur = RecordingCursor(conn)
+    query = "SELECT * FROM \"intake\" WHERE (\"dba\" LIKE '%%x') AND (\"row\" > %s) LIMIT %s"
+    name = statement_name(query)
+
+    cache.execute(cur, query, ('5', 11))
+    cache.execute(cur, query, ('6', 11))
+    assert conn.executed == [
+        (f"PREPARE {name} AS SELECT * FROM \"intake\" WHERE (\"dba\" LIKE '%x') AND (\"row\" > $1) LIMIT $2", None),
+        (f'EXECUTE {name}(%s, %s)', ('5', 11)),
+        (f'EXECUTE {name}(%s, %s)', ('6', 11)),
+    ]
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+
+def test_statement_without_params():
+    cache = StatementCache()
+    conn = RecordingConnection()
+    cache.execute(RecordingCursor(conn), 'SELECT * FROM "intake"')
+    name = statement_name('SELECT * FROM "intake"')
+    assert conn.executed == [(f'PREPARE {name} AS SELECT * FROM "intake"', None), (f'EXECUTE {name}', None)]
+
+
+def test_statements_are_kept_per_connection():
+    cache = StatementCache()
+    first, second = RecordingConnection(), RecordingConnection()
+    cache.execute(RecordingCursor(first), 'SELECT %s', (1,))
+    cache.execute(RecordingCursor(second), 'SELECT %s', (1,))
+    assert [q for q, _ in first.executed] == [q for q, _ in second.executed]
+    assert cache.stats() == {'hits': 0, 'misses': 2}
+
+
+def test_least_recently_used_statements_are_deallocated():
+    cache = StatementCache(max_size=2)
+    conn = RecordingConnection()
+    cur = RecordingCursor(conn)
+    for query in ['SELECT 1', 'SELECT 2', 'SELECT 1', 'SELECT 3']:
+        cache.execute(cur, query)
+    assert (f"DEALLOCATE {statement_name('SELECT 2')}", None) in conn.executed
+    conn.executed.clear()
+    cache.execute(cur, 'SELECT 1')
+    assert conn.executed == [(f"EXECUTE {statement_name('SELECT 1')}", None)]
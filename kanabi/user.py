@@ -1,5 +1,15 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
 from flask_login import UserMixin
 from .configure import db
+from .db.notify import notifications
+
+# channel notified with a user's id when their account changes, so that every server process drops it from its cache
+users_channel = 'kanabi_users'
+default_user_cache_ttl = 60
+default_user_cache_size = 1000
 
 
 # To access these properties for the current user, you can use current_user.PROPERTY
@@ -13,3 +23,123 @@ class User(UserMixin, db.Model):
     is_admin = db.Column(db.Boolean(), default=False)
     is_editor = db.Column(db.Boolean(), default=False)
 
+    def snapshot(self):
+        """
+        Returns (UserSnapshot): a read-only copy of the user, with their roles
+        """
+        roles = frozenset(role for role, has_role in [('editor', self.is_editor), ('admin', self.is_admin)]
+                          if has_role)
+        return UserSnapshot(self.id, self.email, self.password, self.name, bool(self.is_admin), bool(self.is_editor),
+                            roles)
+
+
+class UserSnapshot(namedtuple('UserSnapshot', ['id', 'email', 'password', 'name', 'is_admin', 'is_editor', 'roles']),
+                   UserMixin):
+    """
+    A read-only copy of a User, as loaded for current_user by the user cache. It is detached from the auth database
+    session, so it can be shared between requests and threads.
+        roles (frozenset): the flask-principal roles of the user, 'editor' and 'admin'
+    """
+    __slots__ = ()
+
+
+class UserCache:
+    """
+    Keeps snapshots of the users of recent requests, keyed by user id, so that loading the user and their roles for a
+    request doesn't query the auth database.
+    A snapshot is served for ttl seconds, and the least recently used are dropped beyond max_size. A user's snapshot
+    is dropped as soon as their account changes, whether in this process (see invalidate) or in another one (through
+    notifications on users_channel).
+    """
+
+    def __init__(self, ttl=None, max_size=None, listener=None):
+        """
+        Args:
+            ttl (int): seconds a snapshot is served for; 0 disables the cache. The app's USER_CACHE_TTL if not given
+            max_size (int): number of users kept; the app's USER_CACHE_SIZE if not given
+            listener (Listener): source of user change notifications; the shared one if not given
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.listener = listener or notifications
+        self.listener.subscribe(users_channel, self._changed)
+        self._entries = OrderedDict()  # user id -> (UserSnapshot, expiry time), least recently used first
+        self._generation = 0  # number of invalidations
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        """
+        Reads the cache settings of the app.
+        Args:
+            app (Flask): the app
+        Returns: None
+        """
+        if self.ttl is None:
+            self.ttl = app.config.get('USER_CACHE_TTL', default_user_cache_ttl)
+        if self.max_size is None:
+            self.max_size = app.config.get('USER_CACHE_SIZE', default_user_cache_size)
+
+    def _changed(self, payload):
+        try:
+            self.invalidate(None if payload is None else int(payload))
+        except ValueError:
+            self.invalidate()
+
+    def get(self, user_id):
+        """
+        Looks a user up, in the cache or else in the auth database.
+        Args:
+            user_id (int or str): user id
+        Returns (UserSnapshot): the user, or None if there is no such user
+        """
+        user_id = int(user_id)
+        # hear of the changes made by other processes, without waiting for the listener to connect; while they can't
+        # be heard of, the ttl bounds how stale a snapshot gets
+        self.listener.poll(connect=False)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] >= time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+        snapshot = user.snapshot()
+        if self.ttl:
+            with self._lock:
+                # a snapshot read before an invalidation may be out of date already
+                if generation == self._generation:
+                    self._entries[user_id] = (snapshot, time.monotonic() + self.ttl)
+                    self._entries.move_to_end(user_id)
+                    while len(self._entries) > (self.max_size or default_user_cache_size):
+                        self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id=None):
+        """
+        Drops a user's snapshot, e.g. once their account was changed.
+        Args:
+            user_id (int): user id; every user if None
+        Returns: None
+        """
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(int(user_id), None)
+
+    def stats(self):
+        """
+        Returns (dict): number of users cached, and of lookups answered from the cache or not
+        """
+        with self._lock:
+            return {'users': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+user_cache = UserCache()
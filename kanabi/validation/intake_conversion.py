@@ -0,0 +1,185 @@
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+import numpy as np
+
+from kanabi.models.IntakeRow import ColNames
+
+# Intake columns that are not stored as text, and their SQL types
+intake_column_types = {
+    ColNames.SUBMISSION_DATE.name.lower(): 'date',
+    ColNames.FACILITY_ZIP.name.lower(): 'integer',
+    ColNames.RECEIPT_NUM.name.lower(): 'bigint',
+    ColNames.CASH_AMOUNT.name.lower(): 'numeric(12,2)',
+    ColNames.CHECK_AMOUNT.name.lower(): 'numeric(12,2)',
+    ColNames.CARD_AMOUNT.name.lower(): 'numeric(12,2)',
+}
+
+# Formats accepted for dates given as text: the spreadsheets' format, its four-digit year variant, and ISO
+date_formats = ['%m/%d/%y', '%m/%d/%Y', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S']
+
+# numeric(12,2) holds up to 10 digits before the decimal point
+max_money = Decimal(10) ** 10
+cents = Decimal('0.01')
+
+
+class ConversionException(ValueError):
+    pass
+
+
+def is_null(value):
+    """
+    Tells whether a value stands for a missing one: None, an empty string, or pandas' NaN and NaT.
+    Args:
+        value (any): the value
+    Returns (bool): True if the value should be stored as NULL
+    """
+    if value is None:
+        return True
+    s = str(value).strip()
+    return s == '' or (not isinstance(value, str) and s.lower() in ('nan', 'nat'))
+
+
+def to_date(value):
+    """
+    Converts a value to a date.
+    Args:
+        value (any): a date, datetime (including pandas' Timestamp) or text in one of date_formats
+    Returns (date): the date, or None for a missing value
+    Raises:
+        ConversionException: if the value is not a date
+    """
+    if is_null(value):
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        for date_format in date_formats:
+            try:
+                return datetime.strptime(value.strip(), date_format).date()
+            except ValueError:
+                continue
+    raise ConversionException(f'{value} is not a date')
+
+
+def to_integer(value):
+    """
+    Converts a value to an integer.
+    Args:
+        value (any): an int, a float without fractional part, or text of one
+    Returns (int): the integer, or None for a missing value
+    Raises:
+        ConversionException: if the value is not a whole number
+    """
+    if is_null(value):
+        return None
+    if isinstance(value, bool):
+        raise ConversionException(f'{value} is not a whole number')
+    if isinstance(value, int):
+        return value
+    try:
+        number = Decimal(str(value).strip())
+        if number.is_finite() and number == number.to_integral_value():
+            return int(number)
+    except InvalidOperation:
+        pass
+    raise ConversionException(f'{value} is not a whole number')
+
+
+def to_money(value):
+    """
+    Converts an amount of money to a Decimal rounded to cents.
+    Args:
+        value (any): a number, or text of one, possibly with a leading '$' and thousands separators
+    Returns (Decimal): the amount, or None for a missing value
+    Raises:
+        ConversionException: if the value is not an amount numeric(12,2) can hold
+    """
+    if is_null(value):
+        return None
+    if isinstance(value, bool):
+        raise ConversionException(f'{value} is not an amount')
+    s = str(value).strip()
+    if s.startswith('$'):
+        s = s[1:]
+    try:
+        amount = Decimal(s.replace(',', ''))
+    except InvalidOperation:
+        raise ConversionException(f'{value} is not an amount')
+    if not amount.is_finite() or abs(amount) >= max_money:
+        raise ConversionException(f'{value} is not an amount')
+    return amount.quantize(cents, rounding=ROUND_HALF_UP)
+
+
+converters = {
+    'date': to_date,
+    'integer': to_integer,
+    'bigint': to_integer,
+    'numeric(12,2)': to_money
+}
+
+
+def convert_value(column, value):
+    """
+    Converts a value to the type of the intake column it is stored in. Text columns keep their values.
+    Args:
+        column (str): intake column name
+        value (any): the value
+    Returns (any): the typed value, None for a missing one
+    Raises:
+        ConversionException: if the value can't be stored in the column
+    """
+    sql_type = intake_column_types.get(column)
+    if sql_type is None:
+        return value
+    return converters[sql_type](value)
+
+
+def convert_intake_row(row):
+    """
+    Converts the typed values of a row in intake table order, as built by IntakeRow.value_array.
+    Args:
+        row ([]): row values
+    Returns ([]): a copy of the row with typed values
+    Raises:
+        ConversionException: if a value can't be stored in its column
+    """
+    row = list(row)
+    for name in intake_column_types:
+        i = ColNames[name.upper()].value
+        if i < len(row):
+            row[i] = convert_value(name, row[i])
+    return row
+
+
+def convert_intake_frame(df):
+    """
+    Converts the typed columns of validated intake rows, with columns in intake table order. Values that can't be
+    converted become None; validate_intake has already recorded their columns in the validation errors of the row.
+    Args:
+        df (pd.DataFrame): intake rows
+    Returns (pd.DataFrame): the frame, with the typed columns holding date, int and Decimal objects
+    """
+    for name in intake_column_types:
+        i = ColNames[name.upper()].value
+        if i >= df.shape[1]:
+            continue
+        converter = converters[intake_column_types[name]]
+        converted = {}
+
+        def convert(x):
+            key = (type(x), x)
+            if key not in converted:
+                try:
+                    converted[key] = converter(x)
+                except (ConversionException, TypeError):
+                    converted[key] = None
+            return converted[key]
+
+        # keep an object column, so that pandas doesn't turn the values back into floats or timestamps
+        values = np.empty(len(df), dtype=object)
+        values[:] = [convert(x) for x in df.iloc[:, i]]
+        df[df.columns[i]] = values
+    return df
@@ -1,11 +1,13 @@
-from datetime import datetime
+import math
+from datetime import date, datetime
+from functools import lru_cache, partial
 
 import pandas as pd
 import numpy as np
 import re as re
 import json
 
-from kanabi.models.IntakeRow import ColNames
+from kanabi.models.IntakeRow import ColNames, intake_headers
 
 # addressRegex = r'^(\d+)\s([a-zA-Z]{1,2})\s([a-zA-Z0-9\-\.]+\s)+([a-zA-Z]+)(\.?)'
 # addressWithFacilityRegex = r'^(\d+)\s([a-zA-Z]{1,2})\s(([a-zA-Z1-9]+\s)+)([a-zA-Z]+)(\.?)(\,?)\s(#\d+)'
@@ -38,6 +40,27 @@ valid_endorsements = ["CT", "ED", "EX", "TO"]
 license_types = ['MD', 'MR', 'MC', 'MW', 'MP', 'MU']
 seen_mrls = {}
 
+# Lookup sets and precompiled patterns used by the column-wise checks in validate_intake
+valid_neighborhoods_set = frozenset(validNeighborhoods)
+valid_compliance_regions_set = frozenset(valid_compliance_regions)
+_endorsement = '|'.join(re.escape(e) for e in valid_endorsements)
+_license = '(?:DRE-)?(?:' + '|'.join(re.escape(lic) for lic in license_types) + ')'
+email_pattern = re.compile(emailRegex)
+# a comma-separated list of endorsement types, and the same list repeating any of them. Both are used with match:
+# pandas warns about str.contains patterns with a capture group, which the back reference needs.
+endorsement_list_pattern = re.compile(rf'(?:{_endorsement})(?:,(?:{_endorsement}))*\Z')
+endorsement_repeat_pattern = re.compile(rf'(?:.*,)?({_endorsement}),(?:.*,)?\1(?:,|\Z)')
+license_list_pattern = re.compile(rf'{_license}(?:,{_license})*\Z')
+# an ASCII string whose part before the first '-' is 'MRL' (in any case) and a number, as validate_mrl requires
+mrl_pattern = re.compile(r'[Mm][Rr][Ll][0-9]+(?:-|\Z)')
+# ASCII strings that int() accepts as a value in [0, 100000), and as a value >= 0
+_int_space = r'[ \t\n\r\x0b\x0c]*'
+zip_pattern = re.compile(rf'{_int_space}(?:\+?0*[0-9]{{1,5}}|-0+){_int_space}\Z')
+non_negative_int_pattern = re.compile(rf'{_int_space}(?:\+?[0-9]+(?:_[0-9]+)*|-0+(?:_0+)*){_int_space}\Z')
+# strings the patterns above do not cover exactly; these are checked one value at a time instead
+non_ascii_pattern = re.compile(r'[^\x00-\x7f]')
+non_ascii_or_underscore_pattern = re.compile(r'[^\x00-\x7f]|_')
+
 intake_db_columns = {
     'Submission date': ('Submission date', 'submission_date'),
     'Entity': ('Entity', 'entity'),
@@ -120,6 +143,21 @@ def validate_receipt_num(receiptNo):
     return str(receiptNo).isdigit()
 
 
+def validate_zip(zip_code):
+    try:
+        return 0 <= int(zip_code) < 100000
+    except ValueError:
+        return False
+
+
+def validate_date(date, date_format):
+    try:
+        pd.to_datetime(date, format=date_format, errors="raise")
+        return True
+    except ValueError:
+        return False
+
+
 def validate_mrl(mrl):
     """
     Validate that this field matches "MRL<number>" pattern and is unique for this field.
@@ -172,118 +210,507 @@ def validate_monetary_amount(amt):
         return False
 
 
+def _str_mask(col):
+    """
+    Finds the string values of a column.
+    Args:
+        col (pd.Series): column to inspect
+    Returns (np.ndarray): boolean mask, True where the value is a str
+    """
+    if col.dtype != object:
+        return np.zeros(len(col), dtype=bool)
+    if pd.api.types.infer_dtype(col, skipna=True) == 'string':
+        return col.notna().values
+    return col.map(lambda x: isinstance(x, str)).values.astype(bool)
+
+
+def _as_text(col):
+    """
+    Converts every value of a column with str(), as the per-value validators do.
+    Args:
+        col (pd.Series): column to convert
+    Returns (pd.Series): column of str
+    """
+    if col.dtype == object:
+        is_str = _str_mask(col)
+        if is_str.all():
+            return col
+        text = col.copy()
+        text.values[~is_str] = col[~is_str].map(str).values
+        return text
+    if pd.api.types.is_integer_dtype(col) and not pd.api.types.is_bool_dtype(col):
+        return col.astype(str)
+    return col.map(str).astype(object)
+
+
+def _check_each(col, mask, check):
+    """
+    Runs a per-value validator on the values of a column selected by a mask.
+    Args:
+        col (pd.Series): column to check
+        mask (np.ndarray): boolean mask of the values to check
+        check (function): validator returning a bool for one value
+    Returns (np.ndarray): results for the selected values
+    """
+    if not mask.any():
+        return np.zeros(0, dtype=bool)
+    return np.array([bool(check(x)) for x in col[mask]], dtype=bool)
+
+
+def _type_ids(values):
+    """
+    Returns (np.ndarray): the id of the type of each value in an array
+    """
+    return np.fromiter(map(id, map(type, values)), dtype=np.int64, count=len(values))
+
+
+def _distinct(col):
+    """
+    Splits a column into its distinct values and, for each row, the position of its value among them, so that work
+    on the column can be done once per distinct value. Values of object columns are only alike if they have the same
+    type too, since 1, 1.0 and True are equal but don't print the same; nulls of one type count as one value.
+    Args:
+        col (pd.Series): column to split
+    Returns ((np.ndarray, pd.Series)): the position of each row's value, and the distinct values, with the column's
+        dtype; None if the column doesn't qualify
+    """
+    if len(col) == 0 or pd.api.types.is_bool_dtype(col):
+        return None
+    if pd.api.types.is_float_dtype(col) or pd.api.types.is_datetime64_dtype(col):
+        # compare floats and timestamps bit for bit, so that 0.0 and -0.0 (which print differently) stay apart
+        codes, uniques = pd.factorize(col.values.view(f'i{col.dtype.itemsize}'))
+        return codes, pd.Series(uniques.view(col.dtype))
+    if pd.api.types.is_integer_dtype(col):
+        codes, uniques = pd.factorize(col.values)
+        return codes, pd.Series(uniques, dtype=col.dtype)
+    if col.dtype != object:
+        return None
+    values = col.values
+    if pd.api.types.infer_dtype(col, skipna=True) == 'string':
+        # only the nulls need sorting by type
+        groups = col.isna().values
+        type_codes = np.zeros(len(col), dtype=np.intp)
+        type_codes[groups] = pd.factorize(_type_ids(values[groups]))[0] + 1
+    else:
+        type_codes = pd.factorize(_type_ids(values))[0]
+    codes = np.empty(len(col), dtype=np.intp)
+    distinct = []
+    for t in range(type_codes.max() + 1):
+        of_type = type_codes == t
+        group = values[of_type]
+        if isinstance(group[0], float):
+            group_codes = pd.factorize(group.astype(np.float64).view(np.int64))[0]
+        else:
+            try:
+                group_codes = pd.factorize(group)[0]
+            except TypeError:  # unhashable values
+                return None
+            # the nulls of the type, e.g. None or NaT
+            group_codes[group_codes < 0] = group_codes.max() + 1
+        first = np.unique(group_codes, return_index=True)[1]
+        codes[of_type] = group_codes + len(distinct)
+        distinct.extend(group[first])
+    ret = np.empty(len(distinct), dtype=object)
+    ret[:] = distinct
+    return codes, pd.Series(ret, dtype=object)
+
+
+def _per_distinct(col, check):
+    """
+    Runs a column check once per distinct value of the column rather than once per row. Intake columns repeat the
+    same few values (dates, regions, license types, amounts) over and over, so this saves most of the work.
+    Args:
+        col (pd.Series): column to check
+        check (function): column check returning a boolean mask for the values of a column
+    Returns (np.ndarray): boolean mask, True where the value is valid
+    """
+    distinct = _distinct(col)
+    if distinct is not None:
+        codes, values = distinct
+        return check(values)[codes]
+    return check(col)
+
+
+def _map_distinct(col, func):
+    """
+    Same as col.apply(func), but func is called once per distinct value of the column (see _distinct). The results
+    take the dtype that apply infers from them.
+    Args:
+        col (pd.Series): column to transform
+        func (function): transformation of one value
+    Returns (pd.Series): transformed column
+    """
+    distinct = _distinct(col)
+    if distinct is None:
+        return col.apply(func)
+    codes, values = distinct
+    return _spread(values.apply(func), codes, col)
+
+
+def _str_distinct(col, method):
+    """
+    Same as getattr(col.str, method)(), e.g. col.str.strip(), but the method runs once per distinct string.
+    Args:
+        col (pd.Series): column to transform
+        method (str): name of a method of the .str accessor that takes no arguments
+    Returns (pd.Series): transformed column
+    """
+    distinct = _distinct(col) if col.dtype == object else None
+    if distinct is None:
+        return getattr(col.str, method)()
+    codes, values = distinct
+    # the distinct values have the same types as the column, so the accessor accepts or refuses them alike
+    return _spread(getattr(values.str, method)(), codes, col)
+
+
+def _spread(results, codes, col):
+    """
+    Returns (pd.Series): the results of the distinct values of col, spread back over its rows
+    """
+    ret = pd.Series(results.values.take(codes), name=col.name)
+    ret.index = col.index
+    return ret
+
+
+def _format_date(x):
+    return x.strftime('%m/%d/%y') if isinstance(x, datetime) else x
+
+
+def _valid_dates(col, date_format):
+    valid = np.ones(len(col), dtype=bool)
+    is_str = _str_mask(col)
+    parsed = pd.to_datetime(col[is_str], format=date_format, errors='coerce')
+    str_valid = parsed.notna().values
+    # strings that failed to parse are re-checked one by one, since a few (e.g. 'NaT') parse as null without error
+    str_valid[~str_valid] = _check_each(col[is_str], ~str_valid, lambda x: validate_date(x, date_format))
+    valid[is_str] = str_valid
+    # dates read back from the typed submission_date column are valid by construction
+    is_date = ~is_str & col.map(lambda x: isinstance(x, date) and not isinstance(x, datetime)).values.astype(bool)
+    # dates read from spreadsheet cells; whether they pass depends on their type and the pandas version
+    other = ~is_str & ~is_date
+    valid[other] = _check_each(col, other, lambda x: validate_date(x, date_format))
+    return valid
+
+
+def _valid_zips(col):
+    if pd.api.types.is_integer_dtype(col) and not pd.api.types.is_bool_dtype(col):
+        return ((col >= 0) & (col < 100000)).values
+    if pd.api.types.is_float_dtype(col):
+        values = col.values
+        with np.errstate(invalid='ignore'):
+            truncated = np.trunc(values)
+            valid = np.isfinite(values) & (truncated >= 0) & (truncated < 100000)
+        infinite = np.isinf(values)
+        valid[infinite] = _check_each(col, infinite, validate_zip)
+        return valid
+    valid = np.zeros(len(col), dtype=bool)
+    is_str = _str_mask(col)
+    strs = col[is_str].astype(object)
+    irregular = strs.str.contains(non_ascii_or_underscore_pattern).values.astype(bool)
+    str_valid = strs.str.match(zip_pattern).values.astype(bool)
+    str_valid[irregular] = _check_each(strs, irregular, validate_zip)
+    valid[is_str] = str_valid
+    valid[~is_str] = _check_each(col, ~is_str, validate_zip)
+    return valid
+
+
+def _valid_mrls(col):
+    valid = np.zeros(len(col), dtype=bool)
+    is_str = _str_mask(col)
+    strs = col[is_str].astype(object)
+    str_valid = strs.str.match(mrl_pattern).values.astype(bool)
+    if seen_mrls:
+        m = strs.str.upper().str.split('-', n=1).str[0]
+        str_valid &= ~m.isin(list(seen_mrls)).values
+    # upper() and isdigit() treat some non-ASCII characters in ways the pattern doesn't model
+    irregular = strs.str.contains(non_ascii_pattern).values.astype(bool)
+    str_valid[irregular] = _check_each(strs, irregular, validate_mrl)
+    valid[is_str] = str_valid
+    other = ~is_str & col.notna().values
+    valid[other] = _check_each(col, other, validate_mrl)
+    return valid
+
+
+def _valid_emails(col):
+    valid = np.zeros(len(col), dtype=bool)
+    is_str = _str_mask(col)
+    valid[is_str] = col[is_str].astype(object).str.match(email_pattern).values.astype(bool)
+    return valid
+
+
+def _valid_phones(col):
+    if col.dtype != object:
+        return (_as_text(col).str.len() == 10).values
+    valid = np.zeros(len(col), dtype=bool)
+    is_str = _str_mask(col)
+    strs = col[is_str].astype(object)
+    irregular = strs.str.contains(non_ascii_pattern).values.astype(bool)
+    str_valid = (strs.str.count('[0-9]') == 10).values
+    str_valid[irregular] = _check_each(strs, irregular, validatePhoneNumber)
+    valid[is_str] = str_valid
+    other = ~is_str & col.notna().values
+    valid[other] = _check_each(col, other, validatePhoneNumber)
+    return valid
+
+
+def _valid_endorsements(col):
+    s = _as_text(col).str.upper().str.strip()
+    listed = s.str.match(endorsement_list_pattern) & ~s.str.match(endorsement_repeat_pattern)
+    return ((s.str.len() == 0) | (s == 'NAN') | listed).values.astype(bool)
+
+
+def _valid_license_types(col):
+    return _as_text(col).str.match(license_list_pattern).values.astype(bool)
+
+
+def _valid_receipt_nums(col):
+    return _as_text(col).str.isdigit().values.astype(bool)
+
+
+def _valid_amounts(col):
+    text = _as_text(col)
+    blank = ((text.str.len() == 0) | (text.str.upper() == 'NAN') | (text == 'None')).values
+    digits = text.str.replace(r'\A\$', '', regex=True).str.replace(',', '', regex=False) \
+        .str.replace('.', '', regex=False)
+    irregular = digits.str.contains(non_ascii_pattern).values.astype(bool) & ~blank
+    valid = blank | digits.str.match(non_negative_int_pattern).values.astype(bool)
+    valid[irregular] = _check_each(col, irregular, validate_monetary_amount)
+    return valid
+
+
 def validate_intake(df, is_db=0):
-    i = 0
+    """
+    Validates intake rows a column at a time: each check builds a boolean mask over the whole frame, and the failed
+    checks of each row are then collected from the masks.
+    Args:
+        df (pd.DataFrame): intake rows, with columns in intake table order
+        is_db (int): 1 if the rows came from the database rather than a spreadsheet
+    Returns ((bool, dict)): whether all rows are valid, and the failed columns of each invalid row
+    """
     msg = {}
-    df[ColNames.VALIDATION_ERRORS.name] = df.apply(lambda x: '', axis=1)
+    df[ColNames.VALIDATION_ERRORS.name] = ''
     df.rename(columns={'Unnamed: 0': 'row'}, inplace=True)
 
-    for row in df.itertuples(index=False):
-        errorString = []
+    def column(field):
+        return df.iloc[:, field.value]
 
-        # Submission Date: parseable into a datetime
-        try:
-            if is_db:
-                date_format = '%Y-%m-%d'
-            else:
-                date_format = '%m/%d/%y'
-            pd.to_datetime(row[ColNames.SUBMISSION_DATE.value], format=date_format, errors="raise")
-        except ValueError:
-            errorString.append(ColNames.SUBMISSION_DATE.name)
-
-        # Fields that shouldn't be null but aren't subject to other validation
-        non_nulls = [ColNames.ENTITY, ColNames.FACILITY_ADDRESS, ColNames.MAILING_ADDRESS,
-                     ColNames.PRIMARY_CONTACT_FIRST_NAME, ColNames.PRIMARY_CONTACT_LAST_NAME]
-        for field in non_nulls:
-            if row[field.value] == np.nan:
-                errorString.append(field.name)
+    if is_db:
+        date_format = '%Y-%m-%d'
+    else:
+        date_format = '%m/%d/%y'
 
+    # Fields that shouldn't be null but aren't subject to other validation (entity, addresses, contact name) are not
+    # checked: NaN never compares equal to itself, so the row-by-row check that preceded this never rejected them.
+    # Repeat location, app complete, fee schedule, check no./approval code and MRL num are not checked either.
+    checks = [
+        # Submission Date: parseable into a datetime
+        (ColNames.SUBMISSION_DATE,
+         _per_distinct(column(ColNames.SUBMISSION_DATE), lambda col: _valid_dates(col, date_format))),
         # Facility Zip: 5-digit number
-        try:
-            valid_zip = 0 <= int(row[ColNames.FACILITY_ZIP.value]) < 100000
-        except ValueError:
-            valid_zip = False
-        if not valid_zip:
-            errorString.append(ColNames.FACILITY_ZIP.name)
-
+        (ColNames.FACILITY_ZIP, _per_distinct(column(ColNames.FACILITY_ZIP), _valid_zips)),
         # MRL
-        if not validate_mrl(row[ColNames.MRL.value]):
-            errorString.append(ColNames.MRL.name)
-
+        (ColNames.MRL, _per_distinct(column(ColNames.MRL), _valid_mrls)),
         # Neighborhood Association: in approved list
-        if not row[ColNames.NEIGHBORHOOD_ASSOCIATION.value] in validNeighborhoods:
-            errorString.append(ColNames.NEIGHBORHOOD_ASSOCIATION.name)
-
+        (ColNames.NEIGHBORHOOD_ASSOCIATION,
+         column(ColNames.NEIGHBORHOOD_ASSOCIATION).isin(valid_neighborhoods_set).values),
         # Compliance Region
-        if not row[ColNames.COMPLIANCE_REGION.value] in valid_compliance_regions:
-            errorString.append(ColNames.COMPLIANCE_REGION.name)
-
+        (ColNames.COMPLIANCE_REGION, column(ColNames.COMPLIANCE_REGION).isin(valid_compliance_regions_set).values),
         # Email - matches regex
-        try:
-            if not re.match(emailRegex, row[ColNames.EMAIL.value]):
-                errorString.append(ColNames.EMAIL.name)
-        except:  # any error, honestly
-            errorString.append(ColNames.EMAIL.name)
-
+        (ColNames.EMAIL, _per_distinct(column(ColNames.EMAIL), _valid_emails)),
         # Phone: coerceable into a 10-digit number
-        if not validatePhoneNumber(row[ColNames.PHONE.value]):
-            errorString.append(ColNames.PHONE.name)
-
+        (ColNames.PHONE, _per_distinct(column(ColNames.PHONE), _valid_phones)),
         # Endorsement: combination from approved list
-        if not validateEndorsement(row[ColNames.ENDORSE_TYPE.value]):
-            errorString.append(ColNames.ENDORSE_TYPE.name)
-
+        (ColNames.ENDORSE_TYPE, _per_distinct(column(ColNames.ENDORSE_TYPE), _valid_endorsements)),
         # License Type: matches expected values
-        if not validate_license_type(row[ColNames.LICENSE_TYPE.value]):
-            errorString.append(ColNames.LICENSE_TYPE.name)
-
-        # Repeat location: not checked
-        # App complete: not checked
-        # Fee schedule: not checked
-        # Receipt num: numeric value with no repeats
-        if not validate_receipt_num(row[ColNames.RECEIPT_NUM.value]):
-            errorString.append(ColNames.RECEIPT_NUM.name)
-
-        # Cash amount: number, possibly preceded by '$'
-        if not validate_monetary_amount(row[ColNames.CASH_AMOUNT.value]):
-            errorString.append(ColNames.CASH_AMOUNT.name)
-
-        # Check amount: number, possibly preceded by '$'
-        if not validate_monetary_amount(row[ColNames.CHECK_AMOUNT.value]):
-            errorString.append(ColNames.CHECK_AMOUNT.name)
-
-        # Card amount: number, possibly preceded by '$'
-        if not validate_monetary_amount(row[ColNames.CARD_AMOUNT.value]):
-            errorString.append(ColNames.CARD_AMOUNT.name)
-
-        # Check No./Approval Code: no validation
-        # MRL num: not checked
-        if len(errorString) != 0:
-            error_cols = ','.join(str(x) for x in errorString)
-            df.at[i, ColNames.VALIDATION_ERRORS.name] = error_cols
-            msg[f'row {row[ColNames.ROW.value]}'] = {
+        (ColNames.LICENSE_TYPE, _per_distinct(column(ColNames.LICENSE_TYPE), _valid_license_types)),
+        # Receipt num: numeric value
+        (ColNames.RECEIPT_NUM, _per_distinct(column(ColNames.RECEIPT_NUM), _valid_receipt_nums)),
+        # Cash, check and card amounts: number, possibly preceded by '$'
+        (ColNames.CASH_AMOUNT, _per_distinct(column(ColNames.CASH_AMOUNT), _valid_amounts)),
+        (ColNames.CHECK_AMOUNT, _per_distinct(column(ColNames.CHECK_AMOUNT), _valid_amounts)),
+        (ColNames.CARD_AMOUNT, _per_distinct(column(ColNames.CARD_AMOUNT), _valid_amounts)),
+    ]
+
+    # Join the names of the failed columns of each row, in check order
+    errors = np.full(len(df), '', dtype=object)
+    for field, valid in checks:
+        errors = errors + np.where(valid, '', field.name + ',').astype(object)
+    failed = errors != ''
+    if failed.any():
+        errors[failed] = [e[:-1] for e in errors[failed]]
+        df[ColNames.VALIDATION_ERRORS.name] = errors
+        for row_id, error_cols in zip(column(ColNames.ROW)[failed], errors[failed]):
+            msg[f'row {row_id}'] = {
                 'failed_columns': error_cols
             }
-        i += 1
 
-    # Regularize the following values:
-    df[intake_db_columns['Submission date'][is_db]] = df[intake_db_columns['Submission date'][is_db]].apply(
-        lambda x: x.strftime('%m/%d/%y') if isinstance(x, datetime) else x
-    )
+    # Regularize the following values, once per distinct value:
+    df[intake_db_columns['Submission date'][is_db]] = _map_distinct(
+        df[intake_db_columns['Submission date'][is_db]], _format_date)
     # Facility Address
-    df[intake_db_columns['Facility Address'][is_db]] = df[intake_db_columns['Facility Address'][is_db]].str.title()
+    df[intake_db_columns['Facility Address'][is_db]] = _str_distinct(
+        df[intake_db_columns['Facility Address'][is_db]], 'title')
     # Suite number
-    df[intake_db_columns['Facility Suite #'][is_db]] = df[intake_db_columns['Facility Suite #'][is_db]].str.strip()
+    df[intake_db_columns['Facility Suite #'][is_db]] = _str_distinct(
+        df[intake_db_columns['Facility Suite #'][is_db]], 'strip')
     # MRL
-    df[intake_db_columns['MRL'][is_db]] = df[intake_db_columns['MRL'][is_db]].str.strip()
+    df[intake_db_columns['MRL'][is_db]] = _str_distinct(df[intake_db_columns['MRL'][is_db]], 'strip')
     # Phone numbers
-    df[intake_db_columns['Phone'][is_db]] = df[intake_db_columns['Phone'][is_db]].apply(replacePhoneNumber)
+    df[intake_db_columns['Phone'][is_db]] = _map_distinct(
+        df[intake_db_columns['Phone'][is_db]], replacePhoneNumber)
     # Endorsement types
-    df[intake_db_columns['Endorse Type'][is_db]] = df[intake_db_columns['Endorse Type'][is_db]].apply(
-        lambda x: str(x).strip())
+    df[intake_db_columns['Endorse Type'][is_db]] = _map_distinct(
+        df[intake_db_columns['Endorse Type'][is_db]], lambda x: str(x).strip())
 
     # If dictionary is empty
     if not msg:
         return True, None
 
     return False, msg
+
+
+@lru_cache(maxsize=4096)
+def _parse_date_text(x, date_format):
+    try:
+        datetime.strptime(x, date_format)
+        return True
+    except ValueError:
+        # pandas accepts a few strings strptime doesn't
+        return validate_date(x, date_format)
+
+
+def _row_valid_date(x, date_format):
+    if isinstance(x, str):
+        # spreadsheets and clients repeat the same few dates, so each is parsed once
+        return _parse_date_text(x, date_format)
+    # dates read back from the typed submission_date column are valid by construction
+    if isinstance(x, date) or x is None:
+        return True
+    return validate_date(x, date_format)
+
+
+def _row_valid_zip(x):
+    if isinstance(x, str):
+        if non_ascii_or_underscore_pattern.search(x):
+            return validate_zip(x)
+        return zip_pattern.match(x) is not None
+    if isinstance(x, float):
+        return math.isfinite(x) and 0 <= math.trunc(x) < 100000
+    try:
+        return validate_zip(x)
+    except (TypeError, OverflowError):
+        return False
+
+
+def _row_valid_mrl(x):
+    if isinstance(x, str):
+        m = x.upper().split('-', 1)[0]
+        return m[0:3] == 'MRL' and m[3:].isdigit() and m not in seen_mrls
+    return x is not None and x == x and validate_mrl(x)
+
+
+def _row_valid_phone(x):
+    if isinstance(x, str):
+        if non_ascii_pattern.search(x):
+            return validatePhoneNumber(x)
+        return sum(c.isdigit() for c in x) == 10
+    return x is not None and x == x and validatePhoneNumber(x)
+
+
+def _row_valid_endorsement(x):
+    s = str(x).upper().strip()
+    return len(s) == 0 or s == 'NAN' or (endorsement_list_pattern.match(s) is not None
+                                         and endorsement_repeat_pattern.match(s) is None)
+
+
+def _row_valid_amount(x):
+    s = str(x)
+    if len(s) == 0 or s.upper() == 'NAN' or s == 'None':
+        return True
+    digits = s[1:] if s[0] == '$' else s
+    digits = digits.replace(',', '').replace('.', '')
+    if non_ascii_pattern.search(digits):
+        return validate_monetary_amount(x)
+    return non_negative_int_pattern.match(digits) is not None
+
+
+# The checks of validate_intake, one value at a time, in the same order. The date check is bound to a date format
+# when the rules are compiled.
+intake_row_rules = [
+    (ColNames.SUBMISSION_DATE, _row_valid_date),
+    (ColNames.FACILITY_ZIP, _row_valid_zip),
+    (ColNames.MRL, _row_valid_mrl),
+    (ColNames.NEIGHBORHOOD_ASSOCIATION, lambda x: isinstance(x, str) and x in valid_neighborhoods_set),
+    (ColNames.COMPLIANCE_REGION, lambda x: isinstance(x, str) and x in valid_compliance_regions_set),
+    (ColNames.EMAIL, lambda x: isinstance(x, str) and email_pattern.match(x) is not None),
+    (ColNames.PHONE, _row_valid_phone),
+    (ColNames.ENDORSE_TYPE, _row_valid_endorsement),
+    (ColNames.LICENSE_TYPE, lambda x: license_list_pattern.match(str(x)) is not None),
+    (ColNames.RECEIPT_NUM, lambda x: str(x).isdigit()),
+    (ColNames.CASH_AMOUNT, _row_valid_amount),
+    (ColNames.CHECK_AMOUNT, _row_valid_amount),
+    (ColNames.CARD_AMOUNT, _row_valid_amount),
+]
+
+
+class IntakeRowValidator:
+    """
+    Validates single intake rows with the rules of validate_intake, without building a DataFrame. The rules are
+    compiled once into a tuple of (position, column name, check) triples, so validating a row is a loop of plain
+    function calls over its values.
+    """
+
+    def __init__(self, is_db=0):
+        """
+        Args:
+            is_db (int): 1 for rows that came from the database rather than a spreadsheet or a client
+        """
+        date_format = '%Y-%m-%d' if is_db else '%m/%d/%y'
+        self.rules = tuple(
+            (field.value, field.name, partial(check, date_format=date_format) if check is _row_valid_date else check)
+            for field, check in intake_row_rules)
+
+    def validate(self, values):
+        """
+        Args:
+            values ([]): the row's values, in intake table order starting with the row number
+        Returns ((bool, dict)): whether the row is valid, and its failed columns if it is not
+        """
+        failed = [name for i, name, check in self.rules if not check(values[i])]
+        if not failed:
+            return True, None
+        return False, {f'row {values[ColNames.ROW.value]}': {'failed_columns': ','.join(failed)}}
+
+    def validate_record(self, record, row=999):
+        """
+        Args:
+            record ({}): the row as a JSON object keyed by intake_headers, as sent to PUT /load
+            row (int): row number to report failures under if the record has none
+        Returns ((bool, dict)): whether the row is valid, and its failed columns if it is not
+        """
+        return self.validate([record.get('row', row)] + [record.get(header) for header in intake_headers])
+
+
+row_validators = {0: IntakeRowValidator(0), 1: IntakeRowValidator(1)}
+
+
+def validate_intake_row(values, is_db=0):
+    """
+    Validates a single intake row with the same checks as validate_intake, without building a DataFrame. Suited to
+    checking one row at a time, e.g. an updated row read back from the database.
+    Args:
+        values ([]): the row's values, in intake table order starting with the row number
+        is_db (int): 1 if the row came from the database rather than a spreadsheet
+    Returns ((bool, dict)): whether the row is valid, and its failed columns if it is not
+    """
+    return row_validators[is_db].validate(values)
+
+
+def validate_intake_record(record):
+    """
+    Validates an intake row sent as a JSON object keyed by intake_headers, e.g. to PUT /load.
+    Args:
+        record ({}): the row
+    Returns ((bool, dict)): whether the row is valid, and its failed columns if it is not
+    """
+    return row_validators[0].validate_record(record)
@@ -0,0 +1,111 @@
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from .metrics import metrics
+
+# rows in each row group of an exported Parquet file
+parquet_row_group_size = 50000
+
+# Postgres type OIDs and the Arrow types their values are written as; other types are written as text
+_arrow_types = {
+    16: 'bool_',
+    20: 'int64',
+    21: 'int16',
+    23: 'int32',
+    700: 'float32',
+    701: 'float64',
+    1082: 'date32',
+}
+
+
+def parquet_available():
+    """
+    Returns (bool): whether pyarrow is installed, which writing Parquet requires
+    """
+    return pq is not None
+
+
+def arrow_type(column):
+    """
+    Picks the Arrow type a result column is written as.
+    Args:
+        column (psycopg2.extensions.Column): the column, from a cursor description
+    Returns (pyarrow.DataType): the type
+    """
+    if column.type_code in _arrow_types:
+        return getattr(pa, _arrow_types[column.type_code])()
+    if column.type_code == 1700 and column.precision:
+        return pa.decimal128(column.precision, column.scale or 0)
+    if column.type_code == 1114:
+        return pa.timestamp('us')
+    if column.type_code == 1184:
+        return pa.timestamp('us', tz='UTC')
+    return pa.string()
+
+
+class _ParquetSink:
+    """
+    Write-only file object that pyarrow writes a Parquet file into, and from which the written bytes are taken
+    after each row group.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self._parts = []
+        self._position = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def writable(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        """
+        Returns (bytes): what was written since the last call
+        """
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def parquet_chunks(description, chunks):
+    """
+    Encodes streamed query results as a Parquet file, one row group per chunk of rows.
+    Args:
+        description (tuple): cursor description of the result columns, as returned by driver.stream_query
+        chunks (generator): lists of row tuples
+    Returns (generator): bytes pieces of the Parquet file
+    """
+    types = [arrow_type(column) for column in description]
+    schema = pa.schema([pa.field(column.name, t) for column, t in zip(description, types)])
+    text = [t == pa.string() for t in types]
+    sink = _ParquetSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in chunks:
+            with metrics.timer('serialize'):
+                arrays = []
+                for i, values in enumerate(zip(*rows)):
+                    if text[i]:
+                        values = [None if v is None else str(v) for v in values]
+                    arrays.append(pa.array(values, type=types[i]))
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
@@ -0,0 +1,10 @@
+"""
+Entry point of the production server, which serves the app with several gunicorn worker processes:
+    gunicorn -c gunicorn.conf.py wsgi:app
+The app is created once, in the gunicorn master, and the workers inherit it when they fork. Unfinished uploads are
+resumed by a worker (see gunicorn.conf.py) rather than here, so that they are not resumed once per worker.
+app.py runs the development server instead.
+"""
+from kanabi.configure import create_app
+
+app = create_app(resume_jobs=False)